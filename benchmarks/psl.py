@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+
+import argparse
+import os
+import random
+import sys
+import time
+import timeit
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import publicsuffix  # noqa
+
+from utils import psl  # noqa
+
+
+###
+# How fast base domains can be looked up with the compiled Public Suffix
+# List (utils/psl.py), compared to the publicsuffix package it replaced:
+#
+#   python benchmarks/psl.py [--list public_suffix_list.dat] [--hostnames 100000]
+#
+# Lookups are timed for hostnames made up from real rules, both all
+# different ("cold", which the lookup cache can't help with) and the same
+# few thousand again and again ("repeated", like a scan writing rows).
+###
+
+
+def hostnames(lines, count, seed=0):
+    rules = [
+        line.strip().split()[0].lstrip("!").replace("*", "w") for line in lines
+        if line.strip() and not line.startswith("//")
+    ]
+    chooser = random.Random(seed)
+    return [
+        ".".join(["h%i" % i] * chooser.randint(1, 3) + [chooser.choice(rules)])
+        for i in range(count)
+    ]
+
+
+def rate(lookup, names):
+    started = time.perf_counter()
+    for name in names:
+        lookup(name)
+    return len(names) / (time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark Public Suffix List lookups.")
+    parser.add_argument("--list", default=os.path.join(
+        os.path.dirname(publicsuffix.__file__), "public_suffix_list.dat"))
+    parser.add_argument("--hostnames", type=int, default=100000)
+    options = parser.parse_args()
+
+    with open(options.list, encoding="utf-8") as psl_file:
+        lines = psl_file.readlines()
+
+    cold = hostnames(lines, options.hostnames)
+    repeated = hostnames(lines, 2000) * (options.hostnames // 2000)
+
+    print("Loading the list:")
+    print("  publicsuffix:    %8.1f ms" % (1000 * min(timeit.repeat(
+        lambda: publicsuffix.PublicSuffixList(lines), number=1, repeat=5))))
+    print("  compile trie:    %8.1f ms" % (1000 * min(timeit.repeat(
+        lambda: psl.SuffixTrie.from_lines(lines), number=1, repeat=5))))
+    compiled = os.path.join(os.path.dirname(os.path.abspath(options.list)), ".psl-benchmark.trie")
+    try:
+        psl.load(lines, compiled)
+        print("  load compiled:   %8.1f ms" % (1000 * min(timeit.repeat(
+            lambda: psl.load(lines, compiled), number=1, repeat=5))))
+    finally:
+        if os.path.exists(compiled):
+            os.remove(compiled)
+
+    print("Lookups per second:")
+    expected = publicsuffix.PublicSuffixList(lines)
+    for label, names in (("cold", cold), ("repeated", repeated)):
+        trie = psl.SuffixTrie.from_lines(lines)
+        print("  %-9s publicsuffix: %10.0f  trie: %10.0f" % (
+            label, rate(expected.get_public_suffix, names), rate(trie.get_public_suffix, names)))
+
+
+if __name__ == '__main__':
+    main()
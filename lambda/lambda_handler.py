@@ -2,12 +2,16 @@ import importlib
 import sys
 import logging
 
-from utils import utils
+from utils import payloads, utils
 
 # Central handler for all Lambda events.
 def handler(event, context):
     start_time = utils.local_now()
 
+    # With --lambda-compress, the event is gzipped, and so is the response.
+    compress = payloads.wrapped(event)
+    event = payloads.unwrap(event)
+
     domain = event.get('domain')
     options = event.get('options')
     name = event.get('scanner')
@@ -25,28 +29,60 @@ def handler(event, context):
         logging.error("[%s] Scanner not found, or had an error during loading.\n\tERROR: %s\n\t%s" % (name, exc_type, exc_value))
         exit(1) # ?
 
+    # A batch of domains, all for the same scanner, scanned one after the
+    # other in this (warm) process. Each gets its own result, and an
+    # exception scanning one doesn't stop the rest.
+    if event.get('domains') is not None:
+        results = []
+        for item in event['domains']:
+            item_start_time = utils.local_now()
+            try:
+                results.append(scan_domain(scanner, item['domain'], item['environment'],
+                                           options, context, item_start_time))
+            except Exception:
+                results.append({
+                    'lambda': lambda_details(context, item_start_time, utils.local_now()),
+                    'data': None,
+                    'error': utils.format_last_exception()
+                })
+        return respond({'results': results}, compress)
+
+    response = scan_domain(scanner, domain, environment, options, context, start_time)
+    return respond(response, compress)
+
+
+# Serialize and re-parse the JSON, so that we run our own
+# date transform functions in one place, before Amazon's built-in
+# JSON serialization prepares the data for transport.
+def respond(response, compress):
+    content = payloads.dumps(response)
+    if compress:
+        return payloads.wrap(content.encode('utf-8'))
+    return utils.from_json(content)
+
+
+def scan_domain(scanner, domain, environment, options, context, start_time=None):
+    start_time = start_time or utils.local_now()
+
     # Same method call as when run locally.
     data = scanner.scan(domain, environment, options)
 
     # We capture start and end times locally as well, but it's
     # useful to know the start/end from Lambda's vantage point.
     end_time = utils.local_now()
-    duration = end_time - start_time
-    response = {
-        'lambda': {
-            'log_group_name': context.log_group_name,
-            'log_stream_name': context.log_stream_name,
-            'request_id': context.aws_request_id,
-            'memory_limit': context.memory_limit_in_mb,
-            'start_time': start_time,
-            'end_time': end_time,
-            'measured_duration': duration
-        },
+    return {
+        'lambda': lambda_details(context, start_time, end_time),
         'data': data
     }
 
-    # Serialize and re-parse the JSON, so that we run our own
-    # date transform functions in one place, before Amazon's built-in
-    # JSON serialization prepares the data for transport.
-    return utils.from_json(utils.json_for(response))
 
+def lambda_details(context, start_time, end_time):
+    return {
+        'log_group_name': context.log_group_name,
+        'log_stream_name': context.log_stream_name,
+        'request_id': context.aws_request_id,
+        'memory_limit': context.memory_limit_in_mb,
+        'start_time': start_time,
+        'end_time': end_time,
+        'measured_duration': end_time - start_time
+    }
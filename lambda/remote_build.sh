@@ -60,7 +60,7 @@ cd build
 VENV=scan-env
 
 # Copy in a snapshot of the public suffix list in .txt form.
-# Need to find a more managed way to store this.
+# ./lambda/deploy packages the locally cached list instead, if there is one.
 wget -O ./public-suffix-list.txt \
      https://publicsuffix.org/list/public_suffix_list.dat
 
@@ -10,6 +10,11 @@ from utils import utils
 workers = 3
 pa11y = os.environ.get("PA11Y_PATH", "pa11y")
 
+# pa11y gives up on a page itself after 5 minutes, but can still hang.
+scan_timeout = 10 * 60
+
+dependencies = ["pshtt"]
+
 redirects = {}
 config = ""
 
@@ -1,6 +1,6 @@
 import logging
 import requests
-from scanners import utils
+from utils import utils
 
 ###
 # CSP Scanner - check the presence of CSP headers
@@ -11,6 +11,9 @@ from scanners import utils
 # Overridden by a --workers flag.
 workers = 2
 
+# init_domain skips dead and redirecting domains, from pshtt's data.
+dependencies = ["pshtt"]
+
 
 # default to a custom user agent, can be overridden
 user_agent = "github.com/18f/domain-scan, csp.py"
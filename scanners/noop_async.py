@@ -0,0 +1,55 @@
+import asyncio
+import logging
+
+###
+# Testing scan function, like noop, but with an `async def scan`.
+# Async scanners are run as coroutines on an event loop instead of in
+# worker threads, so they can keep many more domains in flight at once.
+
+
+# Optional one-time initialization for all scans. (Same as noop.)
+#
+# Run locally.
+def init(environment: dict, options: dict) -> dict:
+    logging.debug("Init function.")
+    return {'constant': 12345}
+
+
+# Optional one-time initialization per-scan. Always a plain function,
+# run in a thread so it can't hold up the event loop.
+#
+# Run locally.
+def init_domain(domain: str, environment: dict, options: dict) -> dict:
+    logging.debug("Init function for %s." % domain)
+    return {'variable': domain}
+
+
+# Required scan function, as a coroutine. Anything slow should be
+# awaited (network calls, sleeps, subprocesses), never blocked on.
+#
+# Runs locally (or, with --lambda, the same as a regular scanner).
+async def scan(domain: str, environment: dict, options: dict) -> dict:
+    logging.debug("Scan function called with options: %s" % options)
+
+    # Perform the "task".
+    await asyncio.sleep(0)
+    logging.warning("Complete!")
+
+    return {
+        'complete': True,
+        'constant': environment.get('constant'),
+        'variable': environment.get('variable')
+    }
+
+
+# Required CSV row conversion function. Usually one row, can be more.
+#
+# Run locally.
+def to_rows(data):
+    return [
+        [data['complete'], data['constant'], data['variable']]
+    ]
+
+
+# CSV headers for each row of data. Referenced locally.
+headers = ["Completed", "Constant", "Variable"]
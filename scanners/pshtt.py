@@ -4,7 +4,7 @@ import os
 import re
 
 from pshtt import pshtt
-from utils import utils
+from utils import reference, utils
 
 ###
 # Measure a site's HTTP behavior using DHS NCATS' pshtt tool.
@@ -23,48 +23,47 @@ suffix_list = None
 lambda_support = True
 lambda_suffix_path = "./cache/public-suffix-list.txt"
 
+# All that's sent to Lambda for each domain (see init_domain).
+lambda_option_keys = ["ca_file", "pt_int_ca_file"]
+lambda_environment_keys = ["preload_list", "preload_pending"]
 
-# Download third party data once, at the top of the scan.
+
+# Load third party data once, at the top of the scan. It's cached in
+# the cache directory, and only downloaded again once it's out of date
+# (see utils/reference.py).
 def init(environment, options):
-    logging.warning("[pshtt] Downloading third party data...")
+    logging.warning("[pshtt] Loading third party data...")
+    cache_dir = options.get("_", {}).get("cache_dir", "./cache")
 
-    # In local environments, download latest PSL, cache in-memory.
+    # In local environments, use the cached PSL, cache in-memory.
     if environment['scan_method'] == "local":
-        instance, suffix_list = pshtt.load_suffix_list()
+        discard, suffix_list = utils.load_suffix_list(cache_dir=cache_dir)
 
     # In the cloud, we'll use a PSL snapshot instead of fresh data.
     # Not worth the network transit on my end or the PSL's.
     else:
         suffix_list = None
 
+    preload_list = reference.load(reference.HSTS_PRELOAD_LIST, cache_dir=cache_dir)
+    preload_pending = reference.load(reference.HSTS_PRELOAD_PENDING, cache_dir=cache_dir)
+
+    # Indexed once here, and shared (read-only) by every domain's scan.
     return {
-        'preload_list': pshtt.load_preload_list(),
-        'preload_pending': pshtt.load_preload_pending(),
+        'preload_list': utils.preload_index(preload_list),
+        'preload_pending': utils.preload_index(preload_pending),
         'suffix_list': suffix_list
     }
 
 
 # To save on bandwidth to Lambda, slice the preload and pending lists
-# down to an array of just the domain and its base domain, if they
-# exist.  Override the list in place, which should only modify it
-# per-scan.
+# down to an array of just the domain and any of its parent domains
+# (including its base domain) that are on them. Setting them on the
+# environment only changes them for this domain.
 def init_domain(domain, environment, options):
-    cache_dir = options.get("_", {}).get("cache_dir", "./cache")
-    base_domain = utils.base_domain_for(domain, cache_dir=cache_dir)
-
-    preload_list = []
-    if domain in environment.get("preload_list", []):
-        preload_list.append(domain)
-    if base_domain != domain and base_domain in environment.get("preload_list", []):
-        preload_list.append(base_domain)
-    environment["preload_list"] = preload_list
-
-    preload_pending = []
-    if domain in environment.get("preload_pending", []):
-        preload_pending.append(domain)
-    if base_domain != domain and base_domain in environment.get("preload_pending", []):
-        preload_pending.append(base_domain)
-    environment["preload_pending"] = preload_pending
+    environment["preload_list"] = utils.preloaded_names(
+        domain, environment.get("preload_list", frozenset()))
+    environment["preload_pending"] = utils.preloaded_names(
+        domain, environment.get("preload_pending", frozenset()))
 
     return environment
 
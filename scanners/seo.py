@@ -117,14 +117,14 @@ def scan(domain: str, environment: dict, options: dict) -> dict:
     additional_urls = 0
     for loc in sitemap_results['sitemap_locations_from_index']:
         if loc != sitemap_results['final_url']:
-            sitemap = requests.get(loc)
+            sitemap = requests.get(loc, timeout=4)
             if sitemap.status_code == HTTPStatus.OK:
                 soup = BeautifulSoup(sitemap.text, 'xml')
                 additional_urls += len(soup.find_all('url'))
 
     for loc in sitemap_results['sitemap_locations_from_robotstxt']:
         if loc != sitemap_results['final_url']:
-            sitemap = requests.get(loc)
+            sitemap = requests.get(loc, timeout=4)
             if sitemap.status_code == HTTPStatus.OK:
                 soup = BeautifulSoup(sitemap.text, 'xml')
                 additional_urls += len(soup.find_all('url'))
@@ -39,6 +39,17 @@ network_timeout = 5
 # Advertise Lambda support
 lambda_support = True
 
+# All that's sent to Lambda for each domain.
+lambda_option_keys = [
+    "network_timeout", "ca_file", "sslyze_certs", "sslyze_reneg",
+    "sslyze-certs", "sslyze-reneg"
+]
+lambda_environment_keys = ["hosts_to_scan", "cached_data"]
+
+# Run after pshtt and trustymail on each domain when they are selected,
+# so that their cached results are available to init_domain below.
+dependencies = ["pshtt", "trustymail"]
+
 # File with custom root and intermediate certs that should be trusted
 # for verifying the cert chain
 CA_FILE = None
@@ -21,6 +21,13 @@ default_smtp_ports = '25,465,587'
 # Advertise lambda support
 lambda_support = True
 
+# All that's sent to Lambda for each domain.
+lambda_option_keys = [
+    "timeout", "smtp_timeout", "smtp_localhost", "smtp_ports", "dns",
+    "mx", "starttls", "spf", "dmarc", "no_smtp_cache"
+]
+lambda_environment_keys = ["cached_data"]
+
 
 # Check the fastcache to determine if we have already tested any of
 # the mail servers when scanning other domains.
@@ -11,13 +11,15 @@ lambda_support = True
 # The scan method will be defined in third_parties.js instead.
 scan_headless = True
 
+dependencies = ["pshtt"]
+
 
 # Use pshtt data if we have it, to either skip redirect/inactive
 # domains, or to start with the canonical URL right away.
 def init_domain(domain, environment, options):
     cache_dir = options.get("_", {}).get("cache_dir", "./cache")
     # If we have data from pshtt, skip if it's not a live domain.
-    if utils.domain_not_live(domain):
+    if utils.domain_not_live(domain, cache_dir=cache_dir):
         logging.debug("\tSkipping, domain not reachable during inspection.")
         return False
 
@@ -0,0 +1,181 @@
+import gzip
+import json
+import os
+
+import pytest
+
+from .context import utils  # noqa
+from utils import cache, scan_utils
+from utils import utils as subutils
+
+
+BACKENDS = [cache.FileCache, cache.FanoutCache, cache.SQLiteCache]
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_cache_round_trip(tmpdir, backend):
+    scan_cache = backend(str(tmpdir))
+    assert scan_cache.get("pshtt", "a.gov") is None
+    assert scan_cache.read("pshtt", "a.gov") == (False, None)
+
+    scan_cache.put("pshtt", "a.gov", {"Live": True, "Errors": ["x"]})
+    scan_cache.put("pshtt", "b.gov", None)
+
+    data, written = scan_cache.get("pshtt", "a.gov")
+    assert data == {"Live": True, "Errors": ["x"]}
+    assert written > 0
+    assert scan_cache.read("pshtt", "a.gov") == (True, {"Live": True, "Errors": ["x"]})
+    # A cached failed scan.
+    assert scan_cache.read("pshtt", "b.gov") == (True, None)
+    assert scan_cache.read("sslyze", "a.gov") == (False, None)
+    scan_cache.close()
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_cache_ttls(tmpdir, backend):
+    scan_cache = backend(str(tmpdir))
+    scan_cache.put("pshtt", "a.gov", {"ok": True})
+    scan_cache.put("pshtt", "b.gov", None)
+    later = scan_utils.time.time() + 2 * 60 * 60
+
+    ttls = {"pshtt": 24 * 60 * 60, "invalid": 60 * 60}
+    assert scan_cache.read("pshtt", "a.gov", ttls, now=later) == (True, {"ok": True})
+    assert scan_cache.read("pshtt", "b.gov", ttls, now=later) == (False, None)
+    assert scan_cache.read("pshtt", "a.gov", {"*": 60}, now=later) == (False, None)
+
+
+@pytest.mark.xfail(raises=TypeError)
+def test_incomplete_backend():
+    class ReadOnlyCache(cache.Cache):
+        def get(self, name, domain):
+            return None
+
+    ReadOnlyCache()
+
+
+def test_file_cache_layout(tmpdir):
+    cache.FileCache(str(tmpdir)).put("pshtt", "a.gov", {"ok": True})
+    path = tmpdir.join("pshtt", "a.gov.json")
+    assert path.read() == scan_utils.json_for({"ok": True})
+
+
+def test_fanout_cache_layout(tmpdir):
+    fanout = cache.FanoutCache(str(tmpdir))
+    fanout.put("pshtt", "a.gov", {"ok": True})
+
+    path = fanout.path("pshtt", "a.gov")
+    parts = os.path.relpath(path, str(tmpdir)).split(os.sep)
+    assert parts[0] == "pshtt"
+    assert [len(part) for part in parts[1:3]] == [2, 2]
+    assert parts[3] == "a.gov.json.gz"
+    with gzip.open(path, 'rb') as cached:
+        assert json.loads(cached.read().decode("utf-8")) == {"ok": True}
+
+
+def test_fanout_cache_reads_files_layout(tmpdir):
+    cache.FileCache(str(tmpdir)).put("pshtt", "a.gov", {"old": True})
+    assert cache.FanoutCache(str(tmpdir)).read("pshtt", "a.gov") == (True, {"old": True})
+
+
+def test_data_for_uses_configured_backend(tmpdir):
+    cache_dir = str(tmpdir)
+    cache.cache_for(cache_dir, "sqlite").put("pshtt", "a.gov", {"Live": True})
+    cache.cache_for(cache_dir).put("pshtt", "b.gov", None)
+
+    assert scan_utils.data_for("a.gov", "pshtt", cache_dir=cache_dir) == {"Live": True}
+    assert scan_utils.data_for("b.gov", "pshtt", cache_dir=cache_dir) is None
+    assert scan_utils.data_for("c.gov", "pshtt", cache_dir=cache_dir) == {}
+    assert not tmpdir.join("pshtt").exists()
+
+    # Switching back.
+    assert isinstance(cache.cache_for(cache_dir, "files"), cache.FileCache)
+    assert scan_utils.data_for("a.gov", "pshtt", cache_dir=cache_dir) == {}
+
+
+def test_cache_for_switches_from_fanout_to_files(tmpdir):
+    cache_dir = str(tmpdir)
+    assert type(cache.cache_for(cache_dir, "fanout")) is cache.FanoutCache
+    # A FanoutCache is a FileCache, but not the files layout.
+    assert type(cache.cache_for(cache_dir, "files")) is cache.FileCache
+    cache.cache_for(cache_dir).put("pshtt", "a.gov", {"Live": True})
+    assert tmpdir.join("pshtt", "a.gov.json").exists()
+
+
+PSHTT = {
+    "Live": True,
+    "Redirect": False,
+    "Canonical URL": "https://www.a.gov",
+    "endpoints": {"https": {"live": False}, "httpswww": {"live": True}},
+}
+
+
+class CountingCache(cache.FileCache):
+    def __init__(self, cache_dir):
+        super().__init__(cache_dir)
+        self.gets = 0
+
+    def get(self, name, domain):
+        self.gets += 1
+        return super().get(name, domain)
+
+
+def test_summary_reads_each_domain_once(tmpdir):
+    cache.FileCache(str(tmpdir)).put("pshtt", "a.gov", PSHTT)
+    counting = CountingCache(str(tmpdir))
+
+    for _ in range(4):
+        assert counting.summary("pshtt", "a.gov") == cache.PshttSummary(
+            True, False, "https://www.a.gov", True)
+    assert counting.gets == 1
+
+    # Missing data isn't remembered, in case it's scanned later.
+    assert counting.summary("pshtt", "b.gov") is None
+    counting.put("pshtt", "b.gov", None)
+    assert counting.summary("pshtt", "b.gov") is None
+    counting.put("pshtt", "b.gov", dict(PSHTT, Live=False))
+    assert counting.summary("pshtt", "b.gov").live is False
+    assert counting.gets == 2
+
+
+def test_summaries_stay_bounded(tmpdir):
+    counting = CountingCache(str(tmpdir))
+    counting.max_summaries = 3
+    for i in range(10):
+        counting.put("pshtt", "%i.gov" % i, PSHTT)
+    assert list(counting.summaries["pshtt"]) == ["7.gov", "8.gov", "9.gov"]
+
+    # The most recently used are kept; the rest are read again.
+    counting.summary("pshtt", "7.gov")
+    counting.summary("pshtt", "0.gov")
+    assert counting.gets == 1
+    assert list(counting.summaries["pshtt"]) == ["9.gov", "7.gov", "0.gov"]
+    assert counting.summary("pshtt", "0.gov").live is True
+
+
+def test_helpers_use_index(tmpdir):
+    cache_dir = str(tmpdir)
+    scan_cache = cache.cache_for(cache_dir, "files")
+    scan_cache.put("pshtt", "a.gov", PSHTT)
+    scan_cache.put("pshtt", "b.gov", None)
+    scan_cache.put("trustymail", "a.gov", {
+        "Domain Supports STARTTLS Results": "mx1.a.gov:25, mx2.a.gov:25"})
+
+    # Answered from memory, even once the files are gone.
+    tmpdir.join("pshtt").remove()
+    tmpdir.join("trustymail").remove()
+
+    assert subutils.domain_not_live("a.gov", cache_dir=cache_dir) is False
+    assert subutils.domain_is_redirect("a.gov", cache_dir=cache_dir) is False
+    assert subutils.domain_canonical("a.gov", cache_dir=cache_dir) == "https://www.a.gov"
+    assert subutils.domain_uses_www("a.gov", cache_dir=cache_dir) is True
+    assert subutils.domain_doesnt_support_https("a.gov", cache_dir=cache_dir) is False
+    assert subutils.domain_mail_servers_that_support_starttls(
+        "a.gov", cache_dir=cache_dir) == ["mx1.a.gov:25", "mx2.a.gov:25"]
+
+    # A failed scan, and one that never happened, tell us nothing.
+    for domain in ("b.gov", "c.gov"):
+        assert subutils.domain_not_live(domain, cache_dir=cache_dir) is False
+        assert subutils.domain_canonical(domain, cache_dir=cache_dir) is False
+        assert subutils.domain_doesnt_support_https(domain, cache_dir=cache_dir) is False
+        assert subutils.domain_mail_servers_that_support_starttls(
+            domain, cache_dir=cache_dir) == []
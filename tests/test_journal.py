@@ -0,0 +1,121 @@
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+from .context import utils  # noqa
+from utils import scan_utils, sinks
+from utils.journal import Journal, load_journal
+
+
+def test_journal_round_trip(tmpdir):
+    path = str(tmpdir.join("scan.journal"))
+    journal = Journal(path)
+    journal.record([("pshtt", "a.gov"), ("pshtt", "b.gov")], {"pshtt": 100, "sslyze": 20})
+    journal.record([("sslyze", "a.gov")], {"sslyze": 50})
+    journal.close()
+
+    done, offsets = load_journal(path)
+    assert done == {("pshtt", "a.gov"), ("pshtt", "b.gov"), ("sslyze", "a.gov")}
+    assert offsets == {"pshtt": 100, "sslyze": 50}
+
+
+def test_journal_drops_incomplete_checkpoint(tmpdir):
+    path = str(tmpdir.join("scan.journal"))
+    journal = Journal(path)
+    journal.record([("pshtt", "a.gov")], {"pshtt": 100})
+    journal.close()
+    with open(path, 'a') as f:
+        f.write('{"done": [["pshtt", "b.')
+
+    done, offsets = load_journal(path)
+    assert done == {("pshtt", "a.gov")}
+
+    # New checkpoints go after the last complete one.
+    journal = Journal(path)
+    journal.record([("pshtt", "c.gov")], {"pshtt": 200})
+    journal.close()
+    done, offsets = load_journal(path)
+    assert done == {("pshtt", "a.gov"), ("pshtt", "c.gov")}
+    assert offsets == {"pshtt": 200}
+
+
+def test_load_missing_journal(tmpdir):
+    assert load_journal(str(tmpdir.join("scan.journal"))) == (set(), {})
+
+
+def test_prepare_results_resume(tmpdir):
+    results_dir = str(tmpdir)
+    tmpdir.join("pshtt.csv").write("Domain\na.gov\nb.gov\n")
+    tmpdir.join("sslyze.csv").write("Domain\nx.gov\n")
+    journal = Journal(scan_utils.journal_path(results_dir))
+    journal.record([("pshtt", "a.gov")], {"pshtt": len("Domain\na.gov\n")})
+    journal.close()
+
+    done = scan_utils.prepare_results(results_dir, ["pshtt", "sslyze"], resume=True)
+
+    assert done == {("pshtt", "a.gov")}
+    # b.gov's row never made it into the journal, so it's cut off.
+    assert tmpdir.join("pshtt.csv").read() == "Domain\na.gov\n"
+    assert not tmpdir.join("sslyze.csv").exists()
+
+
+def test_prepare_results_fresh(tmpdir):
+    results_dir = str(tmpdir)
+    tmpdir.join("pshtt.csv").write("Domain\na.gov\n")
+    journal = Journal(scan_utils.journal_path(results_dir))
+    journal.record([("pshtt", "a.gov")], {"pshtt": 13})
+    journal.close()
+
+    assert scan_utils.prepare_results(results_dir, ["pshtt"]) == set()
+    assert not tmpdir.join("pshtt.csv").exists()
+    assert not os.path.exists(scan_utils.journal_path(results_dir))
+
+
+# Writes a.gov and b.gov, checkpoints them, writes c.gov, and dies.
+CRASHING_PARQUET_SCAN = """
+import os
+from utils import sinks
+from utils.journal import Journal
+
+results_dir = %r
+sink = sinks.ParquetSink(os.path.join(results_dir, "x.parquet"), ["Domain"])
+journal = Journal(os.path.join(results_dir, "scan.journal"))
+sink.writerows([["a.gov"], ["b.gov"]])
+journal.record([("x", "a.gov"), ("x", "b.gov")], {"x": sink.checkpoint()})
+sink.writerows([["c.gov"]])
+sink.flush()
+os._exit(1)
+"""
+
+
+def test_prepare_results_resume_parquet(tmpdir):
+    pytest.importorskip("pyarrow")
+    import pyarrow.parquet
+
+    results_dir = str(tmpdir)
+    root = str(Path(__file__).resolve().parent.parent)
+    crashed = subprocess.run([sys.executable, "-c", CRASHING_PARQUET_SCAN % results_dir],
+                             cwd=root)
+    assert crashed.returncode == 1
+    assert not tmpdir.join("x.parquet").exists()
+
+    done = scan_utils.prepare_results(results_dir, ["x"], resume=True, output_format="parquet")
+    assert done == {("x", "a.gov"), ("x", "b.gov")}
+
+    # c.gov is scanned again, along with the rest.
+    sink = sinks.ParquetSink(str(tmpdir.join("x.parquet")), ["Domain"], append=True)
+    sink.writerows([["c.gov"], ["d.gov"]])
+    sink.close()
+
+    domains = pyarrow.parquet.read_table(str(tmpdir.join("x.parquet"))).column("Domain")
+    assert domains.to_pylist() == ["a.gov", "b.gov", "c.gov", "d.gov"]
+
+
+def test_prepare_results_resume_parquet_without_checkpoint(tmpdir):
+    tmpdir.join("x.parquet.jsonl").write('{"Domain": "a.gov"}\n')
+    assert scan_utils.prepare_results(
+        str(tmpdir), ["x"], resume=True, output_format="parquet") == set()
+    assert not tmpdir.join("x.parquet.jsonl").exists()
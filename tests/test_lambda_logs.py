@@ -0,0 +1,166 @@
+import csv
+import os
+import subprocess
+import sys
+import threading
+from pathlib import Path
+
+import pytest
+
+from .context import utils  # noqa
+from utils import lambda_logs
+
+
+def report(request_id, duration="10.5 ms", memory="40 MB"):
+    return ("REPORT RequestId: %s\tDuration: %s\tBilled Duration: 100 ms\t"
+            "Memory Size: 128 MB\tMax Memory Used: %s\t\n" % (request_id, duration, memory))
+
+
+class Throttled(Exception):
+    response = {'Error': {'Code': "ThrottlingException"}}
+
+
+class FakeLogs:
+    """Stand-in CloudWatch Logs client: events show up after some calls."""
+
+    def __init__(self, streams, delays=None, throttles=0, page_size=2):
+        self.streams = streams
+        self.delays = delays or {}
+        self.throttles = throttles
+        self.page_size = page_size
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def filter_log_events(self, logGroupName, logStreamNames, filterPattern,
+                          startTime=None, nextToken=None):
+        with self.lock:
+            self.calls.append((logGroupName, logStreamNames[0], nextToken))
+            if self.throttles:
+                self.throttles -= 1
+                raise Throttled()
+            seen = len([c for c in self.calls if c[1] == logStreamNames[0] and not c[2]])
+
+        events = [
+            {'message': report(request_id), 'ingestionTime': 1500000010000}
+            for request_id in self.streams.get(logStreamNames[0], [])
+            if self.delays.get(request_id, 0) < seen
+        ]
+        start = int(nextToken or 0)
+        response = {'events': events[start:start + self.page_size]}
+        if start + self.page_size < len(events):
+            response['nextToken'] = str(start + self.page_size)
+        return response
+
+
+def fetcher(logs, **kwargs):
+    return lambda_logs.LogFetcher(logs, sleep=lambda seconds: None, **kwargs)
+
+
+def test_parse_report():
+    fields = lambda_logs.parse_report(report("abc"))
+    assert fields["RequestId"] == "abc"
+    assert fields["Duration"] == "10.5 ms"
+    assert fields["Max Memory Used"] == "40 MB"
+
+
+def test_fetch_by_stream_with_pages():
+    logs = FakeLogs({'s1': ["a", "b", "c"], 's2': ["d"]})
+    found, errors = fetcher(logs).fetch({
+        ('g', 's1'): ({"a", "b", "c"}, None),
+        ('g', 's2'): ({"d"}, None),
+    })
+    assert sorted(found) == ["a", "b", "c", "d"]
+    assert errors == {}
+    # One request per page, not per request ID.
+    assert len(logs.calls) == 3
+
+
+def test_fetch_polls_until_logs_show_up():
+    logs = FakeLogs({'s1': ["a", "b"]}, delays={"b": 2})
+    found, errors = fetcher(logs, poll_interval=0).fetch({('g', 's1'): ({"a", "b"}, None)})
+    assert sorted(found) == ["a", "b"]
+    assert len(logs.calls) == 3
+
+
+def test_fetch_gives_up_at_deadline():
+    logs = FakeLogs({'s1': ["a"]}, delays={"a": 1000})
+    clock = iter(range(0, 1000, 10))
+    found, errors = lambda_logs.LogFetcher(
+        logs, deadline=30, poll_interval=10, sleep=lambda seconds: None,
+        clock=lambda: next(clock)).fetch({('g', 's1'): ({"a"}, None)})
+    assert found == {}
+    assert errors == {}
+    assert len(logs.calls) == 3
+
+
+def test_fetch_retries_throttling():
+    logs = FakeLogs({'s1': ["a"]}, throttles=2)
+    found, errors = fetcher(logs).fetch({('g', 's1'): ({"a"}, None)})
+    assert list(found) == ["a"]
+
+    logs = FakeLogs({'s1': ["a"]}, throttles=100)
+    found, errors = fetcher(logs, max_retries=3).fetch({('g', 's1'): ({"a"}, None)})
+    assert found == {}
+    assert errors == {('g', 's1'): "Lambda declined, too many requests."}
+    assert len(logs.calls) == 4
+
+
+@pytest.fixture
+def results(tmpdir):
+    path = str(tmpdir.join("pshtt.csv"))
+    with open(path, 'w', encoding='utf-8', newline='') as output:
+        writer = csv.writer(output)
+        writer.writerow(["Domain", "Lambda Request ID", "Lambda Log Group Name",
+                         "Lambda Log Stream Name", "Lambda Start Time", "Lambda End Time"])
+        writer.writerow(["a.gov", "a", "g", "s1", "2017-07-14T02:40:00Z", "2017-07-14T02:40:00Z"])
+        writer.writerow(["b.gov", "b", "g", "s1", "2017-07-14T02:40:01Z", ""])
+        writer.writerow(["c.gov", "c", "g", "s2", "", ""])
+        writer.writerow(["d.gov", "", "", "", "", ""])
+        writer.writerow(["é.gov", "", "", "", "", ""])
+    return path
+
+
+def test_add_details(results):
+    logs = FakeLogs({'s1': ["a", "b"]})
+    headers = ["Duration", "Delay", "Memory", "Errors"]
+
+    def format_row(details):
+        return [details.get('reported_duration'), details.get('log_delay'),
+                details.get('memory_used'), details.get('errors')]
+
+    lambda_logs.add_details(results, logs, headers, format_row,
+                            fetcher=fetcher(logs, deadline=0))
+
+    with open(results, encoding='utf-8', newline='') as written:
+        rows = list(csv.reader(written))
+    assert rows[0][-4:] == headers
+    assert rows[1][0] == "a.gov"
+    assert rows[1][-4:] == ["10.5 ms", "10.0", "40 MB", ""]
+    assert rows[2][-4:] == ["10.5 ms", "", "40 MB", ""]
+    assert rows[3][-1] == "No logs found for this task."
+    assert rows[4][-1] == "No Lambda request ID."
+
+
+# No logs at all, so every row is written back with an error.
+NO_LOGS = """
+from utils import lambda_logs
+
+class Logs:
+    def filter_log_events(self, **arguments):
+        return {'events': []}
+
+lambda_logs.add_details(%r, Logs(), ["Errors"], lambda details: [details['errors']],
+                        fetcher=lambda_logs.LogFetcher(Logs(), deadline=0))
+"""
+
+
+def test_add_details_utf8_whatever_the_locale(results):
+    # In a plain ASCII locale, where files default to ASCII.
+    root = str(Path(__file__).resolve().parent.parent)
+    subprocess.run(
+        [sys.executable, "-c", NO_LOGS % results], cwd=root, check=True,
+        env={**os.environ, "LC_ALL": "C", "PYTHONUTF8": "0", "PYTHONCOERCECLOCALE": "0"})
+
+    with open(results, encoding='utf-8', newline='') as written:
+        rows = list(csv.reader(written))
+    assert rows[5] == ["é.gov", "", "", "", "", "", "No Lambda request ID."]
@@ -0,0 +1,113 @@
+import csv
+import json
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+from .context import utils  # noqa
+from utils import merge
+
+
+def write_csv(path, rows):
+    with open(str(path), 'w', encoding='utf-8', newline='') as f:
+        csv.writer(f).writerows(rows)
+
+
+def read_csv(path):
+    with open(str(path), encoding='utf-8', newline='') as f:
+        return list(csv.reader(f))
+
+
+def test_merge_csvs_keeps_sorted_order(tmpdir):
+    write_csv(tmpdir.join("1.csv"), [["Domain", "X"], ["a.gov", "1"], ["c.gov", "3"]])
+    write_csv(tmpdir.join("2.csv"), [["Domain", "X"], ["b.gov", "2"], ["d.gov", "4"]])
+    output = tmpdir.join("out.csv")
+
+    count = merge.merge_csvs([str(tmpdir.join("1.csv")), str(tmpdir.join("2.csv"))], str(output))
+
+    assert count == 4
+    assert read_csv(output) == [
+        ["Domain", "X"], ["a.gov", "1"], ["b.gov", "2"], ["c.gov", "3"], ["d.gov", "4"]]
+
+
+@pytest.mark.xfail(raises=ValueError)
+def test_merge_csvs_rejects_different_headers(tmpdir):
+    write_csv(tmpdir.join("1.csv"), [["Domain", "X"], ["a.gov", "1"]])
+    write_csv(tmpdir.join("2.csv"), [["Domain", "Y"], ["b.gov", "2"]])
+    merge.merge_csvs([str(tmpdir.join("1.csv")), str(tmpdir.join("2.csv"))],
+                     str(tmpdir.join("out.csv")))
+
+
+def test_merge_csvs_names_the_header_used(tmpdir):
+    empty = tmpdir.join("1.csv")
+    empty.write("")
+    write_csv(tmpdir.join("2.csv"), [["Domain", "X"], ["a.gov", "1"]])
+    write_csv(tmpdir.join("3.csv"), [["Domain", "Y"], ["b.gov", "2"]])
+    paths = [str(tmpdir.join(name)) for name in ("1.csv", "2.csv", "3.csv")]
+
+    with pytest.raises(ValueError) as error:
+        merge.merge_csvs(paths, str(tmpdir.join("out.csv")))
+    assert str(error.value) == "%s has different columns than %s." % (paths[2], paths[1])
+
+
+def test_merge_csvs_utf8_whatever_the_locale(tmpdir):
+    write_csv(tmpdir.join("1.csv"), [["Domain", "Notes"], ["é.gov", "ü"]])
+    write_csv(tmpdir.join("2.csv"), [["Domain", "Notes"], ["a.gov", "—"]])
+    paths = [str(tmpdir.join("1.csv")), str(tmpdir.join("2.csv"))]
+    output = str(tmpdir.join("out.csv"))
+
+    # In a plain ASCII locale, where files default to ASCII.
+    root = str(Path(__file__).resolve().parent.parent)
+    subprocess.run(
+        [sys.executable, "-c", "from utils import merge; merge.merge_csvs(%r, %r)" % (
+            paths, output)],
+        cwd=root, check=True,
+        env={**os.environ, "LC_ALL": "C", "PYTHONUTF8": "0", "PYTHONCOERCECLOCALE": "0"})
+
+    assert read_csv(output) == [["Domain", "Notes"], ["a.gov", "—"], ["é.gov", "ü"]]
+
+
+def test_merge_meta():
+    metas = [
+        {
+            "start_time": "2018-01-01T00:00:00Z", "end_time": "2018-01-01T01:00:00Z",
+            "durations": {"pshtt": {"start_time": "2018-01-01T00:00:00Z",
+                                    "end_time": "2018-01-01T00:30:00Z"}},
+            "command": "./scan --shard 1/2", "scan_uuid": "1", "shard": "1/2",
+        },
+        {
+            "start_time": "2018-01-01T00:10:00Z", "end_time": "2018-01-01T02:00:00Z",
+            "durations": {"pshtt": {"start_time": "2018-01-01T00:10:00Z",
+                                    "end_time": "2018-01-01T01:00:00Z"},
+                          "sslyze": {"start_time": None, "end_time": None}},
+            "command": "./scan --shard 2/2", "scan_uuid": "2", "shard": "2/2",
+        },
+    ]
+    merged = merge.merge_meta(metas, command="./merge")
+
+    assert merged["start_time"] == "2018-01-01T00:00:00Z"
+    assert merged["end_time"] == "2018-01-01T02:00:00Z"
+    assert merged["duration"] == "7200.000000"
+    assert merged["durations"]["pshtt"]["duration"] == "3600.000000"
+    assert merged["durations"]["sslyze"]["duration"] is None
+    assert [shard["scan_uuid"] for shard in merged["shards"]] == ["1", "2"]
+
+
+def test_merge_results(tmpdir):
+    for i in (1, 2):
+        shard = tmpdir.mkdir("shard-%i" % i)
+        write_csv(shard.join("pshtt.csv"), [["Domain"], ["%i.gov" % i]])
+        shard.join("meta.json").write(json.dumps({"durations": {}, "shard": "%i/2" % i}))
+    # Only one shard had anything to say for this scanner.
+    write_csv(tmpdir.join("shard-1", "sslyze.csv"), [["Domain"], ["1.gov"]])
+
+    results = tmpdir.join("merged")
+    merge.merge_results([str(tmpdir.join("shard-1")), str(tmpdir.join("shard-2"))], str(results))
+
+    assert read_csv(results.join("pshtt.csv")) == [["Domain"], ["1.gov"], ["2.gov"]]
+    assert read_csv(results.join("sslyze.csv")) == [["Domain"], ["1.gov"]]
+    meta = json.loads(results.join("meta.json").read())
+    assert [shard["shard"] for shard in meta["shards"]] == ["1/2", "2/2"]
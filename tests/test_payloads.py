@@ -0,0 +1,30 @@
+import datetime
+import json
+
+from .context import utils  # noqa
+from utils import payloads
+
+
+def test_encode_is_compact():
+    payload = {'b': [1, 2], 'a': datetime.date(2018, 1, 2)}
+    assert payloads.encode(payload) == b'{"a":"2018-01-02","b":[1,2]}'
+
+
+def test_compressed_round_trip():
+    payload = {'domain': "example.gov", 'environment': {'preload_list': ["gov"] * 1000}}
+    compressed = payloads.encode(payload, compress=True)
+    assert len(compressed) < len(payloads.encode(payload))
+
+    parsed = json.loads(compressed)
+    assert payloads.wrapped(parsed)
+    assert payloads.unwrap(parsed) == payload
+    # Plain payloads pass through.
+    assert not payloads.wrapped(payload)
+    assert payloads.unwrap(payload) is payload
+
+
+def test_slim():
+    values = {'debug': True, 'ca_file': "x", 'analytics_domains': ["a.gov"] * 10}
+    assert payloads.slim(values, ["ca_file", "missing"], payloads.OPTIONS) == {
+        'debug': True, 'ca_file': "x"}
+    assert payloads.slim(values, None, payloads.OPTIONS) == values
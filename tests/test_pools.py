@@ -0,0 +1,146 @@
+import asyncio
+import os
+from concurrent.futures import Future
+
+import pytest
+
+from .context import utils  # noqa
+from utils.pools import Batcher, EventLoopThread, RecyclingProcessPool, then
+
+
+# Worker process state, set by the pool's initializer.
+state = {}
+
+
+def remember(value):
+    state['value'] = value
+
+
+def recall(extra):
+    return state['value'] + extra, os.getpid()
+
+
+def test_event_loop_thread_runs_coroutines():
+    async def double(value):
+        await asyncio.sleep(0)
+        return value * 2
+
+    with EventLoopThread(10) as event_loop:
+        futures = [event_loop.submit(double, i) for i in range(5)]
+        results = [future.result(timeout=5) for future in futures]
+
+    assert results == [0, 2, 4, 6, 8]
+
+
+def test_event_loop_thread_limits_concurrency():
+    state = {'running': 0, 'peak': 0}
+
+    async def task():
+        state['running'] += 1
+        state['peak'] = max(state['peak'], state['running'])
+        await asyncio.sleep(0.01)
+        state['running'] -= 1
+
+    with EventLoopThread(3) as event_loop:
+        futures = [event_loop.submit(task) for i in range(12)]
+        for future in futures:
+            future.result(timeout=5)
+
+    assert state['peak'] == 3
+
+
+def test_recycling_process_pool_runs_initializer():
+    with RecyclingProcessPool(2, initializer=remember, initargs=(10,)) as pool:
+        futures = [pool.submit(recall, i) for i in range(4)]
+        results = [future.result(timeout=30)[0] for future in futures]
+
+    assert results == [10, 11, 12, 13]
+
+
+def test_recycling_process_pool_replaces_processes():
+    with RecyclingProcessPool(1, max_tasks=2, initializer=remember, initargs=(0,)) as pool:
+        pids = [pool.submit(recall, i).result(timeout=30)[1] for i in range(6)]
+
+    assert pool.recycled == 2
+    assert pids[0] == pids[1]
+    assert len(set(pids)) == 3
+    assert os.getpid() not in pids
+
+
+def test_then_waits_for_function():
+    calls = []
+    future = Future()
+    chained = then(future, lambda result: calls.append(result) or result * 2)
+    assert not chained.done()
+
+    future.set_result(21)
+    assert chained.result(timeout=5) == 42
+    assert calls == [21]
+
+
+@pytest.mark.xfail(raises=ZeroDivisionError)
+def test_then_passes_on_exceptions():
+    future = Future()
+    chained = then(future, lambda result: result)
+    future.set_exception(ZeroDivisionError())
+    chained.result(timeout=5)
+
+
+def test_then_cancelled():
+    calls = []
+    future = Future()
+    chained = then(future, calls.append)
+
+    assert chained.cancel()
+    assert future.cancelled()
+    assert calls == []
+
+
+def test_batcher_sends_full_batches():
+    sent = []
+
+    def send(key, items):
+        sent.append((key, items))
+        return [item * 2 for item in items]
+
+    with Batcher(send, 3, linger=60) as batcher:
+        futures = [batcher.submit("a", i) for i in range(6)]
+        results = [future.result(timeout=5) for future in futures]
+
+    assert results == [0, 2, 4, 6, 8, 10]
+    assert sent == [("a", [0, 1, 2]), ("a", [3, 4, 5])]
+
+
+def test_batcher_sends_partial_batches_after_linger():
+    sent = []
+
+    def send(key, items):
+        sent.append((key, items))
+        return items
+
+    with Batcher(send, 10, linger=0.05) as batcher:
+        a = batcher.submit("a", 1)
+        b = batcher.submit("b", 2)
+        # Without waiting for close.
+        assert a.result(timeout=5) == 1
+        assert b.result(timeout=5) == 2
+        assert sorted(sent) == [("a", [1]), ("b", [2])]
+
+        c = batcher.submit("a", 3)
+    assert c.result(timeout=5) == 3
+    assert batcher.batches == 3
+
+
+def test_batcher_fails_whole_batch():
+    def send(key, items):
+        if key == "short":
+            return items[1:]
+        raise ValueError("invoke failed")
+
+    with Batcher(send, 2, linger=60) as batcher:
+        futures = [batcher.submit("a", 1), batcher.submit("a", 2),
+                   batcher.submit("short", 3), batcher.submit("short", 4)]
+
+    for future in futures:
+        with pytest.raises(ValueError):
+            future.result(timeout=5)
@@ -0,0 +1,92 @@
+import os
+import threading
+import time
+
+import publicsuffix
+import pytest
+
+from .context import utils  # noqa
+from utils import psl, scan_utils
+
+
+PSL_PATH = os.path.join(os.path.dirname(publicsuffix.__file__), "public_suffix_list.dat")
+
+DOMAINS = [
+    "whitehouse.gov", "www.whitehouse.gov", "x.y.18f.gsa.gov", "GSA.GOV",
+    "trailing.dot.gov.", "gov", "localhost", "", "example.co.uk", "a.b.example.co.uk",
+    "city.kawasaki.jp", "www.city.kawasaki.jp", "a.b.kawasaki.jp", "www.ck", "a.www.ck",
+    "b.a.www.ck", "example.ck", "a.example.ck", "foo.bar.unknowntld", "s3.amazonaws.com",
+    "bucket.s3.amazonaws.com", "xn--85x722f.xn--55qx5d.cn", "blogspot.com", "a.blogspot.com",
+]
+
+
+@pytest.fixture(scope="module")
+def lines():
+    with open(PSL_PATH, encoding="utf-8") as psl_file:
+        return psl_file.readlines()
+
+
+def test_same_answers_as_publicsuffix(lines):
+    expected = publicsuffix.PublicSuffixList(lines)
+    trie = psl.SuffixTrie.from_lines(lines)
+    for domain in DOMAINS:
+        assert trie.get_public_suffix(domain) == expected.get_public_suffix(domain), domain
+
+
+def test_same_answers_for_every_rule(lines):
+    expected = publicsuffix.PublicSuffixList(lines)
+    trie = psl.SuffixTrie.from_lines(lines)
+    for line in lines:
+        line = line.strip()
+        if line.startswith("//") or not line:
+            continue
+        rule = line.split()[0].lstrip("!").replace("*", "w")
+        for domain in (rule, "x." + rule, "y.x." + rule):
+            assert trie.get_public_suffix(domain) == expected.get_public_suffix(domain), domain
+
+
+def test_compiled_trie_is_reused(tmpdir, lines):
+    compiled = str(tmpdir.join("public-suffix-list.trie"))
+    first = psl.load(lines, compiled)
+    assert os.path.exists(compiled)
+
+    second = psl.load(lines, compiled)
+    assert second.root == first.root
+    assert second.get_public_suffix("a.b.example.co.uk") == "example.co.uk"
+
+    # A changed list is compiled again.
+    changed = psl.load(["gov\n", "example.gov\n"], compiled)
+    assert changed.get_public_suffix("a.example.gov") == "a.example.gov"
+    assert psl.load(["gov\n", "example.gov\n"], compiled).root == changed.root
+
+
+def test_corrupt_compiled_trie_is_rebuilt(tmpdir):
+    compiled = tmpdir.join("public-suffix-list.trie")
+    compiled.write_binary(b"not a trie")
+    trie = psl.load(["gov\n"], str(compiled))
+    assert trie.get_public_suffix("a.b.gov") == "b.gov"
+
+
+def test_base_domain_for_loads_once(monkeypatch):
+    loads = []
+
+    def slow_load(cache_dir="./cache"):
+        loads.append(cache_dir)
+        time.sleep(0.1)
+        return psl.SuffixTrie.from_lines(["gov"]), ["gov"]
+
+    monkeypatch.setattr(scan_utils, "suffix_list", None)
+    monkeypatch.setattr(scan_utils, "load_suffix_list", slow_load)
+
+    results = []
+    threads = [
+        threading.Thread(target=lambda: results.append(scan_utils.base_domain_for("x.a.gov")))
+        for _ in range(8)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(loads) == 1
+    assert results == ["a.gov"] * 8
@@ -0,0 +1,171 @@
+import base64
+import json
+import os
+
+import requests
+
+from .context import utils  # noqa
+from utils import reference
+
+
+class FakeResponse:
+    def __init__(self, status_code, content=b"", headers=None):
+        self.status_code = status_code
+        self.content = content
+        self.headers = headers or {}
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.exceptions.HTTPError(self.status_code)
+
+
+class FakeSession:
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.requests = []
+
+    def get(self, url, headers=None, timeout=None):
+        self.requests.append(headers)
+        response = self.responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+
+PENDING = json.dumps([
+    {"name": "a.gov", "include_subdomains": True},
+    {"name": "b.gov", "include_subdomains": False},
+]).encode("utf-8")
+
+DAY = reference.DAY
+
+
+def test_load_downloads_then_uses_cache(tmpdir):
+    session = FakeSession(FakeResponse(200, PENDING, {"ETag": '"v1"'}))
+    dataset = reference.HSTS_PRELOAD_PENDING
+
+    assert reference.load(dataset, str(tmpdir), now=1000, session=session) == ["a.gov"]
+    assert session.requests == [{}]
+    # Only the names are kept.
+    with open(os.path.join(str(tmpdir), dataset.filename)) as cached:
+        assert cached.read() == '["a.gov"]'
+
+    # Fresh: no request at all.
+    assert reference.load(dataset, str(tmpdir), now=1000 + DAY - 1, session=session) == ["a.gov"]
+    assert len(session.requests) == 1
+
+
+def test_load_revalidates_when_stale(tmpdir):
+    dataset = reference.HSTS_PRELOAD_PENDING
+    session = FakeSession(
+        FakeResponse(200, PENDING, {"ETag": '"v1"', "Last-Modified": "Mon, 01 Jan 2018"}),
+        FakeResponse(304),
+        FakeResponse(200, b'[{"name": "c.gov", "include_subdomains": true}]'),
+    )
+    reference.load(dataset, str(tmpdir), now=1000, session=session)
+
+    # Unchanged: kept, and fresh for another TTL.
+    assert reference.load(dataset, str(tmpdir), now=1000 + DAY, session=session) == ["a.gov"]
+    assert session.requests[1] == {
+        "If-None-Match": '"v1"', "If-Modified-Since": "Mon, 01 Jan 2018"}
+    assert reference.load(dataset, str(tmpdir), now=1000 + 2 * DAY - 1,
+                          session=session) == ["a.gov"]
+    assert len(session.requests) == 2
+
+    # Changed.
+    assert reference.load(dataset, str(tmpdir), now=1000 + 2 * DAY, session=session) == ["c.gov"]
+
+
+def test_load_falls_back(tmpdir):
+    dataset = reference.HSTS_PRELOAD_PENDING
+    error = requests.exceptions.ConnectionError("offline")
+
+    # Nothing cached.
+    session = FakeSession(error, FakeResponse(500))
+    assert reference.load(dataset, str(tmpdir), now=1000, session=session) == []
+    assert reference.load(dataset, str(tmpdir), now=1000, session=session) == []
+    assert reference.load(reference.PUBLIC_SUFFIX_LIST, str(tmpdir), now=1000,
+                          session=FakeSession(error)) is None
+
+    # Stale, but cached.
+    session = FakeSession(FakeResponse(200, PENDING), error, FakeResponse(200, b"not json"))
+    reference.load(dataset, str(tmpdir), now=1000, session=session)
+    assert reference.load(dataset, str(tmpdir), now=1000 + DAY, session=session) == ["a.gov"]
+    assert reference.load(dataset, str(tmpdir), now=1000 + DAY, session=session) == ["a.gov"]
+
+
+def test_load_existing_file(tmpdir):
+    # e.g. a Public Suffix List cached before there was metadata.
+    path = os.path.join(str(tmpdir), "public-suffix-list.txt")
+    with open(path, 'w') as psl:
+        psl.write("gov\ncom\n")
+    written = os.path.getmtime(path)
+
+    session = FakeSession(FakeResponse(200, b"gov\n"))
+    dataset = reference.PUBLIC_SUFFIX_LIST
+    assert reference.load(dataset, str(tmpdir), now=written + 60,
+                          session=session) == ["gov\n", "com\n"]
+    assert reference.load(dataset, str(tmpdir), now=written + 7 * DAY,
+                          session=session) == ["gov\n"]
+
+
+def test_parse_preload_list():
+    source = b"""{
+  // A comment.
+  "entries": [
+    // Another.
+    { "name": "a.gov", "policy": "custom", "include_subdomains": true },
+    { "name": "b.gov", "policy": "custom" }
+  ]
+}"""
+    assert json.loads(reference.parse_preload_list(base64.b64encode(source))) == ["a.gov"]
+
+
+def test_load_ignores_corrupt_metadata(tmpdir):
+    dataset = reference.HSTS_PRELOAD_PENDING
+    session = FakeSession(FakeResponse(200, PENDING, {"ETag": '"v1"'}))
+    reference.load(dataset, str(tmpdir), now=1000, session=session)
+
+    # e.g. cut short: counts as fetched when the data was written.
+    meta = tmpdir.join(dataset.filename + ".meta.json")
+    meta.write('{"etag": "v1", "fet')
+    written = os.path.getmtime(str(tmpdir.join(dataset.filename)))
+    assert reference.load(dataset, str(tmpdir), now=written + 60, session=session) == ["a.gov"]
+    assert len(session.requests) == 1
+
+    # And once it's stale, it's downloaded again, and the metadata fixed.
+    session = FakeSession(FakeResponse(200, PENDING, {"ETag": '"v2"'}))
+    assert reference.load(dataset, str(tmpdir), now=written + DAY, session=session) == ["a.gov"]
+    assert session.requests == [{}]
+    assert json.loads(meta.read())["etag"] == '"v2"'
+
+
+def test_load_survives_failed_writes(tmpdir, monkeypatch):
+    dataset = reference.HSTS_PRELOAD_PENDING
+
+    def disk_full(path, content):
+        raise OSError(28, "No space left on device")
+
+    # Nothing cached.
+    monkeypatch.setattr(reference, "_write", disk_full)
+    session = FakeSession(FakeResponse(200, PENDING))
+    assert reference.load(dataset, str(tmpdir), now=1000, session=session) == []
+    monkeypatch.undo()
+
+    # Cached, but stale.
+    reference.load(dataset, str(tmpdir), now=1000, session=FakeSession(FakeResponse(200, PENDING)))
+    monkeypatch.setattr(reference, "_write", disk_full)
+    session = FakeSession(FakeResponse(200, b'[{"name": "c.gov", "include_subdomains": true}]'))
+    assert reference.load(dataset, str(tmpdir), now=1000 + DAY, session=session) == ["a.gov"]
+    assert not [name for name in os.listdir(str(tmpdir)) if name.startswith(".tmp-")]
+
+
+def test_load_replaces_unreadable_cache(tmpdir):
+    dataset = reference.HSTS_PRELOAD_PENDING
+    reference.load(dataset, str(tmpdir), now=1000, session=FakeSession(FakeResponse(200, PENDING)))
+    tmpdir.join(dataset.filename).write('["a.g')
+
+    session = FakeSession(FakeResponse(200, PENDING), requests.exceptions.ConnectionError())
+    assert reference.load(dataset, str(tmpdir), now=1001, session=session) == ["a.gov"]
+    tmpdir.join(dataset.filename).write('["a.g')
+    assert reference.load(dataset, str(tmpdir), now=1002, session=session) == []
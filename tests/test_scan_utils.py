@@ -1,14 +1,27 @@
+import argparse
+import csv
 import os
+import subprocess
 import sys
+import time
 from collections import namedtuple
 from pathlib import Path
 from .context import utils, scanners  # noqa
 from utils import scan_utils
-from scanners import analytics, noop
+from scanners import analytics, noop, noop_async
 
+import publicsuffix
 import pytest
 
 MockScanner = namedtuple("MockScanner", ["workers"])
+MockExecutorScanner = namedtuple("MockExecutorScanner", ["executor"])
+
+
+class MockTimeoutScanner:
+    __name__ = "scanners.mock"
+
+    def __init__(self, scan_timeout):
+        self.scan_timeout = scan_timeout
 
 
 @pytest.mark.parametrize("names,expected", [
@@ -164,6 +177,173 @@ def test_determine_scan_workers(scanner, options, w_default, w_max, expected):
     assert result == expected
 
 
+@pytest.mark.parametrize("options,expected", [
+    ({}, 50),
+    ({"workers": "20"}, 20),
+    ({"workers": "noop=200,sslyze=20,30"}, 200),
+    ({"workers": "sslyze=20,30"}, 30),
+    ({"workers": "sslyze=20"}, 50),
+    ({"workers": "noop=200", "serial": True}, 1),
+])
+def test_determine_scan_workers_option(monkeypatch, options, expected):
+    # The flag wins over the scanner's own setting.
+    monkeypatch.setattr(noop, "workers", 50, raising=False)
+    assert scan_utils.determine_scan_workers(noop, options, 10, 1000) == expected
+
+
+@pytest.mark.parametrize("value", ["pshtt=", "pshtt=a", "0", "pshtt=-1"])
+@pytest.mark.xfail(raises=argparse.ArgumentTypeError)
+def test_parse_workers_invalid(value):
+    scan_utils.parse_workers(value)
+
+
+@pytest.mark.parametrize("scanner,expected", [
+    (noop, False),
+    (noop_async, True),
+    (analytics, False),
+])
+def test_is_async_scanner(scanner, expected):
+    assert scan_utils.is_async_scanner(scanner) == expected
+
+
+def test_rows_for():
+    rows = scan_utils.rows_for([["x", 1], ["y", 2]], "a.b.gov", "b.gov", noop)
+    assert rows == [["a.b.gov", "b.gov", "x", 1], ["a.b.gov", "b.gov", "y", 2]]
+
+
+def test_rows_for_no_data():
+    rows = scan_utils.rows_for(None, "a.b.gov", "b.gov", noop,
+                               meta={'errors': ["Oops.", "Ouch."]})
+    assert rows == [["a.b.gov", "b.gov"] + [None] * len(noop.headers) +
+                    ["Oops. Ouch.", None, None, None]]
+
+
+@pytest.mark.parametrize("value,expected", [
+    ("pshtt=1d", {"pshtt": 86400}),
+    ("pshtt=1d,sslyze=7d,a11y=30d",
+     {"pshtt": 86400, "sslyze": 604800, "a11y": 2592000}),
+    ("12h,invalid=30m", {"*": 43200, "invalid": 1800}),
+    ("noop=1.5s", {"noop": 1.5}),
+])
+def test_parse_cache_ttls(value, expected):
+    assert scan_utils.parse_cache_ttls(value) == expected
+
+
+@pytest.mark.parametrize("value", ["pshtt=1", "pshtt=1y", "pshtt=d", ""])
+@pytest.mark.xfail(raises=argparse.ArgumentTypeError)
+def test_parse_cache_ttls_invalid(value):
+    scan_utils.parse_cache_ttls(value)
+
+
+@pytest.mark.parametrize("scanner,options,expected", [
+    (noop, {}, None),
+    (noop, {"scan_timeout": {"*": 60}}, 60),
+    (noop, {"scan_timeout": {"noop": 5, "*": 60}}, 5),
+    (MockTimeoutScanner(120), {"scan_timeout": {"pshtt": 5}}, 120),
+    (MockTimeoutScanner(120), {"scan_timeout": {"*": 60}}, 60),
+])
+def test_determine_timeout(scanner, options, expected):
+    assert scan_utils.determine_timeout(scanner, options) == expected
+
+
+def test_deadline_kills_commands():
+    started = time.monotonic()
+    with pytest.raises(subprocess.TimeoutExpired):
+        with scan_utils.deadline(0.2):
+            scan_utils.scan(["sleep", "5"])
+    assert time.monotonic() - started < 2
+    assert scan_utils.time_left() is None
+
+
+def test_backoff_grows_up_to_a_cap():
+    for attempt in range(10):
+        delays = [scan_utils.backoff(attempt, 0.5, 4) for i in range(50)]
+        assert all(0 <= delay <= min(4, 0.5 * 2 ** attempt) for delay in delays)
+        # Jittered, not all the same.
+        assert len(set(delays)) > 1
+
+
+def test_throttled():
+    Error = namedtuple("Error", ["response"])
+    assert scan_utils.throttled(Error({"Error": {"Code": "TooManyRequestsException"}}))
+    assert scan_utils.throttled(Error({"Error": {"Code": "ThrottlingException"}}))
+    assert not scan_utils.throttled(Error({"Error": {"Code": "ResourceNotFoundException"}}))
+    assert not scan_utils.throttled(ValueError("no response"))
+
+
+def test_alarm_interrupts():
+    started = time.monotonic()
+    with pytest.raises(TimeoutError):
+        with scan_utils.alarm(0.2):
+            time.sleep(5)
+    assert time.monotonic() - started < 2
+
+
+@pytest.mark.parametrize("value,expected", [
+    ("1/1", (1, 1)),
+    ("2/4", (2, 4)),
+])
+def test_parse_shard(value, expected):
+    assert scan_utils.parse_shard(value) == expected
+
+
+@pytest.mark.parametrize("value", ["0/4", "5/4", "2", "a/b", "1/2/3"])
+@pytest.mark.xfail(raises=argparse.ArgumentTypeError)
+def test_parse_shard_invalid(value):
+    scan_utils.parse_shard(value)
+
+
+def test_shards_split_by_base_domain(monkeypatch):
+    monkeypatch.setattr(scan_utils, "suffix_list", publicsuffix.PublicSuffixList(["gov"]))
+    domains = ["www.%i.gov" % i for i in range(100)] + ["%i.gov" % i for i in range(100)]
+
+    shards = [list(scan_utils.in_shard(domains, (i, 4))) for i in (1, 2, 3, 4)]
+
+    # Every domain ends up in exactly one shard, along with its parent.
+    assert sorted(sum(shards, [])) == sorted(domains)
+    for shard in shards:
+        assert shard
+        for domain in shard:
+            if domain.startswith("www."):
+                assert domain[4:] in shard
+    # And in the same shard every time.
+    assert scan_utils.shard_for("www.7.gov", 4) == scan_utils.shard_for("www.7.gov", 4)
+
+
+@pytest.mark.parametrize("scanner,options,expected", [
+    (noop, {}, "thread"),
+    (MockExecutorScanner("process"), {}, "process"),
+    (noop, {"executor": "process"}, "process"),
+    (MockExecutorScanner("process"), {"executor": "thread"}, "thread"),
+])
+def test_determine_executor(scanner, options, expected):
+    assert scan_utils.determine_executor(scanner, options) == expected
+
+
+@pytest.mark.xfail(raises=ValueError)
+def test_determine_executor_unknown():
+    scan_utils.determine_executor(MockExecutorScanner("gpu"), {})
+
+
+@pytest.mark.parametrize("limits,options,w_max,expected", [
+    ({"pshtt": 10, "sslyze": 5}, {}, 100, 15),
+    ({"pshtt": 10, "sslyze": 5}, {}, 12, 12),
+    ({"pshtt": 10, "sslyze": 5}, {"serial": True}, 100, 1),
+])
+def test_determine_global_workers(limits, options, w_max, expected):
+    assert scan_utils.determine_global_workers(limits, options, w_max) == expected
+
+
+@pytest.mark.parametrize("budgets,scanner_count,options,expected", [
+    ({"thread": 10, "async": 1}, 2, {}, 44),
+    ({"thread": 10, "async": 1}, 2, {"max_pending": 100}, 100),
+    ({"thread": 1, "async": 1}, 3, {"max_pending": 1}, 3),
+])
+def test_determine_window(budgets, scanner_count, options, expected):
+    result = scan_utils.determine_window(budgets, scanner_count, options, 4)
+    assert result == expected
+
+
 @pytest.mark.parametrize("args,expected", [
     (
         "./scan 18f.gsa.gov --scan=analytics --analytics=http://us.ie/de.csv",
@@ -171,16 +351,22 @@ def test_determine_scan_workers(scanner, options, w_default, w_max, expected):
             {
                 "domains": "18f.gsa.gov",
                 "cache": False,
+                "adaptive_workers": False,
                 "debug": False,
+                "enqueue": False,
                 "lambda": False,
+                "lambda_compress": False,
+                "lambda_details": False,
                 "meta": False,
                 "scan": "analytics",
                 "no_fast_cache": False,
+                "resume": False,
                 "serial": False,
                 "sort": False,
                 "dmarc": False,
                 "mx": False,
                 "starttls": False,
+                "worker": False,
                 "spf": False,
                 "output": "./",
                 "_": {
@@ -198,16 +384,22 @@ def test_determine_scan_workers(scanner, options, w_default, w_max, expected):
             {
                 "domains": "tests/data/domains.csv",
                 "cache": False,
+                "adaptive_workers": False,
                 "debug": False,
+                "enqueue": False,
                 "lambda": False,
+                "lambda_compress": False,
+                "lambda_details": False,
                 "meta": False,
                 "scan": "noopabc",
                 "no_fast_cache": False,
+                "resume": False,
                 "serial": False,
                 "sort": False,
                 "dmarc": False,
                 "mx": False,
                 "starttls": False,
+                "worker": False,
                 "spf": False,
                 "output": "./",
                 "_": {
@@ -224,3 +416,85 @@ def test_options(monkeypatch, args, expected):
     monkeypatch.setattr(sys, "argv", args.split(" "))
     result = scan_utils.options()
     assert result == expected
+
+
+def write_csv(path, rows):
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        csv.writer(f).writerows(rows)
+
+
+def read_csv(path):
+    with open(path, encoding='utf-8', newline='') as f:
+        return list(csv.reader(f))
+
+
+@pytest.mark.parametrize("chunk_rows,merge_width", [
+    (None, None),
+    (3, 2),
+    (1, 2),
+])
+def test_sort_csv(tmpdir, chunk_rows, merge_width):
+    path = str(tmpdir.join("trustymail.csv"))
+    rows = [["Domain", "Base Domain", "MX"]] + [
+        ["%02i.gov" % (i * 7 % 20), "x.gov", "mx%i" % i] for i in range(20)
+    ] + [["07.gov", "x.gov", "mx-second"], ["07.gov", "x.gov", "mx-third"]]
+    write_csv(path, rows)
+
+    scan_utils.sort_csv(path, chunk_rows=chunk_rows, merge_width=merge_width)
+
+    result = read_csv(path)
+    assert result[0] == rows[0]
+    assert [row[0] for row in result[1:]] == sorted(row[0] for row in rows[1:])
+    # Domains with several rows keep all of them, in order.
+    assert [row[2] for row in result if row[0] == "07.gov"] == ["mx1", "mx-second", "mx-third"]
+    # No temporary files left behind.
+    assert sorted(os.listdir(str(tmpdir))) == ["trustymail.csv"]
+
+
+def test_sort_csv_no_header(tmpdir):
+    path = str(tmpdir.join("gathered.csv"))
+    write_csv(path, [["b.gov"], ["a.gov"], [], ["c.gov"]])
+    scan_utils.sort_csv(path, chunk_rows=2)
+    assert read_csv(path) == [["a.gov"], ["b.gov"], ["c.gov"]]
+
+
+def test_sort_csv_empty(tmpdir):
+    path = str(tmpdir.join("empty.csv"))
+    write_csv(path, [["Domain", "Base Domain"]])
+    scan_utils.sort_csv(path)
+    assert read_csv(path) == [["Domain", "Base Domain"]]
+
+
+def test_sort_csv_utf8_whatever_the_locale(tmpdir):
+    path = str(tmpdir.join("results.csv"))
+    rows = [["Domain", "Notes"], ["é.gov", "ü"], ["b.gov", "—"], ["a.gov", "ok"]]
+    write_csv(path, rows)
+
+    # In a plain ASCII locale, where files default to ASCII.
+    root = str(Path(__file__).resolve().parent.parent)
+    subprocess.run(
+        [sys.executable, "-c", "from utils import scan_utils; "
+         "scan_utils.sort_csv(%r, chunk_rows=2)" % path],
+        cwd=root, check=True,
+        env={**os.environ, "LC_ALL": "C", "PYTHONUTF8": "0", "PYTHONCOERCECLOCALE": "0"})
+
+    assert read_csv(path) == [rows[0], rows[3], rows[2], rows[1]]
+
+
+def test_environment_view_shares_without_copying():
+    preload_list = ["a.gov", "b.gov"]
+    fast_cache = {}
+    environment = {"preload_list": preload_list, "fastcache": fast_cache}
+
+    view = scan_utils.environment_view(environment)
+    assert view["preload_list"] is preload_list
+
+    # Like pshtt's init_domain: cut the shared list down for one domain.
+    view["preload_list"] = ["a.gov"]
+    view["fastcache"]["mx.a.gov"] = "seen"
+    view["url"] = "https://a.gov"
+
+    assert {**environment, **view} == {
+        "preload_list": ["a.gov"], "fastcache": {"mx.a.gov": "seen"}, "url": "https://a.gov"}
+    assert environment == {"preload_list": ["a.gov", "b.gov"], "fastcache": fast_cache}
+    assert fast_cache == {"mx.a.gov": "seen"}
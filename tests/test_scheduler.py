@@ -0,0 +1,468 @@
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import pytest
+
+from .context import utils  # noqa
+from utils.scheduler import (
+    AdaptiveLimits, Politeness, Scheduler, ThrottleGovernor, TokenBucket, resource_usage
+)
+
+
+class Recorder:
+    """Fake task runner that records what ran, and how much at once."""
+
+    def __init__(self, executor, delays=None):
+        self.executor = executor
+        self.delays = delays or {}
+        self.lock = threading.Lock()
+        self.calls = []
+        self.started = []
+        self.running = {}
+        self.peak = {}
+        self.peak_total = 0
+
+    def submit(self, name, domain):
+        return self.executor.submit(self.task, name, domain)
+
+    def task(self, name, domain):
+        with self.lock:
+            self.started.append((time.monotonic(), name, domain))
+            self.running[name] = self.running.get(name, 0) + 1
+            self.peak[name] = max(self.peak.get(name, 0), self.running[name])
+            self.peak_total = max(self.peak_total, sum(self.running.values()))
+        time.sleep(self.delays.get(name, 0.001))
+        with self.lock:
+            self.running[name] -= 1
+            self.calls.append((name, domain))
+
+
+def test_scheduler_runs_every_scanner_on_every_domain():
+    domains = ["a.gov", "b.gov", "c.gov", "d.gov"]
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        recorder = Recorder(executor)
+        scheduler = Scheduler(["x", "y"], {"x": 2, "y": 2}, 4, recorder.submit)
+        scheduler.run(domains)
+
+    assert sorted(recorder.calls) == sorted(
+        [(name, domain) for name in ["x", "y"] for domain in domains])
+
+
+def test_scheduler_fills_every_slot():
+    # A single scanner runs at its full limit, not one domain at a time.
+    domains = ["%i.gov" % i for i in range(12)]
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        recorder = Recorder(executor, delays={"x": 0.05})
+        scheduler = Scheduler(["x"], {"x": 4}, 4, recorder.submit)
+        scheduler.run(domains)
+
+    assert recorder.peak["x"] == 4
+
+
+def test_scheduler_runs_at_full_concurrency():
+    # 20 tasks of 0.05s each, 10 at a time per scanner: about 0.1s, where
+    # one at a time would take a second.
+    domains = ["%i.gov" % i for i in range(20)]
+    with ThreadPoolExecutor(max_workers=20) as executor:
+        recorder = Recorder(executor, delays={"x": 0.05, "y": 0.05})
+        scheduler = Scheduler(["x", "y"], {"x": 10, "y": 10}, 20, recorder.submit)
+        started = time.monotonic()
+        scheduler.run(domains)
+        elapsed = time.monotonic() - started
+
+    assert recorder.peak == {"x": 10, "y": 10}
+    assert len(recorder.calls) == 40
+    assert elapsed < 0.5
+
+
+def test_scheduler_respects_limits_and_budget():
+    domains = ["%i.gov" % i for i in range(30)]
+    with ThreadPoolExecutor(max_workers=10) as executor:
+        recorder = Recorder(executor)
+        scheduler = Scheduler(["x", "y"], {"x": 2, "y": 5}, 6, recorder.submit)
+        scheduler.run(domains)
+
+    assert recorder.peak["x"] <= 2
+    assert recorder.peak["y"] <= 5
+    assert recorder.peak_total <= 6
+
+
+def test_scheduler_scales_with_tasks_in_flight():
+    # 3000 tasks in flight at once, finishing one at a time: handling each
+    # one shouldn't take longer the more are running.
+    count = 3000
+    futures = []
+    lock = threading.Lock()
+
+    def submit(name, domain):
+        future = Future()
+        with lock:
+            futures.append(future)
+        return future
+
+    def finish():
+        finished = 0
+        while finished < count:
+            with lock:
+                future = futures[finished] if finished < len(futures) else None
+            if future is not None:
+                future.set_result(None)
+                finished += 1
+            time.sleep(0)
+
+    finisher = threading.Thread(target=finish, daemon=True)
+    finisher.start()
+    scheduler = Scheduler(["x"], {"x": count}, count, submit)
+    started = time.monotonic()
+    scheduler.run(["%i.gov" % i for i in range(count)])
+    assert time.monotonic() - started < 1.5
+    assert not scheduler.in_flight
+
+
+def test_scheduler_overlaps_scanners():
+    # A slow scanner shouldn't hold back a fast one until it's done.
+    domains = ["%i.gov" % i for i in range(10)]
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        recorder = Recorder(executor, delays={"slow": 0.02})
+        scheduler = Scheduler(["slow", "fast"], {"slow": 1, "fast": 1}, 2,
+                              recorder.submit)
+        scheduler.run(domains)
+
+    fast_done = [i for i, call in enumerate(recorder.calls) if call[0] == "fast"]
+    slow_done = [i for i, call in enumerate(recorder.calls) if call[0] == "slow"]
+    # The fast scanner finished everything while the slow one was
+    # still working through its own list.
+    assert max(fast_done) < slow_done[1]
+
+
+def test_scheduler_durations():
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        recorder = Recorder(executor)
+        scheduler = Scheduler(["x"], {"x": 1}, 1, recorder.submit)
+        scheduler.run(["a.gov"])
+
+    durations = scheduler.durations()
+    assert set(durations["x"].keys()) == {"start_time", "end_time", "duration"}
+    assert durations["x"]["duration"] is not None
+
+
+def test_scheduler_runs_dependencies_first():
+    domains = ["%i.gov" % i for i in range(8)]
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        recorder = Recorder(executor, delays={"pshtt": 0.005})
+        scheduler = Scheduler(["sslyze", "pshtt"], {"sslyze": 2, "pshtt": 2}, 4,
+                              recorder.submit,
+                              dependencies={"sslyze": ["pshtt"]})
+        scheduler.run(domains)
+
+    assert len(recorder.calls) == 16
+    for domain in domains:
+        upstream = recorder.calls.index(("pshtt", domain))
+        downstream = recorder.calls.index(("sslyze", domain))
+        assert upstream < downstream
+
+
+def test_scheduler_ignores_unselected_dependencies():
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        recorder = Recorder(executor)
+        scheduler = Scheduler(["sslyze"], {"sslyze": 2}, 2, recorder.submit,
+                              dependencies={"sslyze": ["pshtt", "trustymail"]})
+        scheduler.run(["a.gov", "b.gov"])
+
+    assert sorted(recorder.calls) == [("sslyze", "a.gov"), ("sslyze", "b.gov")]
+
+
+@pytest.mark.xfail(raises=ValueError)
+def test_scheduler_rejects_dependency_cycles():
+    Scheduler(["x", "y"], {"x": 1, "y": 1}, 2, None,
+              dependencies={"x": ["y"], "y": ["x"]})
+
+
+def test_scheduler_budgets_per_pool():
+    domains = ["%i.gov" % i for i in range(20)]
+    with ThreadPoolExecutor(max_workers=10) as executor:
+        recorder = Recorder(executor)
+        scheduler = Scheduler(["x", "y"], {"x": 5, "y": 5}, {"thread": 1, "async": 4},
+                              recorder.submit, pools={"y": "async"})
+        scheduler.run(domains)
+
+    assert recorder.peak["x"] == 1
+    assert recorder.peak["y"] <= 4
+    assert len(recorder.calls) == 40
+
+
+def test_scheduler_window_bounds_reading():
+    # With a fast and a slow scanner, the fast one would otherwise read
+    # in every domain long before the slow one gets to them.
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        recorder = Recorder(executor, delays={"slow": 0.005})
+        scheduler = Scheduler(["slow", "fast"], {"slow": 1, "fast": 1}, 2,
+                              recorder.submit, window=6)
+        read = []
+
+        def domains():
+            for i in range(30):
+                # Everything read so far, minus everything finished.
+                assert (2 * len(read)) - len(recorder.calls) <= 6
+                read.append(i)
+                yield "%i.gov" % i
+
+        scheduler.run(domains())
+
+    assert len(read) == 30
+    assert len(recorder.calls) == 60
+    assert scheduler.outstanding == 0
+
+
+def parent(domain):
+    return domain.split(".", 1)[1]
+
+
+def test_scheduler_limits_tasks_per_key():
+    # Lots of subdomains of one site, plus a few others.
+    domains = ["%i.big.gov" % i for i in range(10)] + ["a.gov", "b.gov", "c.gov"]
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        recorder = Recorder(executor, delays={"x": 0.005})
+        active = {}
+        peak = {}
+
+        def submit(name, domain):
+            key = parent(domain)
+            active[key] = active.get(key, 0) + 1
+            peak[key] = max(peak.get(key, 0), active[key])
+            future = recorder.submit(name, domain)
+
+            def done(_):
+                active[key] -= 1
+            future.add_done_callback(done)
+            return future
+
+        scheduler = Scheduler(["x", "y"], {"x": 4, "y": 4}, 8, submit, window=12,
+                              politeness=[Politeness(parent, limit=2)])
+        scheduler.run(domains)
+
+    assert len(recorder.calls) == 26
+    assert peak["big.gov"] <= 2
+    # The other domains didn't have to wait for big.gov to finish.
+    first_other = min(i for i, call in enumerate(recorder.calls) if call[1] == "a.gov")
+    last_big = max(i for i, call in enumerate(recorder.calls) if call[1].endswith("big.gov"))
+    assert first_other < last_big
+
+
+def test_scheduler_limits_rate_per_key():
+    domains = ["%i.big.gov" % i for i in range(4)]
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        recorder = Recorder(executor)
+        scheduler = Scheduler(["x"], {"x": 4}, 4, recorder.submit,
+                              politeness=[Politeness(parent, rate=20)])
+        scheduler.run(domains)
+
+    assert len(recorder.calls) == 4
+    # One start right away, then one every 1/20th of a second.
+    starts = sorted(start for start, _, _ in recorder.started)
+    assert starts[-1] - starts[0] >= 0.14
+
+
+def test_scheduler_ignores_unkeyed_domains():
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        recorder = Recorder(executor)
+        scheduler = Scheduler(["x"], {"x": 4}, 4, recorder.submit,
+                              politeness=[Politeness(lambda domain: None, limit=1, rate=0.01)])
+        scheduler.run(["a.gov", "b.gov", "c.gov"])
+
+    assert len(recorder.calls) == 3
+
+
+def test_token_bucket():
+    bucket = TokenBucket(2, 1, now=0)
+    assert bucket.delay(0) == 0
+    bucket.take(0)
+    assert bucket.delay(0) == 0.5
+    assert bucket.delay(0.25) == 0.25
+    assert bucket.delay(0.5) == 0
+
+
+def test_scheduler_skips_done_tasks():
+    domains = ["a.gov", "b.gov", "c.gov"]
+    done = {("pshtt", "a.gov"), ("sslyze", "a.gov"), ("pshtt", "b.gov")}
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        recorder = Recorder(executor)
+        scheduler = Scheduler(["sslyze", "pshtt"], {"sslyze": 2, "pshtt": 2}, 4,
+                              recorder.submit,
+                              dependencies={"sslyze": ["pshtt"]}, done=done)
+        scheduler.run(domains)
+
+    # sslyze on b.gov doesn't wait on a pshtt task that won't run.
+    assert sorted(recorder.calls) == [
+        ("pshtt", "c.gov"), ("sslyze", "b.gov"), ("sslyze", "c.gov")]
+    assert scheduler.outstanding == 0
+
+
+def test_scheduler_gives_up_on_hung_tasks():
+    hung = []
+    timed_out = []
+
+    def submit(name, domain):
+        future = Future()
+        if (name, domain) == ("x", "hung.gov"):
+            hung.append(future)
+        else:
+            future.set_result(None)
+        return future
+
+    scheduler = Scheduler(["x", "y"], {"x": 1, "y": 1}, 2, submit,
+                          dependencies={"y": ["x"]}, timeouts={"x": 0.1},
+                          on_timeout=lambda name, domain, future: timed_out.append(
+                              (name, domain, future)))
+    started = time.monotonic()
+    scheduler.run(["hung.gov", "a.gov", "b.gov"])
+
+    assert time.monotonic() - started < 2
+    assert timed_out == [("x", "hung.gov", hung[0])]
+    # Dependents still run, and the slot is freed for the other domains.
+    assert scheduler.outstanding == 0
+    assert scheduler.running == {"x": 0, "y": 0}
+
+
+def test_scheduler_leaves_fast_tasks_alone():
+    timed_out = []
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        recorder = Recorder(executor)
+        scheduler = Scheduler(["x"], {"x": 2}, 2, recorder.submit,
+                              timeouts={"x": 5},
+                              on_timeout=lambda *args: timed_out.append(args))
+        scheduler.run(["%i.gov" % i for i in range(10)])
+
+    assert len(recorder.calls) == 10
+    assert timed_out == []
+
+
+def no_pressure():
+    return {'files': 0.1, 'memory': 0.1, 'load': 0.5}
+
+
+def test_adaptive_limits_slow_start():
+    controller = AdaptiveLimits({"x": (1, 10)}, usage=no_pressure, now=0)
+    assert controller.limits == {"x": 1}
+
+    for second in (5, 10, 15, 20):
+        controller.full("x")
+        controller.update(now=second)
+    assert controller.limits == {"x": 10}
+
+
+def test_adaptive_limits_only_grow_when_full():
+    controller = AdaptiveLimits({"x": (2, 10)}, usage=no_pressure, now=0)
+    controller.update(now=5)
+    assert controller.limits == {"x": 2}
+
+
+def test_adaptive_limits_back_off_on_timeouts():
+    controller = AdaptiveLimits({"x": (1, 100), "y": (1, 100)}, usage=no_pressure, now=0)
+    controller.limits = {"x": 40, "y": 40}
+    for i in range(10):
+        controller.record("x", 1.0, timed_out=(i == 0))
+        controller.record("y", 1.0)
+    controller.full("y")
+    controller.update(now=5)
+    assert controller.limits["x"] == 20
+    # Grows additively once out of slow start.
+    controller.full("x")
+    controller.update(now=10)
+    assert controller.limits["x"] == 25
+
+
+def test_adaptive_limits_back_off_on_latency():
+    controller = AdaptiveLimits({"x": (1, 100)}, usage=no_pressure, now=0)
+    controller.limits = {"x": 40}
+    for latency in (1.0, 1.1, 0.9, 1.0, 1.2):
+        controller.record("x", latency)
+    controller.update(now=5)
+    assert controller.limits["x"] == 40
+
+    for latency in (3.0, 2.5, 4.0, 3.0, 3.5):
+        controller.record("x", latency)
+    controller.update(now=10)
+    assert controller.limits["x"] == 20
+
+
+def test_adaptive_limits_back_off_on_pressure():
+    usage = {'files': 0.1, 'memory': 0.95, 'load': None}
+    controller = AdaptiveLimits({"x": (4, 100)}, usage=lambda: usage, now=0)
+    controller.limits = {"x": 6}
+    controller.full("x")
+    controller.update(now=5)
+    # Never below the lower bound.
+    assert controller.limits["x"] == 4
+
+
+def test_resource_usage():
+    usage = resource_usage()
+    assert set(usage) == {'files', 'memory', 'load'}
+
+
+def test_scheduler_follows_controller():
+    controller = AdaptiveLimits({"x": (2, 2), "y": (1, 1)}, usage=no_pressure)
+    with ThreadPoolExecutor(max_workers=10) as executor:
+        recorder = Recorder(executor, delays={"x": 0.01, "y": 0.01})
+        scheduler = Scheduler(["x", "y"], {"x": 5, "y": 5}, 10, recorder.submit,
+                              controller=controller)
+        scheduler.run(["%i.gov" % i for i in range(10)])
+
+    assert len(recorder.calls) == 20
+    assert recorder.peak["x"] <= 2
+    assert recorder.peak["y"] <= 1
+
+
+def test_throttle_governor_backs_off_and_recovers():
+    now = [0]
+    governor = ThrottleGovernor(8, clock=lambda: now[0])
+    assert governor.limit == 8
+
+    # A burst of throttles only counts once.
+    governor.throttled()
+    governor.throttled()
+    assert governor.limit == 4
+    now[0] += ThrottleGovernor.cooldown
+    governor.throttled()
+    assert governor.limit == 2
+    now[0] += ThrottleGovernor.cooldown
+    governor.throttled()
+    governor.throttled()
+    assert governor.limit == 1
+    assert governor.throttles == 5
+
+    # One more for each limit's worth of successes.
+    governor.succeeded()
+    assert governor.limit == 2
+    governor.succeeded()
+    assert governor.limit == 2
+    governor.succeeded()
+    assert governor.limit == 3
+    for i in range(100):
+        governor.succeeded()
+    assert governor.limit == 8
+
+
+def test_throttle_governor_limits_in_flight():
+    governor = ThrottleGovernor(4)
+    governor.limit = 2
+    lock = threading.Lock()
+    running = [0]
+    peak = [0]
+
+    def request(i):
+        with governor:
+            with lock:
+                running[0] += 1
+                peak[0] = max(peak[0], running[0])
+            time.sleep(0.01)
+            with lock:
+                running[0] -= 1
+
+    with ThreadPoolExecutor(max_workers=6) as executor:
+        list(executor.map(request, range(12)))
+
+    assert peak[0] == 2
+    assert governor.in_flight == 0
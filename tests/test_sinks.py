@@ -0,0 +1,110 @@
+import csv
+import json
+import sqlite3
+
+import pytest
+
+from .context import utils  # noqa
+from utils import sinks
+
+
+HEADERS = ["Domain", "Base Domain", "Live", "Score", "Errors"]
+ROWS = [
+    ["a.gov", "a.gov", True, 90, ["timeout"]],
+    ["b.gov", "b.gov", False, 72.5, []],
+    ["c.gov", "c.gov", None, None, None],
+]
+
+
+def test_csv_sink(tmpdir):
+    path = str(tmpdir.join("x.csv"))
+    sink = sinks.CSVSink(path, HEADERS)
+    sink.writerows(ROWS)
+    sink.close()
+
+    with open(path, encoding='utf-8', newline='') as results:
+        rows = list(csv.reader(results))
+    assert rows[0] == HEADERS
+    assert rows[1] == ["a.gov", "a.gov", "True", "90", "['timeout']"]
+    assert len(rows) == 4
+
+
+def test_jsonl_sink_keeps_types(tmpdir):
+    path = str(tmpdir.join("x.jsonl"))
+    sink = sinks.JSONLinesSink(path, HEADERS)
+    sink.writerows(ROWS)
+    sink.close()
+
+    with open(path) as results:
+        rows = [json.loads(line) for line in results]
+    assert rows[0] == dict(zip(HEADERS, ROWS[0]))
+    assert rows[1]["Score"] == 72.5
+    assert rows[2]["Live"] is None
+
+
+def test_sqlite_sink(tmpdir):
+    path = str(tmpdir.join("x.db"))
+    sink = sinks.SQLiteSink(path, HEADERS)
+    sink.writerows(ROWS)
+    assert sink.checkpoint() == 3
+    sink.close()
+
+    db = sqlite3.connect(path)
+    row = db.execute('SELECT * FROM "x" WHERE "Domain" = ?', ("a.gov",)).fetchone()
+    assert row == ("a.gov", "a.gov", 1, 90, '["timeout"]')
+    plan = db.execute(
+        'EXPLAIN QUERY PLAN SELECT * FROM "x" WHERE "Domain" = ?', ("a.gov",)).fetchall()
+    assert "x_domain" in str(plan)
+    db.close()
+
+
+def read_back(sink, path):
+    if sink is sinks.SQLiteSink:
+        db = sqlite3.connect(path)
+        rows = db.execute('SELECT * FROM "x" ORDER BY rowid').fetchall()
+        db.close()
+        return rows
+    with open(path, newline='') as results:
+        if sink is sinks.JSONLinesSink:
+            return [list(json.loads(line).values()) for line in results]
+        return list(csv.reader(results))[1:]
+
+
+@pytest.mark.parametrize("sink", [sinks.CSVSink, sinks.JSONLinesSink, sinks.SQLiteSink])
+def test_sink_restore(tmpdir, sink):
+    path = str(tmpdir.join("x.%s" % sink.extension))
+    results = sink(path, HEADERS)
+    results.writerows(ROWS[:1])
+    position = results.checkpoint()
+    results.writerows(ROWS[1:])
+    results.close()
+
+    # Resuming: cut back to the checkpoint, and carry on from there.
+    sink.restore(path, position)
+    results = sink(path, HEADERS, append=True)
+    results.writerows(ROWS[2:])
+    results.close()
+
+    domains = [row[0] for row in read_back(sink, path)]
+    assert domains == ["a.gov", "c.gov"]
+
+
+def test_parquet_sink(tmpdir):
+    pyarrow = pytest.importorskip("pyarrow")
+    import pyarrow.parquet
+
+    path = str(tmpdir.join("x.parquet"))
+    sink = sinks.ParquetSink(path, HEADERS)
+    sink.writerows(ROWS)
+    sink.close()
+
+    table = pyarrow.parquet.read_table(path)
+    assert table.schema.field("Live").type == pyarrow.bool_()
+    assert table.schema.field("Score").type == pyarrow.float64()
+    assert table.column("Domain").to_pylist() == ["a.gov", "b.gov", "c.gov"]
+    assert table.column("Errors").to_pylist() == ['["timeout"]', '[]', None]
+
+
+@pytest.mark.xfail(raises=ValueError)
+def test_sink_for_unknown_format():
+    sinks.sink_for("xml")
@@ -382,3 +382,13 @@ def test_options_for_scan_check_for_single_args(monkeypatch, command, expected):
     if not result == expected:
         pytest.set_trace()
     assert result == expected
+
+
+def test_preloaded_names():
+    index = subutils.preload_index(["B.gov", "a.b.gov", "app"])
+    assert index == frozenset(["b.gov", "a.b.gov", "app"])
+
+    assert subutils.preloaded_names("x.a.b.gov", index) == ["a.b.gov", "b.gov"]
+    assert subutils.preloaded_names("b.gov", index) == ["b.gov"]
+    assert subutils.preloaded_names("example.app", index) == ["app"]
+    assert subutils.preloaded_names("c.gov", index) == []
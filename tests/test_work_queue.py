@@ -0,0 +1,111 @@
+import threading
+import time
+
+import pytest
+
+from .context import utils  # noqa
+from utils.work_queue import Heartbeat, QueueResults, SQLiteQueue
+
+
+@pytest.fixture
+def work_queue(tmpdir):
+    queue = SQLiteQueue(str(tmpdir.join("scan.db")))
+    queue.add(["a.gov", "b.gov", "c.gov"], ["pshtt", "sslyze"])
+    return queue
+
+
+def test_lease_and_complete(work_queue):
+    assert work_queue.lease("one", 2, 60) == [("a.gov", []), ("b.gov", [])]
+    assert work_queue.lease("two", 2, 60) == [("c.gov", [])]
+    assert work_queue.lease("two", 2, 60) == []
+
+    assert work_queue.complete("one", [
+        ("pshtt", "a.gov", [["a.gov", "a.gov", True]]),
+        ("sslyze", "a.gov", []),
+    ]) == 2
+    counts = work_queue.counts()
+    assert (counts["leased"], counts["done"]) == (2, 1)
+    assert not work_queue.finished()
+
+    work_queue.complete("one", [("pshtt", "b.gov", []), ("sslyze", "b.gov", [])])
+    work_queue.complete("two", [("pshtt", "c.gov", []), ("sslyze", "c.gov", [])])
+    assert work_queue.finished()
+
+    results = list(work_queue.results())
+    assert results[:2] == [
+        ("pshtt", "a.gov", [["a.gov", "a.gov", True]]),
+        ("sslyze", "a.gov", []),
+    ]
+    assert len(results) == 6
+
+
+def test_add_skips_queued_domains(work_queue):
+    assert work_queue.add(["c.gov", "d.gov"], ["sslyze", "pshtt"]) == 1
+    assert work_queue.counts()["queued"] == 4
+
+
+@pytest.mark.xfail(raises=ValueError)
+def test_add_other_scanners(work_queue):
+    work_queue.add(["d.gov"], ["pshtt"])
+
+
+def test_expired_lease_requeued(work_queue):
+    now = time.time()
+    work_queue.lease("one", 1, 60, now=now)
+    work_queue.complete("one", [("pshtt", "a.gov", [])])
+
+    # Still leased by the first worker.
+    assert work_queue.lease("two", 1, 60, now=now + 30) == [("b.gov", [])]
+    # Handed over, with the finished scan left out.
+    assert work_queue.lease("two", 1, 60, now=now + 61) == [("a.gov", ["pshtt"])]
+
+    # The first worker's late results don't count.
+    assert work_queue.complete("one", [("sslyze", "a.gov", [])]) == 0
+    assert work_queue.complete("two", [("sslyze", "a.gov", [])]) == 1
+
+
+def test_gives_up_after_max_attempts(tmpdir):
+    work_queue = SQLiteQueue(str(tmpdir.join("scan.db")), max_attempts=2)
+    work_queue.add(["a.gov"], ["pshtt"])
+
+    now = time.time()
+    assert work_queue.lease("one", 1, 10, now=now) == [("a.gov", [])]
+    assert work_queue.lease("two", 1, 10, now=now + 11) == [("a.gov", [])]
+    assert work_queue.lease("three", 1, 10, now=now + 22) == []
+
+    assert work_queue.counts(now=now + 22)["failed"] == 1
+    assert work_queue.finished()
+    assert list(work_queue.results()) == [("pshtt", "a.gov", None)]
+
+
+def test_heartbeat_extends_lease(work_queue):
+    now = time.time()
+    work_queue.lease("one", 1, 60, now=now)
+    assert work_queue.heartbeat("one", 60, now=now + 50) == 1
+    assert work_queue.lease("two", 3, 60, now=now + 100) == [("b.gov", []), ("c.gov", [])]
+
+
+def test_heartbeat_thread(work_queue):
+    work_queue.lease("one", 1, 0.3)
+    heartbeat = Heartbeat(work_queue, "one", 0.3)
+    time.sleep(0.6)
+    heartbeat.stop()
+    assert work_queue.counts()["leased"] == 1
+
+
+def test_queue_results(work_queue):
+    work_queue.lease("one", 3, 60)
+
+    def put(domain):
+        for name in ("pshtt", "sslyze"):
+            results.put(name, domain, [[domain, name]])
+
+    with QueueResults(work_queue, "one") as results:
+        threads = [threading.Thread(target=put, args=(d,)) for d in ("a.gov", "b.gov", "c.gov")]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    assert work_queue.finished()
+    assert ("sslyze", "b.gov", [["b.gov", "sslyze"]]) in list(work_queue.results())
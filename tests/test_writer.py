@@ -0,0 +1,111 @@
+import csv
+import io
+import time
+
+import pytest
+
+from .context import utils  # noqa
+from utils.journal import Journal, load_journal
+from utils.sinks import CSVSink
+from utils.writer import ResultGate, ResultWriter
+
+
+class CountingSink:
+    """A sink writing CSV to a string, counting the writes made to it."""
+
+    def __init__(self):
+        self.file = io.StringIO()
+        self.writer = csv.writer(self.file)
+        self.calls = 0
+
+    def writerows(self, rows):
+        self.calls += 1
+        self.writer.writerows(rows)
+
+    def flush(self):
+        pass
+
+
+def handle():
+    return {'sink': CountingSink()}
+
+
+def test_result_writer_writes_everything():
+    handles = {"x": handle(), "y": handle()}
+    with ResultWriter(handles) as results:
+        for i in range(50):
+            results.put("x", "%i.gov" % i, [["%i.gov" % i, "a"], ["%i.gov" % i, "b"]])
+            results.put("y", "%i.gov" % i, [["%i.gov" % i, "c"]])
+
+    x = list(csv.reader(io.StringIO(handles["x"]['sink'].file.getvalue())))
+    y = list(csv.reader(io.StringIO(handles["y"]['sink'].file.getvalue())))
+    assert len(x) == 100
+    assert len(y) == 50
+    assert x[0] == ["0.gov", "a"]
+    assert x[1] == ["0.gov", "b"]
+
+
+def test_result_writer_batches_rows():
+    handles = {"x": handle()}
+    with ResultWriter(handles, batch_size=10, flush_interval=60) as results:
+        for i in range(25):
+            results.put("x", "%i.gov" % i, [["%i.gov" % i]])
+
+    # Two full batches, and what was left over at the end.
+    assert handles["x"]['sink'].calls == 3
+
+
+def test_result_writer_flushes_on_interval():
+    handles = {"x": handle()}
+    with ResultWriter(handles, batch_size=1000, flush_interval=0.01) as results:
+        results.put("x", "a.gov", [["a.gov"]])
+        time.sleep(0.1)
+        assert handles["x"]['sink'].file.getvalue() == "a.gov\r\n"
+
+
+class BrokenSink(CountingSink):
+    def writerows(self, rows):
+        raise IOError("Disk full.")
+
+
+@pytest.mark.xfail(raises=IOError)
+def test_result_writer_raises_errors_on_close():
+    handles = {"x": {'sink': BrokenSink()}}
+    with ResultWriter(handles, batch_size=1) as results:
+        results.put("x", "a.gov", [["a.gov"]])
+        results.put("x", "b.gov", [["b.gov"]])
+
+
+def test_result_writer_checkpoints(tmpdir):
+    sink = CSVSink(str(tmpdir.join("x.csv")), ["Domain", "Value"])
+    handles = {"x": {'sink': sink}}
+    journal = Journal(str(tmpdir.join("scan.journal")))
+    with ResultWriter(handles, journal=journal) as results:
+        results.put("x", "a.gov", [["a.gov", 1]])
+        results.put("x", "b.gov", [])
+    journal.close()
+    sink.close()
+
+    done, offsets = load_journal(str(tmpdir.join("scan.journal")))
+    assert done == {("x", "a.gov"), ("x", "b.gov")}
+    assert offsets == {"x": len("Domain,Value\r\na.gov,1\r\n")}
+
+
+def test_result_gate_lets_each_task_through_once():
+    class Results:
+        def __init__(self):
+            self.rows = []
+
+        def put(self, name, domain, rows):
+            self.rows.append((name, domain, rows))
+
+    results = Results()
+    gate = ResultGate(results)
+    gate.start("pshtt", "a.gov")
+
+    # e.g. timed out, and then the scan finishes after all.
+    assert gate.put("pshtt", "a.gov", [["timed out"]])
+    assert not gate.put("pshtt", "a.gov", [["finished"]])
+    # Never started.
+    assert not gate.put("pshtt", "b.gov", [["b.gov"]])
+    assert results.rows == [("pshtt", "a.gov", [["timed out"]])]
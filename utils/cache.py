@@ -0,0 +1,336 @@
+import abc
+import datetime
+import gzip
+import hashlib
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import zlib
+from collections import OrderedDict, namedtuple
+from typing import Any, Optional, Tuple
+
+
+###
+# Where each scanner's full scan data for each domain is cached
+# (--cache-backend), for --cache, --cache-ttl, and for scanners that use
+# other scanners' data (e.g. sslyze checking pshtt's).
+#
+#   files:  cache/<scanner>/<domain>.json, pretty-printed. The default,
+#           and what the cache has always looked like.
+#   fanout: cache/<scanner>/ab/cd/<domain>.json.gz, spread across
+#           directories by a hash of the domain, and gzipped compact
+#           JSON. For big scans, where one flat directory per scanner
+#           gets unwieldy. Falls back to reading the files layout, so
+#           an existing cache still works.
+#   sqlite: every scanner's data in one file, cache/cache.db, as
+#           compressed compact JSON. For very big scans, where millions
+#           of small files exhaust inodes and make backups crawl. Not for
+#           caches on network storage shared by several machines.
+#
+# A failed scan is cached as {"invalid": true}, like scan_utils.invalid().
+#
+# Each cache also keeps an index in memory of the few pshtt and trustymail
+# fields that other scanners' init_domain helpers ask about (e.g. whether
+# a domain is live, or redirects), from every scan that goes through it:
+# this run's results as they're cached, and anything read back. So each
+# domain's cached data is read and parsed at most once per process, not
+# once per helper call.
+###
+
+
+# Marker for a cached failed scan.
+INVALID = {'invalid': True}
+
+
+def format_datetime(obj) -> Optional[str]:
+    """Dates as ISO 8601 strings, for json.dumps's ``default``."""
+    if isinstance(obj, datetime.date):
+        return obj.isoformat()
+    elif isinstance(obj, str):
+        return obj
+    else:
+        return None
+
+
+def _compact(data: Any) -> bytes:
+    return json.dumps(data, sort_keys=True, separators=(",", ":"),
+                      default=format_datetime).encode("utf-8")
+
+
+def fresh(name: str, data: Any, written: float, ttls: dict = None,
+          now: float = None) -> Tuple[bool, Any]:
+    """
+    Whether cached ``data`` for a scanner, cached at ``written``, can be
+    used, and the data to use (None for a cached failed scan).
+
+    With ``ttls`` (from --cache-ttl), cached data older than the scanner's
+    TTL doesn't count. Cached failed scans use the "invalid" TTL, if set.
+    """
+    failed = isinstance(data, dict) and bool(data.get('invalid'))
+
+    if ttls:
+        ttl = ttls.get(name, ttls.get("*"))
+        if failed:
+            ttl = ttls.get("invalid", ttl)
+        # The cache is written once each scan finishes.
+        age = (now or time.time()) - written
+        if (ttl is not None) and (age > ttl):
+            return False, None
+
+    return True, (None if failed else data)
+
+
+# What's indexed about a domain's pshtt data.
+PshttSummary = namedtuple("PshttSummary", ["live", "redirect", "canonical_url", "https_live"])
+
+
+def summarize_pshtt(data: dict) -> PshttSummary:
+    # Bad hostnames still count, to get info about weak crypto even if
+    # the cert doesn't match.
+    endpoints = data.get("endpoints") or {}
+    https_live = any((endpoints.get(endpoint) or {}).get("live")
+                     for endpoint in ("https", "httpswww"))
+    return PshttSummary(data.get("Live"), data.get("Redirect"),
+                        data.get("Canonical URL"), https_live)
+
+
+# Which mail servers support STARTTLS.
+def summarize_trustymail(data: dict) -> Tuple[str, ...]:
+    results = data.get('Domain Supports STARTTLS Results')
+    return tuple(results.split(', ')) if results else ()
+
+
+SUMMARIES = {
+    'pshtt': summarize_pshtt,
+    'trustymail': summarize_trustymail,
+}
+
+
+class Cache(abc.ABC):
+    """
+    Scan data for each (scanner, domain), in some backend.
+
+    Summaries are kept for the ``max_summaries`` domains per scanner used
+    most recently (with the scan's window, the domains whose dependent
+    scans are still to run), and read from the cache again if need be.
+    """
+
+    max_summaries = 10000
+
+    def __init__(self) -> None:
+        self.summaries = {name: OrderedDict() for name in SUMMARIES}  # type: dict
+        self._summaries_lock = threading.Lock()
+
+    @abc.abstractmethod
+    def get(self, name: str, domain: str) -> Optional[Tuple[Any, float]]:
+        """The cached data, and when it was cached. None if there is none."""
+
+    @abc.abstractmethod
+    def store(self, name: str, domain: str, data: Any) -> None:
+        """Write a scan's data to the backend."""
+
+    def put(self, name: str, domain: str, data: Any) -> None:
+        """Cache a scan's data. ``None`` caches a failed scan."""
+        self.store(name, domain, data)
+        self.remember(name, domain, data)
+
+    def remember(self, name: str, domain: str, data: Any) -> Any:
+        """Index a scan's data, if it's from an indexed scanner. Returns its summary."""
+        if name not in SUMMARIES:
+            return None
+        failed = (not data) or (isinstance(data, dict) and bool(data.get('invalid')))
+        summary = None if failed else SUMMARIES[name](data)
+        summaries = self.summaries[name]
+        with self._summaries_lock:
+            summaries[domain] = summary
+            summaries.move_to_end(domain)
+            while len(summaries) > self.max_summaries:
+                summaries.popitem(last=False)
+        return summary
+
+    def summary(self, name: str, domain: str) -> Any:
+        """
+        The indexed summary of a domain's pshtt or trustymail data, read
+        from the cache the first time. None if there's no usable data.
+        """
+        summaries = self.summaries[name]
+        with self._summaries_lock:
+            if domain in summaries:
+                summaries.move_to_end(domain)
+                return summaries[domain]
+
+        entry = self.get(name, domain)
+        # Not remembered when missing, since it may be scanned later.
+        if entry is None:
+            return None
+        return self.remember(name, domain, entry[0])
+
+    def read(self, name: str, domain: str, ttls: dict = None,
+             now: float = None) -> Tuple[bool, Any]:
+        """
+        Look up a scanner's cached data for a domain. Returns whether usable
+        cached data was found, and the data (None for a cached failed scan).
+        See ``fresh`` for ``ttls``.
+        """
+        entry = self.get(name, domain)
+        if entry is None:
+            return False, None
+        data, written = entry
+        self.remember(name, domain, data)
+        return fresh(name, data, written, ttls=ttls, now=now)
+
+    def close(self) -> None:
+        pass
+
+
+class FileCache(Cache):
+    """The files backend: one pretty-printed JSON file per scan."""
+
+    def __init__(self, cache_dir: str) -> None:
+        super().__init__()
+        self.cache_dir = cache_dir
+
+    def path(self, name: str, domain: str) -> str:
+        return os.path.join(self.cache_dir, name, "%s.json" % domain)
+
+    def get(self, name: str, domain: str) -> Optional[Tuple[Any, float]]:
+        return self._read(self.path(name, domain))
+
+    def _read(self, path: str) -> Optional[Tuple[Any, float]]:
+        try:
+            with open(path, encoding='utf-8') as cached:
+                data = json.load(cached)
+            return data, os.path.getmtime(path)
+        except FileNotFoundError:
+            return None
+
+    def store(self, name: str, domain: str, data: Any) -> None:
+        content = json.dumps(INVALID if data is None else data, sort_keys=True,
+                             indent=2, default=format_datetime)
+        self._write(self.path(name, domain), content.encode("utf-8"))
+
+    # Written to a temporary file first, so a scanner reading another's
+    # data never sees half of it.
+    def _write(self, path: str, content: bytes) -> None:
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        descriptor, temporary = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+        try:
+            with os.fdopen(descriptor, 'wb') as output:
+                output.write(content)
+            os.replace(temporary, path)
+        except BaseException:
+            os.remove(temporary)
+            raise
+
+
+class FanoutCache(FileCache):
+    """The fanout backend: gzipped JSON files, spread out by hash."""
+
+    def path(self, name: str, domain: str) -> str:
+        digest = hashlib.sha1(domain.encode("utf-8")).hexdigest()
+        return os.path.join(self.cache_dir, name, digest[0:2], digest[2:4],
+                            "%s.json.gz" % domain)
+
+    def get(self, name: str, domain: str) -> Optional[Tuple[Any, float]]:
+        path = self.path(name, domain)
+        try:
+            with gzip.open(path, 'rb') as cached:
+                data = json.loads(cached.read().decode("utf-8"))
+            return data, os.path.getmtime(path)
+        except FileNotFoundError:
+            return self._read(FileCache.path(self, name, domain))
+
+    def store(self, name: str, domain: str, data: Any) -> None:
+        content = gzip.compress(_compact(INVALID if data is None else data))
+        self._write(self.path(name, domain), content)
+
+
+class SQLiteCache(Cache):
+    """The sqlite backend: one table of compressed JSON, in cache.db."""
+
+    # Seconds to wait on another process's lock on the database.
+    timeout = 60
+
+    def __init__(self, cache_dir: str) -> None:
+        super().__init__()
+        self.path = os.path.join(cache_dir, "cache.db")
+        os.makedirs(cache_dir, exist_ok=True)
+        self.lock = threading.Lock()
+        self.db = None  # type: sqlite3.Connection
+        self.pid = None  # type: int
+
+    # One connection per process (worker processes can't share the
+    # parent's), shared by its threads.
+    def _connection(self) -> sqlite3.Connection:
+        if (self.db is None) or (self.pid != os.getpid()):
+            self.db = sqlite3.connect(self.path, timeout=self.timeout,
+                                      check_same_thread=False)
+            self.pid = os.getpid()
+            self.db.execute("PRAGMA journal_mode = WAL")
+            self.db.execute("PRAGMA synchronous = NORMAL")
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS cache ("
+                "scanner TEXT NOT NULL, domain TEXT NOT NULL, "
+                "written REAL NOT NULL, data BLOB NOT NULL, "
+                "PRIMARY KEY (scanner, domain)) WITHOUT ROWID")
+            self.db.commit()
+        return self.db
+
+    def get(self, name: str, domain: str) -> Optional[Tuple[Any, float]]:
+        with self.lock:
+            row = self._connection().execute(
+                "SELECT data, written FROM cache WHERE scanner = ? AND domain = ?",
+                (name, domain)).fetchone()
+        if row is None:
+            return None
+        return json.loads(zlib.decompress(row[0]).decode("utf-8")), row[1]
+
+    def store(self, name: str, domain: str, data: Any) -> None:
+        content = zlib.compress(_compact(INVALID if data is None else data))
+        with self.lock:
+            db = self._connection()
+            db.execute(
+                "INSERT OR REPLACE INTO cache (scanner, domain, written, data) "
+                "VALUES (?, ?, ?, ?)", (name, domain, time.time(), content))
+            db.commit()
+
+    def close(self) -> None:
+        with self.lock:
+            if (self.db is not None) and (self.pid == os.getpid()):
+                self.db.close()
+            self.db = None
+
+
+BACKENDS = {
+    'files': FileCache,
+    'fanout': FanoutCache,
+    'sqlite': SQLiteCache,
+}
+
+# The cache for each cache directory, once opened.
+_caches = {}  # type: dict
+_caches_lock = threading.Lock()
+
+
+def cache_for(cache_dir: str = "./cache", backend: str = None) -> Cache:
+    """
+    The cache in ``cache_dir``. Giving a ``backend`` (the scan does, from
+    --cache-backend) sets which one is used for that directory from then
+    on in this process; otherwise it's whatever was set, or files.
+    """
+    key = os.path.abspath(cache_dir)
+    with _caches_lock:
+        cache = _caches.get(key)
+        # Exactly that backend: a FanoutCache is a FileCache, too.
+        if (backend is not None) and (type(cache) is not BACKENDS[backend]):
+            if cache is not None:
+                cache.close()
+            cache = None
+        if cache is None:
+            cache = BACKENDS[backend or "files"](cache_dir)
+            _caches[key] = cache
+        return cache
@@ -0,0 +1,71 @@
+import json
+import os
+from typing import Dict, Iterable, Set, Tuple
+
+
+###
+# An append-only record of which (scanner, domain) scans are finished
+# and safely on disk, so that an interrupted scan can pick up where it
+# left off (--resume).
+#
+# Each line is a checkpoint: the scans finished since the last one, and
+# the position of each scanner's results (for a CSV, its size) once their
+# rows were written and synced to disk. On resume, anything in the results
+# past its last checkpointed position is from scans that never made it
+# into the journal, and is cut off so those scans can be run again without
+# duplicating rows.
+###
+
+
+class Journal:
+    """Append checkpoints to the journal at ``path``."""
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.file = open(path, 'a')
+
+    def record(self, done: Iterable[Tuple[str, str]], offsets: Dict[str, int]) -> None:
+        """
+        Add a checkpoint, once the rows for every scan in ``done`` have been
+        synced to the results, which are at ``offsets[name]``.
+        """
+        line = json.dumps({'done': list(done), 'offsets': offsets})
+        self.file.write(line + "\n")
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def close(self) -> None:
+        self.file.close()
+
+
+def load_journal(path: str) -> Tuple[Set[Tuple[str, str]], Dict[str, int]]:
+    """
+    Read back a journal: every (scanner, domain) scan that was finished,
+    and the position of each scanner's results at its last checkpoint.
+
+    A checkpoint that was cut off partway through being written (e.g. by
+    a crash) is dropped from the end of the file, so that new ones can be
+    appended cleanly.
+    """
+    done = set()  # type: Set[Tuple[str, str]]
+    offsets = {}  # type: Dict[str, int]
+    if not os.path.exists(path):
+        return done, offsets
+
+    valid = 0
+    with open(path, 'rb') as journal:
+        for raw in journal:
+            try:
+                if not raw.endswith(b"\n"):
+                    raise ValueError("Incomplete checkpoint.")
+                checkpoint = json.loads(raw.decode("utf-8"))
+            except ValueError:
+                break
+            done.update((name, domain) for name, domain in checkpoint['done'])
+            offsets.update(checkpoint['offsets'])
+            valid += len(raw)
+
+    with open(path, 'r+b') as journal:
+        journal.truncate(valid)
+
+    return done, offsets
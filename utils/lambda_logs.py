@@ -0,0 +1,241 @@
+import csv
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+import strict_rfc3339
+
+from utils import scan_utils
+
+
+###
+# --lambda-details: how long each Lambda task says it took and how much
+# memory it used, from the REPORT line Lambda logs to CloudWatch Logs
+# when each invoke finishes.
+#
+# Rather than asking for each domain's REPORT line in turn, the REPORT
+# lines are fetched a log stream at a time (a warm Lambda container logs
+# every invoke it handles to the same stream), for several streams at
+# once. Logs show up a while after the scan, so streams that are still
+# missing some are asked again every so often, until a deadline.
+# Throttled requests are retried, backing off.
+###
+
+
+# How many log streams to fetch at once.
+workers = 10
+# How long to keep waiting for logs to show up, in seconds, and how often
+# to check again.
+deadline = 120
+poll_interval = 5
+# How many times to retry a throttled request, and the longest first and
+# last waits before retrying.
+max_retries = 6
+backoff = 0.5
+max_backoff = 30
+
+# A log stream: its group, and name.
+Stream = Tuple[str, str]
+
+
+def parse_report(message: str) -> dict:
+    """
+    The fields of a REPORT log line, e.g. {"RequestId": "...",
+    "Duration": "10.5 ms", "Max Memory Used": "40 MB", ...}.
+    """
+    fields = {}
+    for piece in message.strip().split("\t"):
+        name, _, value = piece.partition(":")
+        if name.startswith("REPORT "):
+            name = name[len("REPORT "):]
+        fields[name.strip()] = value.strip()
+    return fields
+
+
+class LogFetcher:
+    """
+    Finds the REPORT log events for Lambda request IDs. ``logs_client``
+    is a boto3 CloudWatch Logs client, or anything with the same
+    ``filter_log_events``.
+    """
+
+    def __init__(self, logs_client: Any, workers: int = workers,
+                 deadline: float = deadline, poll_interval: float = poll_interval,
+                 max_retries: int = max_retries, backoff: float = backoff,
+                 sleep: Callable[[float], None] = time.sleep,
+                 clock: Callable[[], float] = time.monotonic) -> None:
+        self.logs_client = logs_client
+        self.workers = workers
+        self.deadline = deadline
+        self.poll_interval = poll_interval
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.sleep = sleep
+        self.clock = clock
+        self.calls = 0
+
+    def fetch(self, wanted: Dict[Stream, Tuple[set, float]]) -> Tuple[dict, dict]:
+        """
+        Given the request IDs wanted from each log stream, and the
+        earliest time (in seconds) to look from, returns the REPORT event
+        found for each request ID, and the error for any stream that
+        couldn't be read.
+        """
+        found = {}  # type: Dict[str, dict]
+        errors = {}  # type: Dict[Stream, str]
+        pending = {stream: set(ids) for stream, (ids, since) in wanted.items() if ids}
+        give_up = self.clock() + self.deadline
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            while pending:
+                streams = list(pending)
+                results = executor.map(
+                    lambda stream: self._reports(stream, wanted[stream][1]), streams)
+                for stream, (reports, error) in zip(streams, results):
+                    found.update({
+                        request_id: event for request_id, event in reports.items()
+                        if request_id in pending[stream]
+                    })
+                    pending[stream] -= set(reports)
+                    if error is not None:
+                        errors[stream] = error
+                    if (error is not None) or not pending[stream]:
+                        del pending[stream]
+
+                if not pending:
+                    break
+                if self.clock() + self.poll_interval > give_up:
+                    break
+                logging.warning("\tWaiting on logs for %i Lambda tasks..." % sum(
+                    len(ids) for ids in pending.values()))
+                self.sleep(self.poll_interval)
+
+        return found, errors
+
+    # Every REPORT event in a log stream since a time, by request ID, and
+    # an error, if the stream couldn't be read.
+    def _reports(self, stream: Stream, since: float) -> Tuple[dict, Any]:
+        group, name = stream
+        reports = {}
+        arguments = {
+            'logGroupName': group,
+            'logStreamNames': [name],
+            'filterPattern': '"REPORT RequestId"',
+        }
+        if since:
+            arguments['startTime'] = int(since * 1000)
+
+        try:
+            while True:
+                response = self._call(arguments)
+                for event in response.get('events', []):
+                    request_id = parse_report(event.get('message', '')).get("RequestId")
+                    if request_id:
+                        reports[request_id] = event
+                if not response.get('nextToken'):
+                    break
+                arguments['nextToken'] = response['nextToken']
+        except Exception as error:
+            if scan_utils.throttled(error):
+                return reports, "Lambda declined, too many requests."
+            logging.warning("\tCouldn't read logs for %s, %s: %s" % (group, name, error))
+            return reports, "Unknown exception: %s" % error
+        return reports, None
+
+    # Retries throttled requests, backing off.
+    def _call(self, arguments: dict) -> dict:
+        attempt = 0
+        while True:
+            self.calls += 1
+            try:
+                return self.logs_client.filter_log_events(**arguments)
+            except Exception as error:
+                if (not scan_utils.throttled(error)) or (attempt >= self.max_retries):
+                    raise
+                self.sleep(scan_utils.backoff(attempt, self.backoff, max_backoff))
+                attempt += 1
+
+
+def _timestamp(value: str) -> Optional[float]:
+    try:
+        return strict_rfc3339.rfc3339_to_timestamp(value)
+    except (strict_rfc3339.InvalidRFC3339Error, TypeError):
+        return None
+
+
+def _rows(filename: str) -> Iterable[List[str]]:
+    with open(filename, encoding='utf-8', newline='') as input_file:
+        yield from csv.reader(input_file)
+
+
+def details_for(row: dict, event: dict, error: str) -> dict:
+    """The detail fields for one CSV row, from its REPORT event."""
+    if event is None:
+        return {'errors': error or "No logs found for this task."}
+
+    details = {'errors': None, 'log_delay': None}
+    end_time = _timestamp(row.get('Lambda End Time'))
+    if end_time:
+        details['log_delay'] = event['ingestionTime'] / 1000 - end_time
+
+    report = parse_report(event.get('message', ''))
+    details['reported_duration'] = report.get("Duration")
+    details['memory_used'] = report.get("Max Memory Used")
+    return details
+
+
+def add_details(filename: str, logs_client: Any, detail_headers: List[str],
+                format_row: Callable[[dict], list], fetcher: LogFetcher = None) -> None:
+    """
+    Add ``detail_headers`` columns to a results CSV with Lambda --meta
+    columns, from ``format_row(details_for(...))`` for each row.
+
+    The CSV is read through twice, once for which logs to fetch and once
+    to write it out again with the details, so it's never all in memory.
+    """
+    fetcher = fetcher or LogFetcher(logs_client)
+
+    # Which request IDs to look for, in which log streams.
+    wanted = {}  # type: dict
+    header = None
+    for row in _rows(filename):
+        if header is None:
+            header = row
+            continue
+        fields = dict(zip(header, row))
+        request_id = fields.get('Lambda Request ID')
+        if not request_id:
+            continue
+        stream = (fields.get('Lambda Log Group Name'), fields.get('Lambda Log Stream Name'))
+        ids, since = wanted.get(stream, (set(), None))
+        ids.add(request_id)
+        start_time = _timestamp(fields.get('Lambda Start Time'))
+        if start_time and ((since is None) or (start_time < since)):
+            since = start_time
+        wanted[stream] = (ids, since)
+
+    if header is None:
+        return
+
+    found, errors = fetcher.fetch(wanted)
+    logging.warning("Found logs for %i of %i Lambda tasks in %s, with %i requests." % (
+        len(found), sum(len(ids) for ids, since in wanted.values()), filename, fetcher.calls))
+
+    tmp_filename = "%s.tmp" % filename
+    with open(tmp_filename, 'w', encoding='utf-8', newline='') as tmp_file:
+        writer = csv.writer(tmp_file)
+        rows = _rows(filename)
+        writer.writerow(next(rows) + detail_headers)
+        for row in rows:
+            fields = dict(zip(header, row))
+            request_id = fields.get('Lambda Request ID')
+            stream = (fields.get('Lambda Log Group Name'), fields.get('Lambda Log Stream Name'))
+            if request_id:
+                details = details_for(fields, found.get(request_id), errors.get(stream))
+            else:
+                details = {'errors': "No Lambda request ID."}
+            writer.writerow(row + format_row(details))
+
+    os.replace(tmp_filename, filename)
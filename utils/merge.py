@@ -0,0 +1,148 @@
+import argparse
+import csv
+import heapq
+import json
+import logging
+import os
+from pathlib import Path
+from typing import List, Union
+
+import strict_rfc3339
+
+from utils import scan_utils
+
+
+###
+# Combining the results of a scan split across machines with --shard.
+#
+# Each shard's CSVs are merged row by row, without reading any of them
+# into memory. If the shards were each scanned with --sort, the merged
+# CSV is sorted too.
+###
+
+
+def merge_csvs(inputs: List[str], output: str) -> int:
+    """
+    Merge CSVs with the same header row into one. Returns the number of
+    rows written (not counting the header).
+    """
+    files = [open(path, encoding='utf-8', newline='') for path in inputs]
+    try:
+        readers = [csv.reader(f) for f in files]
+        headers = [next(reader, None) for reader in readers]
+
+        # The first file with a header sets the columns.
+        first, header = next(
+            ((path, h) for path, h in zip(inputs, headers) if h is not None), (None, None))
+        for path, other in zip(inputs, headers):
+            if (other is not None) and (other != header):
+                raise ValueError("%s has different columns than %s." % (path, first))
+
+        count = 0
+        with open(output, 'w', encoding='utf-8', newline='') as output_file:
+            writer = csv.writer(output_file)
+            if header is not None:
+                writer.writerow(header)
+
+            rows = [(row for row in reader if row) for reader in readers]
+            for row in heapq.merge(*rows, key=lambda row: row[0]):
+                writer.writerow(row)
+                count += 1
+    finally:
+        for f in files:
+            f.close()
+
+    return count
+
+
+def _timestamp(value: Union[str, None]) -> Union[float, None]:
+    if not value:
+        return None
+    return strict_rfc3339.rfc3339_to_timestamp(value)
+
+
+def _span(starts: list, ends: list) -> dict:
+    starts = [t for t in (_timestamp(v) for v in starts) if t is not None]
+    ends = [t for t in (_timestamp(v) for v in ends) if t is not None]
+    start = min(starts) if starts else None
+    end = max(ends) if ends else None
+    duration = None
+    if (start is not None) and (end is not None):
+        duration = end - start
+    return {
+        'start_time': scan_utils.utc_timestamp(start),
+        'end_time': scan_utils.utc_timestamp(end),
+        'duration': scan_utils.just_microseconds(duration),
+    }
+
+
+def merge_meta(metas: List[dict], command: str = None) -> dict:
+    """
+    Combine the meta.json of each shard. Times cover the whole scan: from
+    the first shard to start to the last one to finish, overall and for
+    each scanner. Each shard's own command and scan UUID are kept.
+    """
+    merged = _span([m.get('start_time') for m in metas],
+                   [m.get('end_time') for m in metas])
+
+    names = sorted({name for m in metas for name in m.get('durations', {})})
+    merged['durations'] = {}
+    for name in names:
+        timings = [m['durations'][name] for m in metas if name in m.get('durations', {})]
+        merged['durations'][name] = _span([t.get('start_time') for t in timings],
+                                          [t.get('end_time') for t in timings])
+
+    merged['command'] = command
+    merged['shards'] = [
+        {key: m.get(key) for key in ('shard', 'command', 'scan_uuid')}
+        for m in metas
+    ]
+    return merged
+
+
+def merge_results(shard_dirs: List[str], results_dir: str, command: str = None) -> None:
+    """
+    Merge the result CSVs and meta.json from each shard's results
+    directory into ``results_dir``.
+    """
+    scan_utils.mkdir_p(results_dir)
+
+    names = sorted({
+        path.name for shard_dir in shard_dirs for path in Path(shard_dir).glob("*.csv")
+    })
+    for name in names:
+        inputs = [
+            os.path.join(shard_dir, name) for shard_dir in shard_dirs
+            if os.path.exists(os.path.join(shard_dir, name))
+        ]
+        count = merge_csvs(inputs, os.path.join(results_dir, name))
+        logging.warning("Merged %i rows from %i shards into %s." % (count, len(inputs), name))
+
+    metas = []
+    for shard_dir in shard_dirs:
+        path = os.path.join(shard_dir, "meta.json")
+        if os.path.exists(path):
+            metas.append(json.loads(scan_utils.read(path)))
+    if metas:
+        scan_utils.write(scan_utils.json_for(merge_meta(metas, command=command)),
+                         os.path.join(results_dir, "meta.json"))
+
+
+def options() -> dict:
+    """
+    Parse options for the ``merge`` command.
+
+    Impure
+        Reads from sys.argv.
+    """
+    parser = argparse.ArgumentParser(
+        prog="merge", description="Combine the results of a scan run with --shard.")
+    parser.add_argument("shards", nargs="+", help="".join([
+        "The results/ directory of each shard."
+    ]))
+    parser.add_argument("--output", default="./", help="".join([
+        "Where to output the merged 'results/' directory. Defaults to './'."
+    ]))
+    parser.add_argument("--debug", action="store_true",
+                        help="Print out more stuff.")
+    return {k: v for k, v in vars(parser.parse_args()).items() if v is not None}
@@ -0,0 +1,61 @@
+import base64
+import gzip
+import json
+from typing import Any, Optional
+
+from utils.cache import format_datetime
+
+
+###
+# What goes over the wire to and from Lambda: compact JSON, and with
+# --lambda-compress, gzipped inside a small JSON envelope,
+# {"gzip": "<Base64>"}, since Lambda payloads have to be JSON.
+#
+# Used on both ends (the scan, and lambda/lambda_handler.py), so it only
+# needs the standard library (and utils/cache.py, which does too).
+###
+
+
+# Options and environment keys every Lambda payload has, whatever the
+# scanner declares: the handler's logging, and how the scan is run.
+OPTIONS = ("debug", "log")
+ENVIRONMENT = ("scan_method", "scan_uuid")
+
+
+def dumps(payload: Any) -> str:
+    return json.dumps(payload, sort_keys=True, separators=(",", ":"),
+                      default=format_datetime)
+
+
+def encode(payload: Any, compress: bool = False) -> bytes:
+    """A payload as compact JSON, gzipped in an envelope if ``compress``."""
+    content = dumps(payload).encode("utf-8")
+    if not compress:
+        return content
+    return dumps(wrap(content)).encode("utf-8")
+
+
+def wrap(content: bytes) -> dict:
+    """The envelope for already-encoded JSON."""
+    return {'gzip': base64.b64encode(gzip.compress(content)).decode("ascii")}
+
+
+def wrapped(payload: Any) -> bool:
+    return isinstance(payload, dict) and (set(payload.keys()) == {'gzip'})
+
+
+def unwrap(payload: Any) -> Any:
+    """A parsed payload, unpacked from its envelope if it's in one."""
+    if wrapped(payload):
+        return json.loads(gzip.decompress(base64.b64decode(payload['gzip'])).decode("utf-8"))
+    return payload
+
+
+def slim(values: dict, keys: Optional[list], always: tuple) -> dict:
+    """
+    Just the ``keys`` a scanner declared it needs (plus ``always``), or
+    everything if it didn't declare any.
+    """
+    if keys is None:
+        return dict(values)
+    return {key: values[key] for key in (*always, *keys) if key in values}
@@ -0,0 +1,255 @@
+import asyncio
+import threading
+import time
+from collections import deque
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Iterable, Iterator, Tuple
+
+
+###
+# Execution pools used by the scheduler, alongside the standard
+# ThreadPoolExecutor. Each pool hands back concurrent.futures.Future
+# objects, so the scheduler can wait on all of them the same way.
+###
+
+
+class EventLoopThread:
+    """
+    Run coroutines on an asyncio event loop in a background thread.
+
+    Scanners with an ``async def scan`` run here, so that thousands of
+    in-flight domains don't each need their own OS thread. At most
+    ``concurrency`` coroutines run at once.
+    """
+
+    def __init__(self, concurrency: int) -> None:
+        self.concurrency = concurrency
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+        # Semaphores bind to the running loop, so create it on the loop.
+        self.semaphore = asyncio.run_coroutine_threadsafe(
+            self._make_semaphore(), self.loop).result()
+
+    def _run(self) -> None:
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    async def _make_semaphore(self) -> asyncio.Semaphore:
+        return asyncio.Semaphore(self.concurrency)
+
+    async def _guarded(self, function, args):
+        async with self.semaphore:
+            return await function(*args)
+
+    def submit(self, function: Callable[..., Any], *args: Any) -> Future:
+        """Schedule ``function(*args)`` (a coroutine function) on the loop."""
+        return asyncio.run_coroutine_threadsafe(
+            self._guarded(function, args), self.loop)
+
+    def close(self) -> None:
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class RecyclingProcessPool:
+    """
+    A pool of ``workers`` processes, replaced by a fresh pool once it has
+    been handed ``max_tasks`` tasks per worker. Contains leaks in
+    long-running worker processes (e.g. sslyze's SynchronousScanner).
+
+    ``initializer(*initargs)`` runs once in each new worker process, so
+    large shared state only has to be sent once per process rather than
+    with every task.
+
+    The old pool is shut down without waiting, so its last tasks finish
+    while the new pool starts up (briefly doubling the process count).
+    """
+
+    def __init__(self, workers: int, max_tasks: int = None,
+                 initializer: Callable[..., Any] = None,
+                 initargs: Tuple = ()) -> None:
+        self.workers = workers
+        self.max_tasks = max_tasks
+        self.initializer = initializer
+        self.initargs = initargs
+        self.executor = None  # type: ProcessPoolExecutor
+        self.submitted = 0
+        self.recycled = 0
+
+    def _new_executor(self) -> ProcessPoolExecutor:
+        return ProcessPoolExecutor(max_workers=self.workers,
+                                   initializer=self.initializer,
+                                   initargs=self.initargs)
+
+    def submit(self, function: Callable[..., Any], *args: Any) -> Future:
+        """Run ``function(*args)`` in a worker process."""
+        if (self.executor is not None) and (self.max_tasks is not None) and \
+                (self.submitted >= self.max_tasks * self.workers):
+            self.executor.shutdown(wait=False)
+            self.executor = None
+            self.recycled += 1
+
+        # Processes are only started once there's work for them.
+        if self.executor is None:
+            self.executor = self._new_executor()
+            self.submitted = 0
+
+        self.submitted += 1
+        return self.executor.submit(function, *args)
+
+    def close(self) -> None:
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+            self.executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class Batcher:
+    """
+    Gather items submitted one at a time (e.g. domains to scan) into
+    batches, and hand each batch to ``send(key, items)``, which returns
+    one result per item, in order. Items are only batched with others
+    submitted under the same ``key`` (e.g. the same scanner).
+
+    A batch goes out once it has ``size`` items, or ``linger`` seconds
+    after its first item came in, whichever is first. Up to ``workers``
+    batches are sent at once, in the Batcher's own threads. Each item's
+    Future gets its result, or the exception if sending the batch failed.
+    """
+
+    def __init__(self, send: Callable[[Any, list], list], size: int,
+                 linger: float = 0.1, workers: int = 10) -> None:
+        self.send = send
+        self.size = size
+        self.linger = linger
+        self.senders = ThreadPoolExecutor(max_workers=workers)
+        self.pending = {}  # type: dict
+        self.deadlines = {}  # type: dict
+        self.condition = threading.Condition()
+        self.closed = False
+        self.batches = 0
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def submit(self, key: Any, item: Any) -> Future:
+        """Queue ``item`` to go out in the next batch for ``key``."""
+        future = Future()  # type: Future
+        with self.condition:
+            if self.closed:
+                raise RuntimeError("Batcher is closed.")
+            batch = self.pending.setdefault(key, [])
+            if not batch:
+                self.deadlines[key] = time.monotonic() + self.linger
+                self.condition.notify()
+            batch.append((item, future))
+            if len(batch) >= self.size:
+                self._flush(key)
+        return future
+
+    # Only called holding the condition.
+    def _flush(self, key: Any) -> None:
+        batch = self.pending.pop(key)
+        del self.deadlines[key]
+        self.batches += 1
+        self.senders.submit(self._send, key, batch)
+
+    def _send(self, key: Any, batch: list) -> None:
+        futures = [future for item, future in batch]
+        try:
+            results = self.send(key, [item for item, future in batch])
+            if len(results) != len(batch):
+                raise ValueError("Got %i results for a batch of %i." % (
+                    len(results), len(batch)))
+        except BaseException as exception:
+            for future in futures:
+                future.set_exception(exception)
+            return
+        for future, result in zip(futures, results):
+            future.set_result(result)
+
+    # Sends batches that have waited long enough to fill up.
+    def _run(self) -> None:
+        with self.condition:
+            while not self.closed:
+                now = time.monotonic()
+                for key in [k for k, d in self.deadlines.items() if d <= now]:
+                    self._flush(key)
+                wait = min(self.deadlines.values(), default=None)
+                self.condition.wait(None if wait is None else wait - now)
+
+    def close(self) -> None:
+        """Send whatever's left, and wait for every batch to finish."""
+        with self.condition:
+            self.closed = True
+            for key in list(self.pending):
+                self._flush(key)
+            self.condition.notify()
+        self.thread.join()
+        self.senders.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def then(future: Future, function: Callable[[Any], Any]) -> Future:
+    """
+    A Future for ``function(future.result())``, which is called as soon
+    as ``future`` is done. Unlike a plain done callback, waiting on the
+    returned Future also waits for ``function`` to finish.
+
+    Cancelling the returned Future cancels ``future`` too, if it hasn't
+    started, and ``function`` isn't called.
+    """
+    chained = Future()  # type: Future
+
+    def done(_):
+        if not chained.set_running_or_notify_cancel():
+            return
+        try:
+            chained.set_result(function(future.result()))
+        except BaseException as exception:
+            chained.set_exception(exception)
+
+    def cancelled(_):
+        if chained.cancelled():
+            future.cancel()
+
+    chained.add_done_callback(cancelled)
+    future.add_done_callback(done)
+    return chained
+
+
+def prefetch(function: Callable[[Any], Any], items: Iterable[Any],
+             executor: Executor, ahead: int) -> Iterator[Tuple[Any, Any]]:
+    """
+    Yield ``(item, function(item))`` for each item, in order, while
+    computing the results for up to ``ahead`` items at once in the
+    background. Useful for slow lookups (e.g. DNS) on a lazy stream.
+    """
+    pending = deque()  # type: deque
+    for item in items:
+        pending.append((item, executor.submit(function, item)))
+        if len(pending) >= ahead:
+            item, future = pending.popleft()
+            yield item, future.result()
+
+    while pending:
+        item, future = pending.popleft()
+        yield item, future.result()
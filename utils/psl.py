@@ -0,0 +1,165 @@
+import functools
+import hashlib
+import logging
+import marshal
+import os
+import tempfile
+from typing import Iterable, List, Tuple, Union
+
+
+###
+# The Public Suffix List, as a trie of domain labels from right to left
+# (e.g. "gov", then "ca.gov"), for finding the base domain of any
+# hostname (scan_utils.base_domain_for).
+#
+# Gives exactly the same answers as the publicsuffix package, which this
+# replaces for lookups, but:
+#
+# * the compiled trie is saved next to the list (in the cache), and
+#   loaded from there as long as the list hasn't changed, so each worker
+#   process doesn't have to parse the whole list again at startup.
+# * recent lookups are remembered, since scans look up the same
+#   hostnames over and over (e.g. for every row they write).
+# * once built, it's never changed, so any number of threads can use it.
+###
+
+
+# Bump when the compiled format changes, so old files get rebuilt.
+FORMAT = 1
+
+# How many recent lookups to remember.
+lookup_cache_size = 65536
+
+# A node is 0 or 1 (whether it's an exception rule, like "!www.ck") if it
+# has no children, and otherwise (0 or 1, {label: node}).
+Node = Union[int, Tuple[int, dict]]
+
+
+class SuffixTrie:
+    """A compiled Public Suffix List. See ``get_public_suffix``."""
+
+    def __init__(self, root: Node) -> None:
+        self.root = root
+        self.get_public_suffix = functools.lru_cache(maxsize=lookup_cache_size)(self._lookup)
+
+    @classmethod
+    def from_lines(cls, lines: Iterable[str]) -> "SuffixTrie":
+        """Compile the lines of a Public Suffix List file."""
+        root = [0]  # type: list
+        for line in lines:
+            line = line.strip()
+            if line.startswith('//') or not line:
+                continue
+
+            rule = line.split()[0].lstrip('.')
+            negate = 0
+            if rule.startswith('!'):
+                negate = 1
+                rule = rule[1:]
+
+            node = root
+            for label in reversed(rule.split('.')):
+                if len(node) == 1:
+                    node.append({})
+                node = node[1].setdefault(label, [0])
+            node[0] = negate
+
+        return cls(_freeze(root))
+
+    def _lookup(self, domain: str) -> str:
+        """
+        get_public_suffix("www.example.com") -> "example.com", like the
+        publicsuffix package: the hostname's registrable base domain.
+        """
+        parts = domain.lower().strip('.').split('.')
+        count = len(parts)
+
+        # Most hostnames only ever match one rule per label, so just follow
+        # their labels down the trie, to the deepest rule that isn't an
+        # exception. Wildcards ("*") need the full search.
+        node = self.root
+        depth = deepest = 1
+        while True:
+            if node.__class__ is int:
+                if node == 0:
+                    deepest = depth
+                break
+
+            negate, children = node
+            if negate == 0:
+                deepest = depth
+            if depth >= count:
+                break
+            if '*' in children:
+                return self._search(parts)
+            node = children.get(parts[-depth])
+            if node is None:
+                break
+            depth += 1
+
+        return '.'.join(parts[count - deepest:])
+
+    def _search(self, parts: List[str]) -> str:
+        count = len(parts)
+        hits = [None] * count  # type: List[Union[int, None]]
+
+        # Every matching rule, wildcards before exact labels, so that
+        # exceptions to a wildcard (like "!www.ck" for "*.ck") win.
+        stack = [(1, self.root)]  # type: List[Tuple[int, Node]]
+        pop, push = stack.pop, stack.append
+        while stack:
+            depth, node = pop()
+            if node.__class__ is int:
+                hits[-depth] = node
+                continue
+
+            negate, children = node
+            hits[-depth] = negate
+            if depth < count:
+                exact = children.get(parts[-depth])
+                if exact is not None:
+                    push((depth + 1, exact))
+                wildcard = children.get('*')
+                if wildcard is not None:
+                    push((depth + 1, wildcard))
+
+        for i, hit in enumerate(hits):
+            if hit == 0:
+                return '.'.join(parts[i:])
+        return '.'.join(parts)
+
+
+def _freeze(node: list) -> Node:
+    if len(node) == 1:
+        return node[0]
+    return (node[0], {label: _freeze(child) for label, child in node[1].items()})
+
+
+def load(lines: List[str], compiled_path: str = None) -> SuffixTrie:
+    """
+    Compile the lines of a Public Suffix List, or with ``compiled_path``,
+    load the trie compiled from the same lines last time (and save it
+    there, if they've changed).
+    """
+    if compiled_path is None:
+        return SuffixTrie.from_lines(lines)
+
+    digest = hashlib.sha256("".join(lines).encode("utf-8")).hexdigest()
+    try:
+        with open(compiled_path, 'rb') as compiled:
+            version, source, root = marshal.loads(compiled.read())
+        if (version, source) == (FORMAT, digest):
+            return SuffixTrie(root)
+    except (OSError, EOFError, ValueError, TypeError):
+        pass
+
+    trie = SuffixTrie.from_lines(lines)
+    try:
+        directory = os.path.dirname(compiled_path) or "."
+        descriptor, temporary = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+        with os.fdopen(descriptor, 'wb') as compiled:
+            marshal.dump((FORMAT, digest, trie.root), compiled)
+        os.replace(temporary, compiled_path)
+    except OSError as error:
+        logging.debug("Couldn't save the compiled Public Suffix List: %s" % error)
+    return trie
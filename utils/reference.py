@@ -0,0 +1,173 @@
+import base64
+import json
+import logging
+import os
+import re
+import tempfile
+import time
+from typing import Any, Callable, NamedTuple
+
+import requests
+
+
+###
+# Third-party reference data that scans depend on (the Public Suffix
+# List, and Chrome's HSTS preload and pending lists), cached in cache/.
+#
+# Each dataset is kept in a ready-to-use form (e.g. just the preloaded
+# names), with a .meta.json file next to it saying when it was fetched,
+# and its ETag and Last-Modified headers. It's used as is until its TTL
+# runs out, then checked with a conditional request, so an unchanged
+# list is never downloaded again. If the check fails, the cached copy
+# keeps being used. To force a fresh download, delete the cached file.
+###
+
+
+# Seconds to wait on a download.
+timeout = 60
+
+
+class Dataset(NamedTuple):
+    name: str
+    url: str
+    # Where it's cached, in the cache directory.
+    filename: str
+    # How long a fetched copy is used without checking for a new one.
+    ttl: float
+    # Downloaded bytes -> what's cached (text).
+    parse: Callable[[bytes], str]
+    # Cached file -> what's used.
+    read: Callable[[str], Any]
+    # What to use if it can't be fetched, and isn't cached.
+    fallback: Any = None
+
+
+def _read_lines(path: str) -> list:
+    with open(path, encoding='utf-8') as cached:
+        return cached.readlines()
+
+
+def _read_json(path: str) -> Any:
+    with open(path, encoding='utf-8') as cached:
+        return json.load(cached)
+
+
+# Metadata that can't be read (e.g. cut short) is as good as none.
+def _read_meta(path: str) -> dict:
+    try:
+        meta = _read_json(path)
+    except (OSError, ValueError):
+        return {}
+    return meta if isinstance(meta, dict) else {}
+
+
+def _names(names: list) -> str:
+    return json.dumps(names, separators=(",", ":"))
+
+
+# Chromium's source viewer serves the file Base64-encoded, and it has
+# '//' comments in it, which aren't valid JSON. Like pshtt, only entries
+# that include subdomains are kept.
+def parse_preload_list(raw: bytes) -> str:
+    text = base64.b64decode(raw).decode("utf-8")
+    text = "".join(re.sub(r"^\s*//.*$", "", line) for line in text.splitlines())
+    entries = json.loads(text)["entries"]
+    return _names([entry["name"] for entry in entries if entry.get("include_subdomains") is True])
+
+
+def parse_preload_pending(raw: bytes) -> str:
+    entries = json.loads(raw.decode("utf-8"))
+    return _names([entry["name"] for entry in entries if entry.get("include_subdomains") is True])
+
+
+DAY = 24 * 60 * 60
+
+PUBLIC_SUFFIX_LIST = Dataset(
+    "Public Suffix List", "https://publicsuffix.org/list/public_suffix_list.dat",
+    "public-suffix-list.txt", 7 * DAY, lambda raw: raw.decode("utf-8"), _read_lines)
+
+HSTS_PRELOAD_LIST = Dataset(
+    "HSTS preload list",
+    "https://chromium.googlesource.com/chromium/src/+/main/net/http/"
+    "transport_security_state_static.json?format=TEXT",
+    "hsts-preload-list.json", DAY, parse_preload_list, _read_json, [])
+
+HSTS_PRELOAD_PENDING = Dataset(
+    "HSTS preload pending list", "https://hstspreload.org/api/v2/pending",
+    "hsts-preload-pending.json", DAY, parse_preload_pending, _read_json, [])
+
+
+def _write(path: str, content: str) -> None:
+    descriptor, temporary = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+    try:
+        with os.fdopen(descriptor, 'w', encoding='utf-8') as output:
+            output.write(content)
+        os.replace(temporary, path)
+    except BaseException:
+        os.remove(temporary)
+        raise
+
+
+def load(dataset: Dataset, cache_dir: str = "./cache", now: float = None,
+         session: Any = requests) -> Any:
+    """
+    A dataset, from the cache if it's fresh (or still current), and
+    otherwise downloaded and cached. Returns ``dataset.fallback`` if it
+    can't be downloaded, and there's no cached copy that can be read.
+    """
+    now = now or time.time()
+    path = os.path.join(cache_dir, dataset.filename)
+    meta_path = path + ".meta.json"
+
+    meta = _read_meta(meta_path)
+    cached = os.path.exists(path)
+    # A file put there some other way counts as fetched when it was written.
+    if cached and ("fetched" not in meta):
+        meta["fetched"] = os.path.getmtime(path)
+
+    if cached and (now - meta["fetched"] < dataset.ttl):
+        try:
+            return dataset.read(path)
+        except (OSError, ValueError) as error:
+            logging.warning("Unable to read the cached %s, downloading it again: %s" % (
+                dataset.name, error))
+            cached = False
+
+    headers = {}
+    if cached and meta.get("etag"):
+        headers["If-None-Match"] = meta["etag"]
+    if cached and meta.get("last_modified"):
+        headers["If-Modified-Since"] = meta["last_modified"]
+
+    try:
+        response = session.get(dataset.url, headers=headers, timeout=timeout)
+        if cached and (response.status_code == 304):
+            logging.debug("%s hasn't changed." % dataset.name)
+        else:
+            response.raise_for_status()
+            logging.warning("Downloaded the %s." % dataset.name)
+            os.makedirs(cache_dir, exist_ok=True)
+            _write(path, dataset.parse(response.content))
+            cached = True
+            meta = {
+                "etag": response.headers.get("ETag"),
+                "last_modified": response.headers.get("Last-Modified"),
+            }
+        meta["fetched"] = now
+        meta["url"] = dataset.url
+        _write(meta_path, json.dumps(meta))
+    # (Including not being able to write it to the cache.)
+    except (requests.exceptions.RequestException, OSError, ValueError, KeyError) as error:
+        if cached:
+            logging.warning("Unable to update the %s, using the cached copy: %s" % (
+                dataset.name, error))
+        else:
+            logging.warning("Unable to download the %s: %s" % (dataset.name, error))
+
+    if not cached:
+        return dataset.fallback
+    try:
+        return dataset.read(path)
+    except (OSError, ValueError) as error:
+        logging.warning("Unable to read the cached %s: %s" % (dataset.name, error))
+        return dataset.fallback
@@ -1,16 +1,26 @@
 import argparse
-import codecs
+import asyncio
 import csv
 import datetime
 import errno
+import hashlib
+import heapq
 import importlib
 import json
 import logging
 import os
+import random
 import shutil
+import signal
+import socket
 import subprocess
 import sys
+import tempfile
+import threading
+import time
 import traceback
+from collections import ChainMap
+from contextlib import contextmanager
 from functools import singledispatch
 from pathlib import Path
 from typing import (
@@ -22,12 +32,13 @@ from typing import (
     cast,
 )
 from types import ModuleType
-from urllib.error import URLError
 
-import publicsuffix
 import requests
 import strict_rfc3339
 
+from utils import cache, journal, psl, reference, sinks
+from utils.cache import format_datetime
+
 
 MANDATORY_SCANNER_PROPERTIES = (
     "headers",
@@ -35,6 +46,7 @@ MANDATORY_SCANNER_PROPERTIES = (
 )
 # global in-memory cache
 suffix_list = None
+suffix_list_lock = threading.Lock()
 
 
 # Time Conveniences #
@@ -43,15 +55,6 @@ def local_now() -> float:
     return datetime.datetime.now().timestamp()
 
 
-def format_datetime(obj) -> Union[str, None]:
-    if isinstance(obj, datetime.date):
-        return obj.isoformat()
-    elif isinstance(obj, str):
-        return obj
-    else:
-        return None
-
-
 # Cut off floating point errors, always output duration down to
 # microseconds.
 def just_microseconds(duration: float) -> str:
@@ -116,10 +119,11 @@ def format_last_exception():
 def scan(command: List[str], env: dict=None,
          allowed_return_codes: list=[]) -> Union[str, None]:
     try:
+        # Killed (raising subprocess.TimeoutExpired) at the scan's deadline.
         response = subprocess.check_output(
             command,
             stderr=subprocess.STDOUT,
-            shell=False, env=env
+            shell=False, env=env, timeout=time_left()
         )
         return str(response, encoding='UTF-8')
     except subprocess.CalledProcessError as exc:
@@ -177,51 +181,120 @@ def configure_logging(options: Union[dict, None]=None) -> None:
 # CSV Handling #
 
 # Sort a CSV by domain name, "in-place" (by making a temporary copy).
-# This loads the whole thing into memory: it's not a great solution for
-# super-large lists of domains.
-def sort_csv(input_filename):
+#
+# An external merge sort, so memory use doesn't grow with the size of the
+# file: rows are read in chunks of `sort_chunk_rows`, each chunk is sorted
+# and spilled to a temporary file, and the sorted chunks are merged back
+# together (at most `sort_merge_width` at a time). The sort is stable, so
+# a domain with several rows (e.g. one per mail server) keeps them all, in
+# their original order.
+sort_chunk_rows = 100000
+sort_merge_width = 100
+
+
+def sort_csv(input_filename, chunk_rows=None, merge_width=None):
     logging.warning("Sorting %s..." % input_filename)
-
-    input_file = open(input_filename, encoding='utf-8', newline='')
+    chunk_rows = chunk_rows or sort_chunk_rows
+    merge_width = merge_width or sort_merge_width
+    directory = os.path.dirname(os.path.abspath(input_filename))
     tmp_filename = "%s.tmp" % input_filename
-    tmp_file = open(tmp_filename, 'w', newline='')
-    tmp_writer = csv.writer(tmp_file)
 
-    # store list of domains, to sort at the end
-    domains = []
-
-    # index rows by domain
-    rows = {}
+    # Every temporary file made along the way, to clean up at the end.
+    temps = []
     header = None
+    try:
+        runs = []
+        with open(input_filename, encoding='utf-8', newline='') as input_file:
+            reader = csv.reader(input_file)
+
+            # keep the header around
+            rows = []
+            first = next(reader, None)
+            if first and (first[0].lower() == "domain"):
+                header = first
+            elif first is not None:
+                rows.append(first)
+
+            for row in reader:
+                if not row:
+                    continue
+                rows.append(row)
+                if len(rows) >= chunk_rows:
+                    runs.append(_sorted_run(rows, directory, temps))
+                    rows = []
+            if rows:
+                runs.append(_sorted_run(rows, directory, temps))
+
+        # Merge the sorted runs a batch at a time, until few enough are
+        # left to merge in one go.
+        while len(runs) > merge_width:
+            runs = [
+                _merge_runs(runs[i:i + merge_width], directory, temps)
+                for i in range(0, len(runs), merge_width)
+            ]
+
+        # write out to a new file
+        files = [open(run, encoding='utf-8', newline='') for run in runs]
+        try:
+            with open(tmp_filename, 'w', encoding='utf-8', newline='') as tmp_file:
+                tmp_writer = csv.writer(tmp_file)
+                if header is not None:
+                    tmp_writer.writerow(header)
+                tmp_writer.writerows(
+                    heapq.merge(*(csv.reader(f) for f in files), key=_sort_key))
+        finally:
+            for f in files:
+                f.close()
+    finally:
+        for temp in temps:
+            if os.path.exists(temp):
+                os.remove(temp)
 
-    for row in csv.reader(input_file):
-        # keep the header around
-        if (row[0].lower() == "domain"):
-            header = row
-            continue
+    # replace the original
+    shutil.move(tmp_filename, input_filename)
 
-        # index domain for later reference
-        domain = row[0]
-        domains.append(domain)
-        rows[domain] = row
 
-    # straight alphabet sort
-    domains.sort()
+def _sort_key(row):
+    return row[0] if row else ""
 
-    # write out to a new file
-    tmp_writer.writerow(header)
-    for domain in domains:
-        tmp_writer.writerow(rows[domain])
 
-    # close the file handles
-    input_file.close()
-    tmp_file.close()
+# Sort one chunk of rows, and spill it to a temporary file.
+def _sorted_run(rows, directory, temps):
+    rows.sort(key=_sort_key)
+    handle, path = tempfile.mkstemp(suffix=".sort", dir=directory)
+    temps.append(path)
+    with os.fdopen(handle, 'w', encoding='utf-8', newline='') as run_file:
+        csv.writer(run_file).writerows(rows)
+    return path
 
-    # replace the original
-    shutil.move(tmp_filename, input_filename)
+
+# Merge sorted runs into one, and delete them. Ties go to the earlier
+# run, which keeps the sort stable.
+def _merge_runs(runs, directory, temps):
+    handle, path = tempfile.mkstemp(suffix=".sort", dir=directory)
+    temps.append(path)
+    files = [open(run, encoding='utf-8', newline='') for run in runs]
+    try:
+        with os.fdopen(handle, 'w', encoding='utf-8', newline='') as run_file:
+            csv.writer(run_file).writerows(
+                heapq.merge(*(csv.reader(f) for f in files), key=_sort_key))
+    finally:
+        for f in files:
+            f.close()
+    for run in runs:
+        os.remove(run)
+    return path
 
 
 def write_rows(rows, domain, base_domain, scanner, csv_writer, meta={}):
+    csv_writer.writerows(rows_for(rows, domain, base_domain, scanner, meta=meta))
+
+
+def rows_for(rows, domain, base_domain, scanner, meta={}):
+    """
+    The full CSV rows for a scan: domain and base domain, then the
+    scanner's own fields, then any meta fields.
+    """
 
     # If we didn't get any info, we'll still output information about why the scan failed.
     if rows is None:
@@ -251,12 +324,54 @@ def write_rows(rows, domain, base_domain, scanner, csv_writer, meta={}):
             meta_fields.append(meta['lambda'].get('memory_limit'))
             meta_fields.append(just_microseconds(meta['lambda'].get('measured_duration')))
 
-    # Write out prefix, scan data, and meta scan data.
-    for row in rows:
-        csv_writer.writerow(standard_prefix + row + meta_fields)
+    # Prefix, scan data, and meta scan data.
+    return [standard_prefix + row + meta_fields for row in rows]
 # CSV Handling #
 
 
+# Resuming #
+
+# Where a scan keeps its journal of finished scans, for --resume.
+def journal_path(results_dir):
+    return os.path.join(results_dir, "scan.journal")
+
+
+def prepare_results(results_dir, names, resume=False, output_format="csv"):
+    """
+    Get the results directory ready for a scan of the given scanners.
+
+    Normally that means clearing out existing results (in any format) and
+    the journal, to avoid inconsistent data. When resuming, each
+    scanner's results are instead cut back to the end of its last
+    journaled scan (or removed, if there is none), and the set of
+    (scanner, domain) scans already done is returned.
+    """
+    path = journal_path(results_dir)
+    if not resume:
+        for sink in sinks.SINKS.values():
+            for result in Path(results_dir).glob("*.%s" % sink.extension):
+                os.remove(str(result))
+            for result in Path(results_dir).glob("*.%s.jsonl" % sink.extension):
+                os.remove(str(result))
+        if os.path.exists(path):
+            os.remove(path)
+        return set()
+
+    sink = sinks.sink_for(output_format)
+    done, offsets = journal.load_journal(path)
+    for name in names:
+        result = str(Path(results_dir, "%s.%s" % (name, sink.extension)))
+        if not sink.exists(result):
+            continue
+        if offsets.get(name):
+            sink.restore(result, offsets[name])
+        else:
+            sink.remove(result)
+
+    return {(name, domain) for name, domain in done if name in names}
+# /Resuming #
+
+
 # Cache Handling #
 def cache_single(filename, cache_dir="./cache"):
     return os.path.join(cache_dir, filename)
@@ -267,18 +382,136 @@ def cache_path(domain, operation, ext="json", cache_dir="./cache"):
     return os.path.join(cache_dir, operation, ("%s.%s" % (domain, ext)))
 
 
-# Used to quickly get cached data for a domain.
+# --cache-ttl and --scan-timeout units, in seconds.
+DURATION_UNITS = {'s': 1, 'm': 60, 'h': 60 * 60, 'd': 24 * 60 * 60, 'w': 7 * 24 * 60 * 60}
+
+
+def parse_durations(value: str, what: str, example: str) -> dict:
+    """
+    Parse values like "pshtt=1d,sslyze=7d,12h" into seconds, per scanner
+    name. A duration with no name is stored under "*".
+    """
+    durations = {}
+    for entry in value.split(","):
+        name, _, duration = entry.strip().rpartition("=")
+        try:
+            durations[name or "*"] = float(duration[:-1]) * DURATION_UNITS[duration[-1:]]
+        except (KeyError, ValueError):
+            raise argparse.ArgumentTypeError(
+                "Invalid %s '%s': use e.g. %s." % (what, entry, example))
+    return durations
+
+
+def parse_cache_ttls(value: str) -> dict:
+    """Parse --cache-ttl values like "pshtt=1d,sslyze=7d,12h"."""
+    return parse_durations(value, "cache TTL", "pshtt=1d,sslyze=12h")
+
+
+def parse_timeouts(value: str) -> dict:
+    """Parse --scan-timeout values like "pshtt=10m,a11y=2m,30m"."""
+    return parse_durations(value, "timeout", "pshtt=10m,a11y=2m")
+
+
+def determine_timeout(scanner: ModuleType, options: dict) -> Union[float, None]:
+    """
+    How many seconds a scanner gets to scan one domain, or None for no
+    limit. --scan-timeout can set it per scanner, or for every scanner;
+    otherwise, scanners can set their own with a `scan_timeout` attribute.
+    """
+    name = scanner.__name__.split(".")[-1]
+    timeouts = options.get("scan_timeout") or {}
+    if name in timeouts:
+        return timeouts[name]
+    if "*" in timeouts:
+        return timeouts["*"]
+    return getattr(scanner, "scan_timeout", None)
+
+
+# The deadline (by time.monotonic()) for the scan running in this thread.
+_deadline = threading.local()
+
+
+@contextmanager
+def deadline(seconds: Union[float, None]):
+    """
+    ``with deadline(seconds):`` sets a deadline for the scan running in
+    this thread. Commands run with scan() are killed once it passes.
+    """
+    previous = getattr(_deadline, "at", None)
+    if seconds is not None:
+        _deadline.at = time.monotonic() + seconds
+    try:
+        yield
+    finally:
+        _deadline.at = previous
+
+
+@contextmanager
+def alarm(seconds: Union[float, None]):
+    """
+    ``with alarm(seconds):`` interrupts whatever the block is doing with a
+    TimeoutError once the time is up, using SIGALRM. Only works in a
+    process's main thread (e.g. in a worker process), and does nothing
+    anywhere else.
+    """
+    if (seconds is None) or (not hasattr(signal, "setitimer")) or \
+            (threading.current_thread() is not threading.main_thread()):
+        yield
+        return
+
+    def interrupt(signum, frame):
+        raise TimeoutError("Timed out after %gs." % seconds)
+
+    previous = signal.signal(signal.SIGALRM, interrupt)
+    signal.setitimer(signal.ITIMER_REAL, seconds)
+    try:
+        yield
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous)
+
+
+def time_left() -> Union[float, None]:
+    """Seconds until this thread's scan deadline, or None if it has none."""
+    at = getattr(_deadline, "at", None)
+    if at is None:
+        return None
+    return max(0.0, at - time.monotonic())
+
+
+# The error codes AWS uses for being throttled.
+THROTTLED = ("ThrottlingException", "TooManyRequestsException",
+             "LimitExceededException", "RequestLimitExceeded")
+
+
+def throttled(error: Exception) -> bool:
+    """Whether an error from a boto3 client is about being throttled."""
+    response = getattr(error, "response", None) or {}
+    return response.get("Error", {}).get("Code") in THROTTLED
+
+
+def backoff(attempt: int, base: float, cap: float) -> float:
+    """
+    How long to wait before retry number ``attempt`` (from 0): a random
+    time up to ``base`` seconds, doubled for each attempt, up to ``cap``.
+    Random, so that workers that failed together don't retry together.
+    """
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+# Used to quickly get cached data for a domain, from whichever
+# --cache-backend is in use.
 def data_for(domain, operation, cache_dir="./cache"):
-    path = cache_path(domain, operation, cache_dir=cache_dir)
-    if os.path.exists(path):
-        raw = read(path)
-        data = json.loads(raw)
-        if isinstance(data, dict) and (data.get('invalid', False)):
-            return None
-        else:
-            return data
-    else:
+    found, data = cache.cache_for(cache_dir).read(operation, domain)
+    if not found:
         return {}
+    return data
+
+
+# Used to quickly answer questions about a domain's pshtt or trustymail
+# data, from the cache's index. None if there's no usable data.
+def summary_for(domain, operation, cache_dir="./cache"):
+    return cache.cache_for(cache_dir).summary(operation, domain)
 
 
 # marker for a cached invalid response
@@ -296,10 +529,13 @@ def base_domain_for(subdomain, cache_dir="./cache"):
     """
     For "x.y.domain.gov", return "domain.gov".
 
-    If suffix_list is None, the caches have not been initialized, so do that.
+    If suffix_list is None, the caches have not been initialized, so do that
+    (just once, however many threads get here first).
     """
     if suffix_list is None:
-        suffix_list, discard = load_suffix_list(cache_dir=cache_dir)
+        with suffix_list_lock:
+            if suffix_list is None:
+                suffix_list, discard = load_suffix_list(cache_dir=cache_dir)
 
     if suffix_list is None:
         logging.warning("Error downloading the PSL.")
@@ -308,33 +544,18 @@ def base_domain_for(subdomain, cache_dir="./cache"):
     return suffix_list.get_public_suffix(subdomain)
 
 
-# Returns an instantiated PublicSuffixList object, and the
-# list of lines read from the file.
+# Returns a compiled Public Suffix List (a psl.SuffixTrie), and the
+# list of lines read from the file. The list is cached, and kept up to
+# date, by utils.reference.
 def load_suffix_list(cache_dir="./cache"):
 
-    cached_psl = cache_single("public-suffix-list.txt", cache_dir=cache_dir)
-
-    if os.path.exists(cached_psl):
-        logging.debug("Using cached Public Suffix List...")
-        with codecs.open(cached_psl, encoding='utf-8') as psl_file:
-            suffixes = publicsuffix.PublicSuffixList(psl_file)
-            content = psl_file.readlines()
-    else:
-        # File does not exist, download current list and cache it at given location.
-        logging.debug("Downloading the Public Suffix List...")
-        try:
-            cache_file = publicsuffix.fetch()
-        except URLError as err:
-            logging.warning("Unable to download the Public Suffix List...")
-            logging.debug("{}".format(err))
-            return None, None
-
-        content = cache_file.readlines()
-        suffixes = publicsuffix.PublicSuffixList(content)
+    compiled_psl = cache_single("public-suffix-list.trie", cache_dir=cache_dir)
 
-        # Cache for later.
-        write(''.join(content), cached_psl)
+    content = reference.load(reference.PUBLIC_SUFFIX_LIST, cache_dir=cache_dir)
+    if content is None:
+        return None, None
 
+    suffixes = psl.load(content, compiled_psl)
     return suffixes, content
 # /Cache Handling #
 
@@ -372,16 +593,35 @@ class ArgumentParser(argparse.ArgumentParser):
 def build_scan_options_parser() -> ArgumentParser:
     """ Builds the argparse parser object. """
     parser = ArgumentParser(prefix_chars="--")
-    parser.add_argument("domains", help="".join([
+    parser.add_argument("domains", nargs="?", help="".join([
         "Either a comma-separated list of domains or the url of a CSV ",
         "file/path to a local CSV file containing the domains to be ",
         "domains to be scanned. The CSV's header row will be ignored ",
-        "if the first cell starts with \"Domain\" (case-insensitive).",
+        "if the first cell starts with \"Domain\" (case-insensitive). ",
+        "Not needed with --worker.",
     ]))
     parser.add_argument("--cache", action="store_true", help="".join([
         "Use previously cached scan data to avoid scans hitting the network ",
         "where possible.",
     ]))
+    parser.add_argument("--cache-backend", choices=sorted(cache.BACKENDS), help="".join([
+        "Where to cache scan data: files (the default, a JSON file per ",
+        "domain and scanner), fanout (gzipped files, spread across hashed ",
+        "directories) or sqlite (one compressed database, cache/cache.db)."
+    ]))
+    parser.add_argument("--cache-ttl", type=parse_cache_ttls, help="".join([
+        "How long cached scan data stays fresh, per scanner, e.g. ",
+        "'pshtt=1d,sslyze=7d,a11y=30d'. A duration on its own applies to ",
+        "all other scanners, and 'invalid=6h' applies to cached failed ",
+        "scans. Units are s, m, h, d and w. Implies --cache: only stale or ",
+        "missing data is scanned again.",
+    ]))
+    parser.add_argument("--scan-timeout", type=parse_timeouts, help="".join([
+        "The longest a scanner can take on one domain, per scanner, e.g. ",
+        "'pshtt=10m,a11y=2m'. A duration on its own applies to all other ",
+        "scanners. Units are s, m, h, d and w. Scans that run over are ",
+        "recorded with a timeout error, and their workers freed up.",
+    ]))
     parser.add_argument("--debug", action="store_true",
                         help="Print out more stuff. Useful with '--serial'")
     parser.add_argument("--lambda", action="store_true", help="".join([
@@ -396,6 +636,20 @@ def build_scan_options_parser() -> ArgumentParser:
         "The maximum number of times to retry a Lambda job that fails.  ",
         "If not specified then the value 0 is used."
     ]))
+    parser.add_argument("--lambda-details", action="store_true", help="".join([
+        "With --lambda and --meta, once the scan is done, add each Lambda ",
+        "task's reported duration and memory use from CloudWatch Logs to ",
+        "the results. Waits for the logs to show up, for up to 2 minutes.",
+    ]))
+    parser.add_argument("--lambda-compress", action="store_true", help="".join([
+        "With --lambda, gzip what's sent to and from Lambda.",
+    ]))
+    parser.add_argument("--lambda-batch-size", type=int, help="".join([
+        "With --lambda, send each scanner's domains to Lambda this many at ",
+        "a time, scanned one after the other in a single invoke. For quick ",
+        "scans, where the invoke takes longer than the scan. Each scanner's ",
+        "workers are then how many invokes it has going at once.",
+    ]))
     parser.add_argument("--meta", action="store_true", help="".join([
         "Append some additional columns to each row with information about ",
         "the scan itself. This includes start/end times and durations, as ",
@@ -404,9 +658,14 @@ def build_scan_options_parser() -> ArgumentParser:
     ]))
     parser.add_argument("--scan", nargs=1, required=True,
                         help="Comma-separated list of scanners (required).")
+    parser.add_argument("--output-format", choices=sorted(sinks.SINKS), help="".join([
+        "What to write each scanner's results as: csv (the default), jsonl ",
+        "(JSON Lines), sqlite (a table per scanner, indexed on domain), or ",
+        "parquet (needs pyarrow). All but csv keep values' types."
+    ]))
     parser.add_argument("--sort", action="store_true", help="".join([
-        "Sort result CSVs by domain name, alphabetically. (Note: this causes ",
-        "the entire dataset to be read into memory.)",
+        "Sort result CSVs by domain name, alphabetically. Sorts in chunks ",
+        "on disk, so big CSVs need temporary disk space, not memory.",
     ]))
     parser.add_argument("--serial", action="store_true", help="".join([
         "Disable parallelization, force each task to be done simultaneously. ",
@@ -422,8 +681,84 @@ def build_scan_options_parser() -> ArgumentParser:
         "Where to output the 'cache/' and 'results/' directories. ",
         "Defaults to './'.",
     ]))
-    parser.add_argument("--workers", nargs=1,
-                        help="Limit parallel threads per-scanner to a number.")
+    parser.add_argument("--workers", nargs=1, help="".join([
+        "Limit parallel workers per-scanner to a number. Can be set for ",
+        "each scanner, e.g. 'pshtt=200,sslyze=20', and a number on its own ",
+        "applies to the rest. Overrides the scanners' own settings."
+    ]))
+    parser.add_argument("--adaptive-workers", action="store_true", help="".join([
+        "Adjust each scanner's number of workers during the scan, between ",
+        "--min-workers and its usual number: more while scans stay fast, ",
+        "fewer when they slow down or time out, or when this machine runs ",
+        "low on file descriptors, memory or CPU."
+    ]))
+    parser.add_argument("--min-workers", type=int, help="".join([
+        "With --adaptive-workers, the fewest workers a scanner is cut back ",
+        "to. Defaults to 1."
+    ]))
+    parser.add_argument("--shard", type=parse_shard, help="".join([
+        "Only scan shard i of N (e.g. '2/4'), to split a scan across ",
+        "several machines. Domains are split up by base domain, so all ",
+        "subdomains of one organization go to the same shard. Combine ",
+        "the results afterwards with ./merge."
+    ]))
+    parser.add_argument("--resume", action="store_true", help="".join([
+        "Pick up an interrupted scan where it left off: skip the scans it ",
+        "already finished, and append to its result CSVs instead of ",
+        "starting them over. Use the same domains and options as before."
+    ]))
+    parser.add_argument("--queue", help="".join([
+        "Path to a work queue (a SQLite file on storage shared by every ",
+        "machine), for --enqueue and --worker."
+    ]))
+    parser.add_argument("--enqueue", action="store_true", help="".join([
+        "Put a task for each domain and scanner in the --queue, wait for ",
+        "workers to finish them, and write out the results."
+    ]))
+    parser.add_argument("--worker", action="store_true", help="".join([
+        "Scan domains from the --queue until it is empty, instead of from ",
+        "the domains argument. Run as many workers, on as many machines, ",
+        "as needed."
+    ]))
+    parser.add_argument("--lease-time", type=int, help="".join([
+        "With --worker, how many seconds a worker can go without a ",
+        "heartbeat before its domains are handed to another worker. ",
+        "Defaults to 300."
+    ]))
+    parser.add_argument("--max-pending", type=int, help="".join([
+        "The maximum number of scan tasks (one per domain, per scanner) ",
+        "that can be read in but not yet finished at any time. Domains are ",
+        "only read from the input as tasks finish, which keeps memory use ",
+        "flat for very large lists of domains. Defaults to a few times the ",
+        "number of workers."
+    ]))
+    parser.add_argument("--executor", choices=["thread", "process"], help="".join([
+        "Run scanners in a pool of worker threads (the default), or in a ",
+        "pool of worker processes, for CPU-heavy scanners that would ",
+        "otherwise hold each other up on Python's global interpreter lock. ",
+        "Scanners can also ask for processes themselves."
+    ]))
+    parser.add_argument("--process-max-tasks", type=int, help="".join([
+        "With --executor=process, how many scans each worker process runs ",
+        "before the processes are replaced with fresh ones, to contain ",
+        "memory leaks. Defaults to 100."
+    ]))
+    parser.add_argument("--per-domain-workers", type=int, help="".join([
+        "Politeness: the maximum number of scan tasks that can run at once ",
+        "against subdomains of the same base domain, across all scanners."
+    ]))
+    parser.add_argument("--per-domain-rate", type=float, help="".join([
+        "Politeness: the maximum number of scan tasks that can start per ",
+        "second against subdomains of the same base domain."
+    ]))
+    parser.add_argument("--per-ip-workers", type=int, help="".join([
+        "Politeness: the maximum number of scan tasks that can run at once ",
+        "against domains that resolve to the same IP address."
+    ]))
+    parser.add_argument("--per-ip-rate", type=float, help="".join([
+        "Politeness: the maximum number of scan tasks that can start per ",
+        "second against domains that resolve to the same IP address."
+    ]))
     # TODO: Should workers have a default value?
     parser.add_argument("--no-fast-cache", action="store_true", help="".join([
         "Do not use fast caching even if a scanner supports it.  This option ",
@@ -511,10 +846,43 @@ def options() -> Tuple[dict, list]:
 
     opts = {k: v for k, v in vars(parsed).items() if v is not None}
 
+    # Workers get their domains from the work queue instead.
+    if (not opts.get("domains")) and (not opts.get("worker")):
+        parser.error("the following arguments are required: domains")
+
+    # Otherwise the value of e.g. "--noop-delay 1" ends up as the domains.
+    if opts.get("worker") and opts.get("domains"):
+        parser.error("workers get domains from the --queue, and need scanner "
+                     "options given as --option=value")
+
+    if (opts.get("worker") or opts.get("enqueue")) and not opts.get("queue"):
+        raise argparse.ArgumentTypeError(
+            "Can't use --worker or --enqueue without a --queue.")
+
+    if (opts.get("output_format") == "parquet") and (sinks.pyarrow is None):
+        raise argparse.ArgumentTypeError(
+            "Can't use --output-format=parquet without pyarrow installed.")
+
     if opts.get("lambda_profile") and not opts.get("lambda"):
         raise argparse.ArgumentTypeError(
             "Can't set lambda profile unless lambda flag is set.")
 
+    if opts.get("lambda_details") and not (opts.get("lambda") and opts.get("meta")):
+        raise argparse.ArgumentTypeError(
+            "Can't use --lambda-details without --lambda and --meta.")
+
+    if opts.get("lambda_compress") and not opts.get("lambda"):
+        raise argparse.ArgumentTypeError(
+            "Can't set --lambda-compress unless lambda flag is set.")
+
+    if opts.get("lambda_batch_size") is not None:
+        if not opts.get("lambda"):
+            raise argparse.ArgumentTypeError(
+                "Can't set --lambda-batch-size unless lambda flag is set.")
+        if opts["lambda_batch_size"] < 1:
+            raise argparse.ArgumentTypeError(
+                "Invalid --lambda-batch-size: must be at least 1.")
+
     # We know we want one value, but the ``nargs`` flag means we get a list.
     should_be_singles = (
         "lambda_profile",
@@ -525,6 +893,10 @@ def options() -> Tuple[dict, list]:
     )
     opts = make_values_single(opts, should_be_singles)
 
+    # Checked now, but parsed where it's used.
+    if opts.get("workers"):
+        parse_workers(opts["workers"])
+
     # Derive some options not set directly at CLI:
     opts["_"] = {
         "cache_dir": os.path.join(opts.get("output", "./"), "cache"),
@@ -592,12 +964,13 @@ def verify_scanner_properties(scanner: ModuleType) -> None:
         raise ImportError(errmsg)
 
 
-def begin_csv_writing(scanner: ModuleType, options: dict,
-                      base_hdrs: Tuple[List[str], List[str], List[str]]) -> dict:
+def begin_writing(scanner: ModuleType, options: dict,
+                  base_hdrs: Tuple[List[str], List[str], List[str]]) -> dict:
     """
-    Determine the CSV output file path for the scanner, open the file at that
-    path, instantiate a CSV writer for it, determine whether or not to use
-    lambda, determine what the headers are, write the headers to the CSV.
+    Determine the output file path for the scanner, open a sink for the
+    --output-format at that path (CSV by default), determine whether or
+    not to use lambda, and determine what the headers are. New CSVs get
+    the header row; when resuming, the sink appends to existing results.
 
     Return a dict containing the above.
     """
@@ -605,10 +978,7 @@ def begin_csv_writing(scanner: ModuleType, options: dict,
     name = scanner.__name__.split(".")[-1]  # e.g. 'pshtt'
     results_dir = options["_"]["results_dir"]
     meta = options.get("meta")
-    lambda_mode = options.get("lambda")
-    use_lambda = lambda_mode and \
-        hasattr(scanner, "lambda_support") and \
-        scanner.lambda_support  # type: ignore  # it's an optional variable.
+    use_lambda = uses_lambda(scanner, options)
 
     # Write the header row, factoring in Lambda detail if needed.
     headers = PREFIX_HEADERS + scanner.headers  # type: ignore  # optional again
@@ -619,40 +989,177 @@ def begin_csv_writing(scanner: ModuleType, options: dict,
     if meta and use_lambda:
         headers += LAMBDA_HEADERS
 
-    scanner_csv_path = Path(results_dir, "%s.csv" % name).resolve()
-    scanner_file = scanner_csv_path.open('w', newline='')
-    scanner_writer = csv.writer(scanner_file)
+    output_format = options.get("output_format", "csv")
+    sink = sinks.sink_for(output_format)
+    scanner_path = Path(results_dir, "%s.%s" % (name, sink.extension)).resolve()
 
-    scanner_writer.writerow(headers)
+    # With --resume, pick up where an earlier run of this scanner left off.
+    scanner_sink = sink(str(scanner_path), headers, append=options.get("resume", False))
 
     return {
         'name': name,
-        'file': scanner_file,
-        'filename': str(scanner_csv_path),
-        'writer': scanner_writer,
+        'sink': scanner_sink,
+        'format': output_format,
+        'filename': str(scanner_path),
         'headers': headers,
         'use_lambda': use_lambda,
     }
 
 
+def environment_view(environment: dict) -> ChainMap:
+    """
+    A scanner's environment for one domain's init_domain, without copying
+    it: anything set on the view is kept just for that domain, on top of
+    the data from the scanner's init, which every domain shares.
+
+    So init_domain should set new values (e.g. a smaller list) rather
+    than change the shared ones in place. Except for FAST_CACHE_KEY's,
+    which is meant to be shared.
+    """
+    return ChainMap({}, environment)
+
+
+def uses_lambda(scanner: ModuleType, options: dict) -> bool:
+    """Whether to run the scanner in Lambda: if --lambda, and it can."""
+    return bool(options.get("lambda") and
+                getattr(scanner, "lambda_support", False))
+
+
+def parse_workers(value: str) -> dict:
+    """
+    Parse --workers values like "pshtt=200,sslyze=20,50" into worker
+    counts per scanner name. A count with no name is stored under "*".
+    """
+    workers = {}
+    for entry in value.split(","):
+        name, _, count = entry.strip().rpartition("=")
+        try:
+            workers[name or "*"] = int(count)
+        except ValueError:
+            raise argparse.ArgumentTypeError(
+                "Invalid workers '%s': use e.g. pshtt=200,sslyze=20." % entry)
+        if workers[name or "*"] < 1:
+            raise argparse.ArgumentTypeError(
+                "Invalid workers '%s': must be at least 1." % entry)
+    return workers
+
+
 def determine_scan_workers(scanner: ModuleType, options: dict, w_default: int,
                            w_max: int) -> int:
     """
     Given a number of inputs, determines the right number of workers to set
     when running scans.
     """
+    name = scanner.__name__.split(".")[-1] if hasattr(scanner, "__name__") else None
+    caps = parse_workers(options["workers"]) if options.get("workers") else {}
+
+    # --workers wins over the scanner's own setting.
     if options.get("serial"):
         workers = 1
+    elif name in caps:
+        workers = caps[name]
+    elif "*" in caps:
+        workers = caps["*"]
     elif hasattr(scanner, "workers"):
         workers = scanner.workers  # type: ignore # The subclass objects set this sometimes.
     else:
-        # mypy has trouble with this, presumably because we're using a dict
-        workers = int(options.get("workers", w_default))  # type: ignore
+        workers = w_default
 
     # Enforce a local worker maximum as a safety valve.
     return min(workers, w_max)
 
 
+def is_async_scanner(scanner: ModuleType) -> bool:
+    """
+    Whether the scanner's scan function is a coroutine function
+    (``async def scan``), to be run on an event loop rather than a thread.
+    """
+    return asyncio.iscoroutinefunction(getattr(scanner, "scan", None))
+
+
+def determine_executor(scanner: ModuleType, options: dict) -> str:
+    """
+    Whether a (non-async, local) scanner runs in worker threads or worker
+    processes. --executor applies to every scanner, otherwise a scanner
+    can ask for processes with ``executor = "process"``.
+    """
+    executor = options.get("executor") or getattr(scanner, "executor", None) or "thread"
+    if executor not in ("thread", "process"):
+        raise ValueError("Unknown executor: %s" % executor)
+    return executor
+
+
+def determine_global_workers(limits: dict, options: dict, w_max: int) -> int:
+    """
+    Given the per-scanner worker counts, determines the size of the single
+    pool shared by all scanners during a scan.
+    """
+    if options.get("serial"):
+        return 1
+
+    # Enough for every scanner to run at its own limit at once.
+    return max(1, min(sum(limits.values()), w_max))
+
+
+def determine_window(budgets: dict, scanner_count: int, options: dict,
+                     factor: int) -> int:
+    """
+    Given the worker budgets of each pool, determines how many scan tasks
+    can be outstanding (read in, but not yet finished) at once.
+    """
+    if options.get("max_pending"):
+        window = int(options["max_pending"])
+    else:
+        # Enough queued work to keep every worker busy as tasks finish.
+        window = factor * sum(budgets.values())
+
+    # Always room for every scanner's task for at least one domain.
+    return max(window, scanner_count)
+
+
+def parse_shard(value: str) -> Tuple[int, int]:
+    """Parse --shard values like "2/4" into (2, 4)."""
+    try:
+        index, count = (int(part) for part in value.split("/"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            "Invalid shard '%s': use e.g. 2/4 for the 2nd of 4 shards." % value)
+    if not (1 <= index <= count):
+        raise argparse.ArgumentTypeError(
+            "Invalid shard '%s': must be from 1/%i to %i/%i." % (value, count, count, count))
+    return index, count
+
+
+def shard_for(domain: str, count: int, cache_dir="./cache") -> int:
+    """
+    Which of ``count`` shards (numbered from 1) a domain belongs to. Based
+    on a stable hash of its base domain, so it's the same on every machine
+    and every run.
+    """
+    base_domain = base_domain_for(domain, cache_dir=cache_dir) or domain
+    digest = hashlib.sha1(base_domain.lower().encode("utf-8")).digest()
+    return (int.from_bytes(digest[:8], "big") % count) + 1
+
+
+def in_shard(domains: Iterable[str], shard: Tuple[int, int],
+             cache_dir="./cache") -> Iterable[str]:
+    """Only the domains that belong to ``shard`` (an (i, N) pair)."""
+    index, count = shard
+    for domain in domains:
+        if shard_for(domain, count, cache_dir=cache_dir) == index:
+            yield domain
+
+
+def resolve_ip(domain: str) -> Union[str, None]:
+    """
+    The IPv4 address a domain resolves to, or None if it doesn't resolve.
+    """
+    try:
+        return socket.gethostbyname(domain)
+    except (socket.error, UnicodeError):
+        return None
+
+
 # Yield domain names from a single string, or a CSV of them.
 @singledispatch
 def domains_from(arg: Any, domain_suffix=None) -> Iterable[str]:
@@ -706,8 +1213,12 @@ def handle_domains_argument(domains: str, cache_dir: Path) -> Union[Path, str]:
     if domains.startswith("http:") or domains.startswith("https:"):
         domains_path = Path(cache_dir, "domains.csv")
         try:
-            response = requests.get(domains)
-            write(response.text, str(domains_path))
+            # Stream to disk, rather than holding the whole list in memory.
+            response = requests.get(domains, stream=True)
+            mkdir_p(str(cache_dir))
+            with domains_path.open("wb") as domains_file:
+                for chunk in response.iter_content(chunk_size=1024 * 1024):
+                    domains_file.write(chunk)
         except requests.exceptions.RequestException as err:
             msg = "\n".join([
                 "Domains URL not downloaded successfully; RequestException",
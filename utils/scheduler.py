@@ -0,0 +1,732 @@
+import heapq
+import itertools
+import logging
+import math
+import os
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from typing import Callable, Dict, Iterable, List, Set, Tuple, Union
+
+from utils import scan_utils
+
+
+###
+# Pipelined scheduling of (scanner, domain) tasks.
+#
+# Instead of running one full pass over every domain per scanner, all
+# selected scanners pull from one stream of domains, and their tasks
+# share a single global budget of in-flight work. A slow tail in one
+# scanner leaves room for the other scanners to keep going.
+#
+# Scanners can depend on other scanners (e.g. sslyze on pshtt). For each
+# domain, a scanner's task only becomes ready once the tasks for its
+# dependencies on that same domain have finished, so the downstream
+# scanner can rely on their cached results within a single run.
+#
+# Domains are read lazily, and only as long as the number of outstanding
+# tasks (queued, waiting or running) stays within a fixed window. When a
+# slow scanner falls behind, reading stops until it catches up, so memory
+# stays flat no matter how long the list of domains is.
+#
+# Tasks can also be held back to be polite to the hosts being scanned:
+# capped in how many run at once, and how often they start, per base
+# domain or per IP address. Held-back tasks are skipped over in favor of
+# other work, rather than tying up a worker while they wait.
+#
+# Tasks that run past their scanner's timeout are given up on, so that a
+# hung scan can't tie up a worker for the rest of the run.
+#
+# How many tasks each scanner runs at once can also be adjusted as the
+# scan goes, backing off when scans slow down or this machine is busy.
+###
+
+
+# The pool scanners run in unless told otherwise.
+DEFAULT_POOL = "thread"
+
+
+class Scheduler:
+    """
+    Dispatch (scanner, domain) tasks from a single domain stream.
+
+    ``submit(name, domain)`` must start the task and return a
+    ``concurrent.futures.Future``. Each scanner is capped at
+    ``limits[name]`` in-flight tasks, and all scanners together are capped
+    at ``budget``.
+
+    ``dependencies[name]`` lists the scanners whose task for a domain
+    must finish before ``name`` starts on that domain.
+
+    Scanners can run in different pools (e.g. threads for blocking
+    scanners, an event loop for async ones). ``pools[name]`` names the
+    pool a scanner's tasks run in, and ``budget`` can then be a dict of
+    caps per pool. By default, everything shares one pool.
+
+    At most ``window`` tasks are outstanding at any time. By default the
+    window is unbounded.
+
+    Each of the ``politeness`` limits is checked before a task starts.
+
+    Tasks in ``done`` (e.g. from an earlier, interrupted run) are skipped.
+
+    A task still running ``timeouts[name]`` seconds after it started is
+    given up on: ``on_timeout(name, domain, future)`` is called to clean
+    up after it, and its slot goes to the next task.
+
+    With a ``controller`` (see AdaptiveLimits), each scanner's limit is
+    whatever the controller says, up to ``limits[name]``.
+    """
+
+    def __init__(self, names: List[str], limits: Dict[str, int],
+                 budget: Union[int, Dict[str, int]],
+                 submit: Callable[[str, str], Future],
+                 dependencies: Dict[str, List[str]] = None,
+                 pools: Dict[str, str] = None,
+                 window: int = None,
+                 politeness: List["Politeness"] = None,
+                 done: Set[Tuple[str, str]] = None,
+                 timeouts: Dict[str, float] = None,
+                 on_timeout: Callable[[str, str, Future], None] = None,
+                 controller: "AdaptiveLimits" = None) -> None:
+        self.names = list(names)
+        self.limits = dict(limits)
+        self.caps = dict(limits)
+        self.controller = controller
+        if controller is not None:
+            self._adjust()
+        self.submit = submit
+
+        # Tasks read in but not yet finished, and the cap on those.
+        self.outstanding = 0
+        self.window = window
+
+        pools = pools or {}
+        self.pools = {name: pools.get(name, DEFAULT_POOL) for name in self.names}
+        if isinstance(budget, dict):
+            self.budgets = dict(budget)
+        else:
+            self.budgets = {DEFAULT_POOL: budget}
+        self.pool_running = {pool: 0 for pool in self.budgets}
+
+        # Only dependencies on scanners in this run matter. Otherwise the
+        # scanner falls back on whatever is already cached.
+        dependencies = dependencies or {}
+        self.dependencies = {
+            name: set(dependencies.get(name, [])) & (set(self.names) - {name})
+            for name in self.names
+        }
+        check_acyclic(self.dependencies)
+        self.dependents = {
+            name: [other for other in self.names if name in self.dependencies[other]]
+            for name in self.names
+        }
+        # Scanners that don't wait on anything. Only these drive reading
+        # more domains; the rest are fed as their dependencies finish.
+        self.roots = [name for name in self.names if not self.dependencies[name]]
+        # Per-domain dependencies still unfinished, for each waiting scanner.
+        self.waiting = {}  # type: Dict[str, Dict[str, set]]
+
+        # (name, domain) tasks that don't need to be run again.
+        self.done = done if done is not None else set()
+
+        # Politeness keys (e.g. base domain, IP) for domains with tasks
+        # outstanding, and how many tasks each of those domains has left.
+        self.politeness = politeness or []
+        self.keys = {}  # type: Dict[str, list]
+        self.domain_tasks = {}  # type: Dict[str, int]
+        # Seconds until a task held back by a rate limit could start.
+        self._wakeup = None  # type: Union[float, None]
+
+        # Tasks waiting for a free slot, per scanner.
+        self.ready = {name: deque() for name in self.names}  # type: Dict[str, deque]
+        # Tasks currently running, per scanner and overall.
+        self.running = {name: 0 for name in self.names}
+        self.in_flight = {}  # type: Dict[Future, tuple]
+        self.started = {}  # type: Dict[Future, float]
+        # Tasks put themselves here as they finish, so that waiting on the
+        # next one doesn't mean going through every task in flight.
+        self.finished = queue.Queue()  # type: queue.Queue
+
+        # First task start and last task end, per scanner.
+        self.timings = {
+            name: {'start_time': None, 'end_time': None} for name in self.names
+        }
+
+        # Deadlines for running tasks, soonest first, as
+        # (deadline, tiebreaker, future). Entries for finished tasks are
+        # dropped as they come up.
+        self.timeouts = {
+            name: timeout for name, timeout in (timeouts or {}).items()
+            if timeout is not None
+        }
+        self.on_timeout = on_timeout
+        self.deadlines = []  # type: List[tuple]
+        self._sequence = itertools.count()
+
+        # Rotates so that no scanner gets first pick of free slots every time.
+        self._turn = 0
+
+    def run(self, domains: Iterable[str]) -> None:
+        """Run every scanner over every domain. Returns when all are done."""
+        domains = iter(domains)
+        exhausted = False
+
+        while True:
+            if not exhausted:
+                exhausted = self._fill(domains)
+
+            self._dispatch()
+
+            # Starting those may have left slots free: read more domains
+            # for them before waiting on anything.
+            if (not exhausted) and self._hungry():
+                continue
+
+            if not self.in_flight:
+                if exhausted and not self._pending():
+                    break
+                # Everything left is held back by a rate limit.
+                if self._wakeup is not None:
+                    time.sleep(self._wakeup)
+                continue
+
+            try:
+                future = self.finished.get(timeout=self._next_wakeup())
+                while True:
+                    # Tasks that timed out were already given up on.
+                    if future in self.in_flight:
+                        self._complete(future)
+                    future = self.finished.get_nowait()
+            except queue.Empty:
+                pass
+            self._expire()
+            if self.controller is not None:
+                self._adjust()
+
+    # Read domains while some scanner has a free slot but nothing it can
+    # start. Returns True once the domain stream is exhausted.
+    def _fill(self, domains) -> bool:
+        while self._hungry():
+            try:
+                domain = next(domains)
+            except StopIteration:
+                return True
+            self.admit(domain)
+        return False
+
+    # Queue up one task per scanner for a newly read domain, holding back
+    # the ones that need to wait for other scanners.
+    def admit(self, domain: str) -> None:
+        # Tasks already done count as finished for their dependents, too.
+        finished = {name for name in self.names if (name, domain) in self.done}
+        names = [name for name in self.names if name not in finished]
+        if not names:
+            return
+
+        self.outstanding += len(names)
+
+        if self.politeness:
+            if domain not in self.keys:
+                self.keys[domain] = [limit.key_for(domain) for limit in self.politeness]
+            self.domain_tasks[domain] = self.domain_tasks.get(domain, 0) + len(names)
+
+        for name in names:
+            dependencies = self.dependencies[name] - finished
+            if dependencies:
+                waiting = self.waiting.setdefault(domain, {})
+                waiting[name] = dependencies
+            else:
+                self.ready[name].append(domain)
+
+    # Release the tasks for a domain that were only waiting on this one.
+    def _release(self, name: str, domain: str) -> None:
+        waiting = self.waiting.get(domain)
+        if waiting is None:
+            return
+
+        for dependent in self.dependents[name]:
+            if dependent not in waiting:
+                continue
+            waiting[dependent].discard(name)
+            if not waiting[dependent]:
+                del waiting[dependent]
+                self.ready[dependent].append(domain)
+
+        if not waiting:
+            del self.waiting[domain]
+
+    def _hungry(self) -> bool:
+        # Backpressure: don't read another domain if its tasks wouldn't fit
+        # in the window. (Always allow one, so a tiny window still works.)
+        if (self.window is not None) and (self.outstanding > 0) and \
+                (self.outstanding + len(self.names) > self.window):
+            return False
+        return any(
+            self._has_slot(name) and (self._find(name, time.monotonic()) is None)
+            for name in self.roots
+        )
+
+    def _has_slot(self, name: str) -> bool:
+        pool = self.pools[name]
+        return (self.running[name] < self.limits[name]) and \
+            (self.pool_running[pool] < self.budgets[pool])
+
+    def _pending(self) -> bool:
+        return bool(self.waiting) or any(self.ready[name] for name in self.names)
+
+    # Index of the first queued task for a scanner that's allowed to
+    # start now, or None. Notes when a rate-limited task could start.
+    def _find(self, name: str, now: float) -> Union[int, None]:
+        if not self.politeness:
+            return 0 if self.ready[name] else None
+
+        for index, domain in enumerate(self.ready[name]):
+            delay = max(
+                limit.delay(key, now)
+                for limit, key in zip(self.politeness, self.keys[domain])
+            )
+            if delay <= 0:
+                return index
+            if (delay != math.inf) and ((self._wakeup is None) or (delay < self._wakeup)):
+                self._wakeup = delay
+        return None
+
+    # Hand out free slots one task at a time, round-robin across scanners.
+    def _dispatch(self) -> None:
+        self._wakeup = None
+        progress = True
+        while progress:
+            progress = False
+            now = time.monotonic()
+            for offset in range(len(self.names)):
+                name = self.names[(self._turn + offset) % len(self.names)]
+                if not (self.ready[name] and self._has_slot(name)):
+                    continue
+                index = self._find(name, now)
+                if index is None:
+                    continue
+                domain = self.ready[name][index]
+                del self.ready[name][index]
+                self._start(name, domain, now)
+                progress = True
+            self._turn = (self._turn + 1) % max(len(self.names), 1)
+
+    def _start(self, name: str, domain: str, now: float) -> None:
+        if self.timings[name]['start_time'] is None:
+            self.timings[name]['start_time'] = scan_utils.local_now()
+        self.running[name] += 1
+        self.pool_running[self.pools[name]] += 1
+        for limit, key in zip(self.politeness, self.keys.get(domain, [])):
+            limit.acquire(key, now)
+        future = self.submit(name, domain)
+        self.in_flight[future] = (name, domain)
+        self.started[future] = now
+        future.add_done_callback(self.finished.put)
+        if (self.controller is not None) and (self.running[name] >= self.limits[name]):
+            self.controller.full(name)
+        if name in self.timeouts:
+            heapq.heappush(self.deadlines, (
+                time.monotonic() + self.timeouts[name], next(self._sequence), future))
+
+    # Seconds until a held-back task could start, or a running task times
+    # out, whichever is sooner. None if neither.
+    def _next_wakeup(self) -> Union[float, None]:
+        while self.deadlines and (self.deadlines[0][2] not in self.in_flight):
+            heapq.heappop(self.deadlines)
+        if not self.deadlines:
+            return self._wakeup
+        until = max(0.0, self.deadlines[0][0] - time.monotonic())
+        return until if self._wakeup is None else min(until, self._wakeup)
+
+    # Give up on running tasks that are past their deadline.
+    def _expire(self) -> None:
+        now = time.monotonic()
+        while self.deadlines and (self.deadlines[0][0] <= now):
+            _, _, future = heapq.heappop(self.deadlines)
+            if (future not in self.in_flight) or future.done():
+                continue
+            name, domain = self.in_flight[future]
+            logging.warning("[%s][%s] Timed out after %gs." % (
+                domain, name, self.timeouts[name]))
+            if self.on_timeout is not None:
+                self.on_timeout(name, domain, future)
+            self._complete(future, timed_out=True)
+
+    def _complete(self, future: Future, timed_out: bool = False) -> None:
+        name, domain = self.in_flight.pop(future)
+        started = self.started.pop(future)
+        if self.controller is not None:
+            self.controller.record(name, time.monotonic() - started, timed_out=timed_out)
+        self.outstanding -= 1
+        self.running[name] -= 1
+        self.pool_running[self.pools[name]] -= 1
+        self.timings[name]['end_time'] = scan_utils.local_now()
+
+        if self.politeness:
+            for limit, key in zip(self.politeness, self.keys[domain]):
+                limit.release(key)
+            self.domain_tasks[domain] -= 1
+            if self.domain_tasks[domain] == 0:
+                del self.domain_tasks[domain]
+                del self.keys[domain]
+
+        # Tasks are expected to handle their own errors, but don't let
+        # one that slipped through take down the whole scan.
+        exception = None if timed_out else future.exception()
+        if exception is not None:
+            logging.warning("[%s][%s] Task failed: %s" % (domain, name, exception))
+
+        self._release(name, domain)
+
+    # Take up the controller's latest limits (never past the fixed ones).
+    def _adjust(self) -> None:
+        for name, limit in self.controller.update().items():
+            if name in self.caps:
+                self.limits[name] = min(limit, self.caps[name])
+
+    def durations(self) -> dict:
+        """Per-scanner start/end/duration, in the shape used by meta.json."""
+        durations = {}
+        for name, timing in self.timings.items():
+            start_time, end_time = timing['start_time'], timing['end_time']
+            duration = None
+            if (start_time is not None) and (end_time is not None):
+                duration = end_time - start_time
+            durations[name] = {
+                'start_time': scan_utils.utc_timestamp(start_time),
+                'end_time': scan_utils.utc_timestamp(end_time),
+                'duration': scan_utils.just_microseconds(duration)
+            }
+        return durations
+
+
+def check_acyclic(dependencies: Dict[str, set]) -> None:
+    """Raise a ValueError if scanners depend on each other in a cycle."""
+    done = set()  # type: set
+
+    def visit(name, path):
+        if name in path:
+            cycle = " -> ".join(path[path.index(name):] + [name])
+            raise ValueError("Scanner dependencies form a cycle: %s" % cycle)
+        if name in done:
+            return
+        for dependency in sorted(dependencies.get(name, [])):
+            visit(dependency, path + [name])
+        done.add(name)
+
+    for name in sorted(dependencies):
+        visit(name, [])
+
+
+class TokenBucket:
+    """Allows ``rate`` events per second, in bursts of up to ``capacity``."""
+
+    def __init__(self, rate: float, capacity: float, now: float) -> None:
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = now
+
+    def _refill(self, now: float) -> None:
+        elapsed = max(0.0, now - self.updated)
+        self.tokens = min(self.capacity, self.tokens + (elapsed * self.rate))
+        self.updated = now
+
+    def delay(self, now: float) -> float:
+        """Seconds until the next event is allowed (0 if it is now)."""
+        self._refill(now)
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def take(self, now: float) -> None:
+        self._refill(now)
+        self.tokens -= 1
+
+    def full(self, now: float) -> bool:
+        self._refill(now)
+        return self.tokens >= self.capacity
+
+
+class Politeness:
+    """
+    Caps how many tasks run at once (``limit``) and how many start per
+    second (``rate``), across all domains that share a key.
+    ``key_for(domain)`` gives the key (e.g. the base domain), or None to
+    leave that domain alone.
+    """
+
+    # Start forgetting rate limits for idle keys past this many.
+    max_buckets = 10000
+
+    def __init__(self, key_for: Callable[[str], Union[str, None]],
+                 limit: int = None, rate: float = None) -> None:
+        self.key_for = key_for
+        self.limit = limit
+        self.rate = rate
+        self.active = {}  # type: Dict[str, int]
+        self.buckets = {}  # type: Dict[str, TokenBucket]
+
+    def delay(self, key: Union[str, None], now: float) -> float:
+        """
+        Seconds until a task for ``key`` could start: 0 if it can start
+        now, or infinity if it has to wait for another task to finish.
+        """
+        if key is None:
+            return 0.0
+        if (self.limit is not None) and (self.active.get(key, 0) >= self.limit):
+            return math.inf
+        if key in self.buckets:
+            return self.buckets[key].delay(now)
+        return 0.0
+
+    def acquire(self, key: Union[str, None], now: float) -> None:
+        if key is None:
+            return
+        self.active[key] = self.active.get(key, 0) + 1
+        if self.rate is not None:
+            if key not in self.buckets:
+                self._prune(now)
+                # No bursts: tasks start evenly spaced out.
+                self.buckets[key] = TokenBucket(self.rate, 1, now)
+            self.buckets[key].take(now)
+
+    def release(self, key: Union[str, None]) -> None:
+        if key is None:
+            return
+        self.active[key] -= 1
+        if self.active[key] == 0:
+            del self.active[key]
+
+    # A full bucket for a key with nothing running is the same as none.
+    def _prune(self, now: float) -> None:
+        if len(self.buckets) < self.max_buckets:
+            return
+        for key in list(self.buckets):
+            if (key not in self.active) and self.buckets[key].full(now):
+                del self.buckets[key]
+
+
+class AdaptiveLimits:
+    """
+    Adjusts how many tasks each scanner runs at once, during a scan,
+    between ``bounds[name] = (lowest, highest)``.
+
+    Every ``interval`` seconds, each scanner's recent tasks are checked
+    for signs of trouble: the median task taking ``latency_factor`` times
+    longer than the best seen so far, or more than ``max_timeout_rate`` of
+    tasks timing out. A scanner in trouble has its limit cut by
+    ``decrease``; otherwise, if it was using all of its slots, it gets a
+    few more. (Additive increase, multiplicative decrease.) Every scanner
+    is cut back when this machine is short on resources, as measured by
+    ``usage()`` (see ``resource_usage``).
+
+    Scanners start at their lowest limit, and double it each interval
+    until the first sign of trouble, or they reach their highest.
+    """
+
+    interval = 5.0
+    latency_factor = 2.0
+    max_timeout_rate = 0.05
+    decrease = 0.5
+    # Tasks needed in an interval to judge a scanner's latency.
+    min_samples = 5
+
+    # Resource pressure: fraction of the open file limit in use, fraction
+    # of physical memory used by this process, and load per CPU.
+    max_files = 0.8
+    max_memory = 0.8
+    max_load = 2.0
+
+    def __init__(self, bounds: Dict[str, Tuple[int, int]],
+                 usage: Callable[[], Dict[str, Union[float, None]]] = None,
+                 now: float = None) -> None:
+        self.bounds = dict(bounds)
+        self.usage = usage or resource_usage
+        self.limits = {name: low for name, (low, high) in self.bounds.items()}
+        self.slow_start = {name: True for name in self.bounds}
+        # Best median latency seen so far, per scanner.
+        self.baseline = {}  # type: Dict[str, float]
+        self._reset()
+        self.updated = time.monotonic() if now is None else now
+
+    def _reset(self) -> None:
+        self.latencies = {name: [] for name in self.bounds}  # type: Dict[str, List[float]]
+        self.timeouts = {name: 0 for name in self.bounds}
+        self.saturated = set()  # type: Set[str]
+
+    def record(self, name: str, latency: float, timed_out: bool = False) -> None:
+        """Note how long one of a scanner's tasks took, or that it timed out."""
+        if timed_out:
+            self.timeouts[name] += 1
+        else:
+            self.latencies[name].append(latency)
+
+    def full(self, name: str) -> None:
+        """Note that a scanner is using all of its slots."""
+        self.saturated.add(name)
+
+    def update(self, now: float = None) -> Dict[str, int]:
+        """The limit for each scanner, adjusted once every ``interval``."""
+        now = time.monotonic() if now is None else now
+        if (now - self.updated) < self.interval:
+            return self.limits
+        self.updated = now
+
+        pressure = self._pressure()
+        for name in self.bounds:
+            trouble = pressure or self._trouble(name)
+            if trouble:
+                self._set(name, int(self.limits[name] * self.decrease), trouble)
+                self.slow_start[name] = False
+            elif name in self.saturated:
+                if self.slow_start[name]:
+                    self._set(name, self.limits[name] * 2, "slow start")
+                else:
+                    low, high = self.bounds[name]
+                    self._set(name, self.limits[name] + max(1, high // 20), "no trouble")
+
+        self._reset()
+        return self.limits
+
+    def _set(self, name: str, limit: int, reason: str) -> None:
+        low, high = self.bounds[name]
+        limit = max(low, min(high, limit))
+        if limit != self.limits[name]:
+            logging.debug("[%s] Workers: %i -> %i (%s)." % (
+                name, self.limits[name], limit, reason))
+            self.limits[name] = limit
+
+    def _trouble(self, name: str) -> Union[str, None]:
+        latencies = sorted(self.latencies[name])
+        finished = len(latencies) + self.timeouts[name]
+        if finished and (self.timeouts[name] / finished) > self.max_timeout_rate:
+            return "timeouts"
+
+        if len(latencies) < self.min_samples:
+            return None
+        median = latencies[len(latencies) // 2]
+        baseline = self.baseline.get(name)
+        if (baseline is None) or (median < baseline):
+            self.baseline[name] = median
+            return None
+        if median > (baseline * self.latency_factor):
+            return "latency"
+        return None
+
+    def _pressure(self) -> Union[str, None]:
+        usage = self.usage()
+        for key, limit in (("files", self.max_files), ("memory", self.max_memory),
+                           ("load", self.max_load)):
+            if (usage.get(key) is not None) and (usage[key] > limit):
+                return "%s pressure" % key
+        return None
+
+
+def resource_usage() -> Dict[str, Union[float, None]]:
+    """
+    How much of this machine the scan is using: the fraction of the open
+    file limit in use, the fraction of physical memory this process is
+    using, and the load average per CPU. None for anything that can't be
+    measured here.
+    """
+    usage = {'files': None, 'memory': None, 'load': None}  # type: Dict[str, Union[float, None]]
+
+    try:
+        import resource
+        soft, _ = resource.getrlimit(resource.RLIMIT_NOFILE)
+        if soft > 0:
+            usage['files'] = len(os.listdir("/proc/self/fd")) / soft
+    except (ImportError, OSError, ValueError):
+        pass
+
+    try:
+        with open("/proc/self/statm") as statm:
+            resident = int(statm.read().split()[1])
+        usage['memory'] = resident / os.sysconf("SC_PHYS_PAGES")
+    except (OSError, ValueError, IndexError):
+        pass
+
+    try:
+        usage['load'] = os.getloadavg()[0] / (os.cpu_count() or 1)
+    except (AttributeError, OSError):
+        pass
+
+    return usage
+
+
+class ThrottleGovernor:
+    """
+    Limits how many requests to a throttled service (e.g. Lambda invokes)
+    are in flight at once, across every thread that shares it, to what
+    the service lets this account run.
+
+    Starts at ``highest``. Being throttled cuts the limit by ``decrease``
+    (at most once every ``cooldown`` seconds, since requests in flight
+    together tend to be throttled together); going as many requests as
+    the limit without being throttled adds one back, up to ``highest``.
+    (Additive increase, multiplicative decrease.)
+    """
+
+    decrease = 0.5
+    cooldown = 1.0
+
+    def __init__(self, highest: int, lowest: int = 1,
+                 clock: Callable[[], float] = time.monotonic) -> None:
+        self.highest = max(1, highest)
+        self.lowest = max(1, min(lowest, self.highest))
+        self.clock = clock
+        self.limit = self.highest
+        self.in_flight = 0
+        self.throttles = 0
+        self._successes = 0
+        self._cut = None  # type: Union[float, None]
+        self._condition = threading.Condition()
+
+    def acquire(self) -> None:
+        """Wait until another request can be in flight."""
+        with self._condition:
+            while self.in_flight >= self.limit:
+                self._condition.wait()
+            self.in_flight += 1
+
+    def release(self) -> None:
+        with self._condition:
+            self.in_flight -= 1
+            self._condition.notify()
+
+    def __enter__(self) -> "ThrottleGovernor":
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.release()
+
+    def throttled(self) -> None:
+        """Note that a request was throttled."""
+        with self._condition:
+            self.throttles += 1
+            self._successes = 0
+            now = self.clock()
+            if (self._cut is not None) and ((now - self._cut) < self.cooldown):
+                return
+            self._cut = now
+            self._set(int(self.limit * self.decrease), "throttled")
+
+    def succeeded(self) -> None:
+        """Note that a request got through."""
+        with self._condition:
+            self._successes += 1
+            if (self._successes >= self.limit) and (self.limit < self.highest):
+                self._successes = 0
+                self._set(self.limit + 1, "no throttles")
+                self._condition.notify_all()
+
+    def _set(self, limit: int, reason: str) -> None:
+        limit = max(self.lowest, min(self.highest, limit))
+        if limit != self.limit:
+            logging.debug("Requests in flight: %i -> %i (%s)." % (self.limit, limit, reason))
+            self.limit = limit
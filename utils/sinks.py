@@ -0,0 +1,291 @@
+import csv
+import json
+import os
+import sqlite3
+from typing import Any, List
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+
+###
+# Where each scanner's results go (--output-format).
+#
+# Every sink takes the same rows: the scanner's `headers`, and the rows
+# from its `to_rows` (plus the domain and --meta columns). CSV is the
+# default. The others keep each value's type (booleans, numbers, lists),
+# so nothing downstream has to guess at them again:
+#
+#   jsonl:   one JSON object per row, keyed by header.
+#   sqlite:  one table per scanner, indexed on domain.
+#   parquet: columnar, for analysis tools. Needs pyarrow.
+#
+# Sinks are written to from one thread (the ResultWriter's), in batches.
+# For --resume, each sink can report a position that everything written
+# so far is safely stored up to, and be cut back to one later.
+###
+
+
+class CSVSink:
+    """One scanner's results, as a CSV with a header row."""
+
+    extension = "csv"
+
+    def __init__(self, path: str, headers: List[str], append: bool = False) -> None:
+        self.path = path
+        self.headers = headers
+        append = append and os.path.exists(path)
+        self.file = open(path, 'a' if append else 'w', encoding='utf-8', newline='')
+        self._start(append)
+
+    def _start(self, append: bool) -> None:
+        self.writer = csv.writer(self.file)
+        if not append:
+            self.writer.writerow(self.headers)
+
+    def writerows(self, rows: List[list]) -> None:
+        self.writer.writerows(rows)
+
+    def flush(self) -> None:
+        self.file.flush()
+
+    def checkpoint(self) -> int:
+        """Sync everything written to disk. Returns the file's size."""
+        self.flush()
+        os.fsync(self.file.fileno())
+        return os.fstat(self.file.fileno()).st_size
+
+    def close(self) -> None:
+        self.file.close()
+
+    @classmethod
+    def restore(cls, path: str, position: int) -> None:
+        """Cut the results back to a position from ``checkpoint``."""
+        with open(path, 'r+b') as results:
+            results.truncate(position)
+
+    @classmethod
+    def exists(cls, path: str) -> bool:
+        """Whether anything was written to the results at ``path``."""
+        return os.path.exists(path)
+
+    @classmethod
+    def remove(cls, path: str) -> None:
+        os.remove(path)
+
+
+class JSONLinesSink(CSVSink):
+    """One scanner's results, as one JSON object per line."""
+
+    extension = "jsonl"
+
+    def _start(self, append: bool) -> None:
+        pass
+
+    def writerows(self, rows: List[list]) -> None:
+        self.file.write("".join(
+            json.dumps(dict(zip(self.headers, row)), default=str) + "\n"
+            for row in rows
+        ))
+
+
+class SQLiteSink:
+    """
+    One scanner's results, as a table (named after the scanner) in a
+    SQLite database. Lists and dicts are stored as JSON.
+    """
+
+    extension = "db"
+
+    def __init__(self, path: str, headers: List[str], append: bool = False) -> None:
+        self.path = path
+        self.headers = headers
+        self.table = _quote(os.path.splitext(os.path.basename(path))[0])
+        if not append and os.path.exists(path):
+            os.remove(path)
+
+        # Opened here, but written to from the ResultWriter's thread.
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        columns = ", ".join(_quote(header) for header in headers)
+        self.db.execute("CREATE TABLE IF NOT EXISTS %s (%s)" % (self.table, columns))
+        self.db.execute("CREATE INDEX IF NOT EXISTS %s ON %s (%s)" % (
+            _quote("%s_domain" % self.table.strip('"')), self.table, _quote(headers[0])))
+        self.db.commit()
+        self.insert = "INSERT INTO %s VALUES (%s)" % (
+            self.table, ", ".join("?" for _ in headers))
+        self.count = self.db.execute("SELECT COUNT(*) FROM %s" % self.table).fetchone()[0]
+
+    def writerows(self, rows: List[list]) -> None:
+        self.db.executemany(self.insert, ([_sqlite_value(v) for v in row] for row in rows))
+        self.count += len(rows)
+
+    def flush(self) -> None:
+        self.db.commit()
+
+    def checkpoint(self) -> int:
+        """Commit everything written. Returns the number of rows."""
+        self.flush()
+        return self.count
+
+    def close(self) -> None:
+        self.db.commit()
+        self.db.close()
+
+    @classmethod
+    def restore(cls, path: str, position: int) -> None:
+        table = _quote(os.path.splitext(os.path.basename(path))[0])
+        db = sqlite3.connect(path)
+        db.execute("DELETE FROM %s WHERE rowid > ?" % table, (position,))
+        db.commit()
+        db.close()
+
+    @classmethod
+    def exists(cls, path: str) -> bool:
+        return os.path.exists(path)
+
+    @classmethod
+    def remove(cls, path: str) -> None:
+        os.remove(path)
+
+
+def _quote(name: str) -> str:
+    return '"%s"' % name.replace('"', '""')
+
+
+def _sqlite_value(value: Any) -> Any:
+    if isinstance(value, (list, dict)):
+        return json.dumps(value, default=str)
+    return value
+
+
+class ParquetSink:
+    """
+    One scanner's results, as a Parquet file.
+
+    Parquet needs each column's type up front, which can't be known until
+    every row has been seen. So rows are written to a JSON Lines file
+    alongside it as they come in, and converted to Parquet, a batch at a
+    time, when the sink is closed.
+    """
+
+    extension = "parquet"
+    # Rows per Parquet row group.
+    batch_size = 10000
+
+    def __init__(self, path: str, headers: List[str], append: bool = False) -> None:
+        if pyarrow is None:
+            raise ImportError("--output-format=parquet needs pyarrow installed.")
+        self.path = path
+        self.headers = headers
+        self.spill_path = path + ".jsonl"
+
+        # Pick up from a finished file (e.g. resuming a finished scan).
+        if append and os.path.exists(path) and not os.path.exists(self.spill_path):
+            spill = JSONLinesSink(self.spill_path, headers)
+            for batch in pyarrow.parquet.ParquetFile(path).iter_batches(self.batch_size):
+                spill.writerows([list(row.values()) for row in batch.to_pylist()])
+            spill.close()
+
+        self.spill = JSONLinesSink(self.spill_path, headers, append=append)
+
+    def writerows(self, rows: List[list]) -> None:
+        self.spill.writerows(rows)
+
+    def flush(self) -> None:
+        self.spill.flush()
+
+    def checkpoint(self) -> int:
+        return self.spill.checkpoint()
+
+    def close(self) -> None:
+        self.spill.close()
+
+        types = self._types()
+        schema = pyarrow.schema([
+            (header, types[header]) for header in self.headers
+        ])
+        with pyarrow.parquet.ParquetWriter(self.path, schema) as writer:
+            for batch in self._batches():
+                columns = {
+                    header: [_parquet_value(row.get(header), types[header]) for row in batch]
+                    for header in self.headers
+                }
+                writer.write_table(pyarrow.Table.from_pydict(columns, schema=schema))
+        os.remove(self.spill_path)
+
+    def _batches(self):
+        batch = []
+        with open(self.spill_path, encoding='utf-8') as spill:
+            for line in spill:
+                batch.append(json.loads(line))
+                if len(batch) >= self.batch_size:
+                    yield batch
+                    batch = []
+        if batch:
+            yield batch
+
+    # The narrowest type that fits every value in each column.
+    def _types(self) -> dict:
+        seen = {header: set() for header in self.headers}  # type: dict
+        for batch in self._batches():
+            for row in batch:
+                for header in self.headers:
+                    value = row.get(header)
+                    if value is not None:
+                        seen[header].add(type(value))
+
+        types = {}
+        for header, kinds in seen.items():
+            if kinds == {bool}:
+                types[header] = pyarrow.bool_()
+            elif kinds == {int}:
+                types[header] = pyarrow.int64()
+            elif kinds and kinds <= {int, float}:
+                types[header] = pyarrow.float64()
+            else:
+                types[header] = pyarrow.string()
+        return types
+
+    @classmethod
+    def restore(cls, path: str, position: int) -> None:
+        # Without the JSON Lines file, the Parquet file was finished.
+        spill_path = path + ".jsonl"
+        if os.path.exists(spill_path):
+            JSONLinesSink.restore(spill_path, position)
+
+    # A scan that stopped part way through only has the JSON Lines file.
+    @classmethod
+    def exists(cls, path: str) -> bool:
+        return os.path.exists(path) or os.path.exists(path + ".jsonl")
+
+    @classmethod
+    def remove(cls, path: str) -> None:
+        for result in (path, path + ".jsonl"):
+            if os.path.exists(result):
+                os.remove(result)
+
+
+def _parquet_value(value: Any, column_type: Any) -> Any:
+    if (value is None) or (column_type != pyarrow.string()):
+        return value
+    if isinstance(value, str):
+        return value
+    return json.dumps(value, default=str)
+
+
+SINKS = {
+    'csv': CSVSink,
+    'jsonl': JSONLinesSink,
+    'sqlite': SQLiteSink,
+    'parquet': ParquetSink,
+}
+
+
+def sink_for(output_format: str):
+    """The sink class for an --output-format."""
+    if output_format not in SINKS:
+        raise ValueError("Unknown output format: %s" % output_format)
+    return SINKS[output_format]
@@ -13,14 +13,11 @@ import csv
 import logging
 import datetime
 import strict_rfc3339
-import codecs
 from itertools import chain
-from urllib.error import URLError
 
-import publicsuffix
 from utils.scan_utils import options as options_for_scan
-# global in-memory cache
-suffix_list = None
+from utils.scan_utils import time_left
+from utils import scan_utils
 
 
 # /Time Conveniences #
@@ -179,8 +176,8 @@ def build_gather_options_parser(services):
         "be excluded."
     ]))
     parser.add_argument("--sort", action="store_true", help="".join([
-        "Sort result CSVs by domain name, alphabetically. (Note: this causes ",
-        "the entire dataset to be read into memory.)",
+        "Sort result CSVs by domain name, alphabetically. Sorts in chunks ",
+        "on disk, so big CSVs need temporary disk space, not memory.",
     ]))
     parser.add_argument("--suffix", nargs=1, required=True, help="".join([
         "Comma-separated list of suffixes, e.g '.gov' ",
@@ -418,10 +415,11 @@ def try_command(command):
 
 def scan(command, env=None, allowed_return_codes=[]):
     try:
+        # Killed (raising subprocess.TimeoutExpired) at the scan's deadline.
         response = subprocess.check_output(
             command,
             stderr=subprocess.STDOUT,
-            shell=False, env=env
+            shell=False, env=env, timeout=time_left()
         )
         return str(response, encoding='UTF-8')
     except subprocess.CalledProcessError as exc:
@@ -458,16 +456,13 @@ def cache_single(filename, cache_dir="./cache"):
 
 # Used to quickly get cached data for a domain.
 def data_for(domain, operation, cache_dir="./cache"):
-    path = cache_path(domain, operation, cache_dir=cache_dir)
-    if os.path.exists(path):
-        raw = read(path)
-        data = json.loads(raw)
-        if isinstance(data, dict) and (data.get('invalid', False)):
-            return None
-        else:
-            return data
-    else:
-        return {}
+    return scan_utils.data_for(domain, operation, cache_dir=cache_dir)
+
+
+# Used to quickly answer questions about a domain's pshtt or trustymail
+# data, from an index kept in memory.
+def summary_for(domain, operation, cache_dir="./cache"):
+    return scan_utils.summary_for(domain, operation, cache_dir=cache_dir)
 
 
 # marker for a cached invalid response
@@ -490,51 +485,13 @@ def local_now():
 
 # Return base domain for a subdomain, factoring in the Public Suffix List.
 def base_domain_for(subdomain, cache_dir="./cache"):
-    global suffix_list
-
-    """
-    For "x.y.domain.gov", return "domain.gov".
-
-    If suffix_list is None, the caches have not been initialized, so do that.
-    """
-    if suffix_list is None:
-        suffix_list, discard = load_suffix_list(cache_dir=cache_dir)
-
-    if suffix_list is None:
-        logging.warning("Error downloading the PSL.")
-        exit(1)
+    return scan_utils.base_domain_for(subdomain, cache_dir=cache_dir)
 
-    return suffix_list.get_public_suffix(subdomain)
 
-
-# Returns an instantiated PublicSuffixList object, and the
-# list of lines read from the file.
+# Returns a compiled Public Suffix List, and the list of lines read from
+# the file.
 def load_suffix_list(cache_dir="./cache"):
-
-    cached_psl = cache_single("public-suffix-list.txt", cache_dir=cache_dir)
-
-    if os.path.exists(cached_psl):
-        logging.debug("Using cached Public Suffix List...")
-        with codecs.open(cached_psl, encoding='utf-8') as psl_file:
-            suffixes = publicsuffix.PublicSuffixList(psl_file)
-            content = psl_file.readlines()
-    else:
-        # File does not exist, download current list and cache it at given location.
-        logging.debug("Downloading the Public Suffix List...")
-        try:
-            cache_file = publicsuffix.fetch()
-        except URLError as err:
-            logging.warning("Unable to download the Public Suffix List...")
-            logging.debug("{}".format(err))
-            return None, None
-
-        content = cache_file.readlines()
-        suffixes = publicsuffix.PublicSuffixList(content)
-
-        # Cache for later.
-        write(''.join(content), cached_psl)
-
-    return suffixes, content
+    return scan_utils.load_suffix_list(cache_dir=cache_dir)
 
 
 # Check whether we have HTTP behavior data cached for a domain.
@@ -542,22 +499,11 @@ def load_suffix_list(cache_dir="./cache"):
 # Useful for saving time on TLS-related scanning.
 def domain_doesnt_support_https(domain, cache_dir="./cache"):
     # Make sure we have the cached data.
-    inspection = data_for(domain, "pshtt", cache_dir=cache_dir)
+    inspection = summary_for(domain, "pshtt", cache_dir=cache_dir)
     if not inspection:
         return False
 
-    if (inspection.__class__ is dict) and inspection.get('invalid'):
-        return False
-
-    https = inspection.get("endpoints").get("https")
-    httpswww = inspection.get("endpoints").get("httpswww")
-
-    def endpoint_used(endpoint):
-        # commented out next line to remove bad hostname check so we can still get info about weak crypto even if the cert doesn't match
-        # return endpoint.get("live") and (not endpoint.get("https_bad_hostname"))
-        return endpoint.get("live")
-
-    return (not (endpoint_used(https) or endpoint_used(httpswww)))
+    return (not inspection.https_live)
 
 
 # Check whether we have HTTP behavior data cached for a domain.
@@ -568,15 +514,13 @@ def domain_uses_www(domain, cache_dir="./cache"):
         return False
 
     # Make sure we have the data.
-    inspection = data_for(domain, "pshtt", cache_dir=cache_dir)
+    inspection = summary_for(domain, "pshtt", cache_dir=cache_dir)
 
     if not inspection:
         return False
-    if (inspection.__class__ is dict) and inspection.get('invalid'):
-        return False
 
     # We know the canonical URL, return True if it's www.
-    url = inspection.get("Canonical URL")
+    url = inspection.canonical_url
     return (
         url.startswith("http://www") or
         url.startswith("https://www")
@@ -584,14 +528,7 @@ def domain_uses_www(domain, cache_dir="./cache"):
 
 
 def domain_mail_servers_that_support_starttls(domain, cache_dir="./cache"):
-    retVal = []
-    data = data_for(domain, 'trustymail', cache_dir=cache_dir)
-    if data:
-        starttls_results = data.get('Domain Supports STARTTLS Results')
-        if starttls_results:
-            retVal = starttls_results.split(', ')
-
-    return retVal
+    return list(summary_for(domain, 'trustymail', cache_dir=cache_dir) or [])
 
 
 # Check whether we have HTTP behavior data cached for a domain.
@@ -599,11 +536,11 @@ def domain_mail_servers_that_support_starttls(domain, cache_dir="./cache"):
 # Useful for skipping scans on non-live domains.
 def domain_not_live(domain, cache_dir="./cache"):
     # Make sure we have the data.
-    inspection = data_for(domain, "pshtt", cache_dir=cache_dir)
+    inspection = summary_for(domain, "pshtt", cache_dir=cache_dir)
     if not inspection:
         return False
 
-    return (not inspection.get("Live"))
+    return (not inspection.live)
 
 
 # Check whether we have HTTP behavior data cached for a domain.
@@ -611,11 +548,11 @@ def domain_not_live(domain, cache_dir="./cache"):
 # Useful for skipping scans on redirect domains.
 def domain_is_redirect(domain, cache_dir="./cache"):
     # Make sure we have the data.
-    inspection = data_for(domain, "pshtt", cache_dir=cache_dir)
+    inspection = summary_for(domain, "pshtt", cache_dir=cache_dir)
     if not inspection:
         return False
 
-    return (inspection.get("Redirect") is True)
+    return (inspection.redirect is True)
 
 
 # Check whether we have HTTP behavior data cached for a domain.
@@ -623,11 +560,30 @@ def domain_is_redirect(domain, cache_dir="./cache"):
 # Useful for focusing scans on the right endpoint.
 def domain_canonical(domain, cache_dir="./cache"):
     # Make sure we have the data.
-    inspection = data_for(domain, "pshtt", cache_dir=cache_dir)
+    inspection = summary_for(domain, "pshtt", cache_dir=cache_dir)
     if not inspection:
         return False
 
-    return (inspection.get("Canonical URL"))
+    return (inspection.canonical_url)
+
+
+# An index of an HSTS preload list (e.g. from pshtt.load_preload_list),
+# which only has entries that include subdomains. Built once, and safe to
+# share between threads.
+def preload_index(names):
+    return frozenset(name.lower().strip('.') for name in names)
+
+
+# Which of a hostname and its parent domains are in a preload index,
+# e.g. ["a.b.gov"] for "x.a.b.gov" if "a.b.gov" is preloaded. Since the
+# list's entries include subdomains, any parent in there means the
+# hostname is preloaded too. One lookup per label, however long the list.
+def preloaded_names(hostname, index):
+    labels = hostname.lower().strip('.').split('.')
+    return [
+        name for name in ('.'.join(labels[i:]) for i in range(len(labels)))
+        if name in index
+    ]
 
 
 # Load the first column of a CSV into memory as an array of strings.
@@ -652,49 +608,10 @@ def load_domains(domain_csv, whole_rows=False):
     return domains
 
 
-# Sort a CSV by domain name, "in-place" (by making a temporary copy).
-# This loads the whole thing into memory: it's not a great solution for
-# super-large lists of domains.
+# Sort a CSV by domain name, "in-place". The same out-of-core sort as
+# ./scan --sort uses.
 def sort_csv(input_filename):
-    logging.warning("Sorting %s..." % input_filename)
-
-    input_file = open(input_filename, encoding='utf-8', newline='')
-    tmp_filename = "%s.tmp" % input_filename
-    tmp_file = open(tmp_filename, 'w', newline='')
-    tmp_writer = csv.writer(tmp_file)
-
-    # store list of domains, to sort at the end
-    domains = []
-
-    # index rows by domain
-    rows = {}
-    header = None
-
-    for row in csv.reader(input_file):
-        # keep the header around
-        if (row[0].lower() == "domain"):
-            header = row
-            continue
-
-        # index domain for later reference
-        domain = row[0]
-        domains.append(domain)
-        rows[domain] = row
-
-    # straight alphabet sort
-    domains.sort()
-
-    # write out to a new file
-    tmp_writer.writerow(header)
-    for domain in domains:
-        tmp_writer.writerow(rows[domain])
-
-    # close the file handles
-    input_file.close()
-    tmp_file.close()
-
-    # replace the original
-    shutil.move(tmp_filename, input_filename)
+    scan_utils.sort_csv(input_filename)
 
 
 # Given a domain suffix, provide a compiled regex.
@@ -0,0 +1,356 @@
+import json
+import logging
+import os
+import queue
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Dict, Iterable, Iterator, List, Tuple
+
+
+###
+# A work queue for spreading a scan across any number of machines
+# (./scan --enqueue, and ./scan --worker), kept in a SQLite file on
+# storage they all share.
+#
+# Each domain gets one task per scanner. Workers lease domains a few at
+# a time, and run every unfinished task for each domain they lease, so a
+# domain's scanners can still depend on each other's cached results.
+# Rows for each finished task are written back to the queue, and the
+# coordinator writes them out to the result CSVs.
+#
+# Workers keep their leases alive with a heartbeat. A lease that runs
+# out (because the worker died, or lost touch) goes back in the queue for
+# another worker, minus any of its tasks that were already finished.
+###
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS settings (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS domains (
+    id INTEGER PRIMARY KEY,
+    domain TEXT NOT NULL UNIQUE,
+    state TEXT NOT NULL DEFAULT 'queued',
+    worker TEXT,
+    lease_expires REAL,
+    attempts INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS domains_state ON domains (state, id);
+CREATE INDEX IF NOT EXISTS domains_worker ON domains (worker, state);
+CREATE TABLE IF NOT EXISTS tasks (
+    domain_id INTEGER NOT NULL REFERENCES domains (id),
+    scanner TEXT NOT NULL,
+    done INTEGER NOT NULL DEFAULT 0,
+    rows TEXT,
+    PRIMARY KEY (domain_id, scanner)
+);
+"""
+
+# Domain states.
+QUEUED = "queued"
+LEASED = "leased"
+DONE = "done"
+# Given up on, after its lease ran out too many times.
+FAILED = "failed"
+
+
+class SQLiteQueue:
+    """
+    The work queue in the SQLite file at ``path``. Safe to use from many
+    threads (each gets its own connection) and many processes.
+
+    A domain is given up on after its lease runs out ``max_attempts``
+    times, so that one domain that reliably kills workers can't stall
+    the whole scan.
+    """
+
+    # Seconds to wait on another process's lock on the database.
+    timeout = 60
+    max_attempts = 3
+
+    def __init__(self, path: str, max_attempts: int = None) -> None:
+        self.path = path
+        if max_attempts is not None:
+            self.max_attempts = max_attempts
+        self.local = threading.local()
+
+        self._connection().executescript(SCHEMA)
+
+    def _connection(self) -> sqlite3.Connection:
+        if getattr(self.local, "db", None) is None:
+            # Autocommit, so transactions are only what _transaction begins.
+            self.local.db = sqlite3.connect(
+                self.path, timeout=self.timeout, isolation_level=None)
+        return self.local.db
+
+    def _transaction(self):
+        return Transaction(self._connection())
+
+    def close(self) -> None:
+        if getattr(self.local, "db", None) is not None:
+            self.local.db.close()
+            self.local.db = None
+
+    def add(self, domains: Iterable[str], names: List[str], batch_size: int = 1000) -> int:
+        """
+        Add a task for each scanner to each domain. Domains already in the
+        queue are left alone, so re-running --enqueue just picks up where
+        it left off. Returns how many domains were added.
+        """
+        self.check_scanners(names)
+
+        added = 0
+        batch = []  # type: List[str]
+        for domain in domains:
+            batch.append(domain)
+            if len(batch) >= batch_size:
+                added += self._add(batch, names)
+                batch = []
+        if batch:
+            added += self._add(batch, names)
+        return added
+
+    def _add(self, batch: List[str], names: List[str]) -> int:
+        added = 0
+        with self._transaction() as db:
+            for domain in batch:
+                cursor = db.execute(
+                    "INSERT OR IGNORE INTO domains (domain) VALUES (?)", (domain,))
+                if cursor.rowcount:
+                    added += 1
+                    db.executemany(
+                        "INSERT INTO tasks (domain_id, scanner) VALUES (?, ?)",
+                        [(cursor.lastrowid, name) for name in names])
+        return added
+
+    # Every worker has to run the same scanners as the queue was set up for.
+    def check_scanners(self, names: List[str]) -> None:
+        with self._transaction() as db:
+            row = db.execute("SELECT value FROM settings WHERE key = 'scanners'").fetchone()
+            if row is None:
+                db.execute("INSERT INTO settings (key, value) VALUES ('scanners', ?)",
+                           (json.dumps(names),))
+            elif sorted(json.loads(row[0])) != sorted(names):
+                raise ValueError("This queue is for the scanners: %s" % ", ".join(json.loads(row[0])))
+
+    def scanners(self) -> List[str]:
+        row = self._connection().execute(
+            "SELECT value FROM settings WHERE key = 'scanners'").fetchone()
+        return json.loads(row[0]) if row else []
+
+    def lease(self, worker: str, count: int, lease_time: float,
+              now: float = None) -> List[Tuple[str, List[str]]]:
+        """
+        Lease up to ``count`` domains for ``lease_time`` seconds. Returns
+        each domain, with the scanners already done for it.
+        """
+        now = now or time.time()
+        with self._transaction() as db:
+            self._expire(db, now)
+            leased = db.execute(
+                "SELECT id, domain FROM domains WHERE state = ? ORDER BY id LIMIT ?",
+                (QUEUED, count)).fetchall()
+            db.executemany(
+                "UPDATE domains SET state = ?, worker = ?, lease_expires = ?, "
+                "attempts = attempts + 1 WHERE id = ?",
+                [(LEASED, worker, now + lease_time, domain_id) for domain_id, _ in leased])
+
+            results = []
+            for domain_id, domain in leased:
+                finished = db.execute(
+                    "SELECT scanner FROM tasks WHERE domain_id = ? AND done = 1",
+                    (domain_id,)).fetchall()
+                results.append((domain, [name for name, in finished]))
+        return results
+
+    # Put domains whose leases have run out back in the queue.
+    def _expire(self, db: sqlite3.Connection, now: float) -> None:
+        db.execute(
+            "UPDATE domains SET state = ?, worker = NULL "
+            "WHERE state = ? AND lease_expires < ? AND attempts >= ?",
+            (FAILED, LEASED, now, self.max_attempts))
+        db.execute(
+            "UPDATE domains SET state = ?, worker = NULL "
+            "WHERE state = ? AND lease_expires < ?",
+            (QUEUED, LEASED, now))
+
+    def heartbeat(self, worker: str, lease_time: float, now: float = None) -> int:
+        """Extend all of a worker's leases. Returns how many it has."""
+        now = now or time.time()
+        with self._transaction() as db:
+            cursor = db.execute(
+                "UPDATE domains SET lease_expires = ? WHERE worker = ? AND state = ?",
+                (now + lease_time, worker, LEASED))
+            return cursor.rowcount
+
+    def complete(self, worker: str, results: Iterable[Tuple[str, str, List[list]]]) -> int:
+        """
+        Record the CSV rows for finished (scanner, domain) tasks. Only
+        counts while the worker still holds the domain's lease; otherwise
+        another worker has taken over, and its results will be used.
+        Returns how many were recorded.
+        """
+        recorded = 0
+        with self._transaction() as db:
+            for name, domain, rows in results:
+                row = db.execute(
+                    "SELECT id FROM domains WHERE domain = ? AND worker = ? AND state = ?",
+                    (domain, worker, LEASED)).fetchone()
+                if row is None:
+                    continue
+                domain_id = row[0]
+                db.execute(
+                    "UPDATE tasks SET done = 1, rows = ? WHERE domain_id = ? AND scanner = ?",
+                    (json.dumps(rows), domain_id, name))
+                recorded += 1
+
+                remaining = db.execute(
+                    "SELECT COUNT(*) FROM tasks WHERE domain_id = ? AND done = 0",
+                    (domain_id,)).fetchone()[0]
+                if remaining == 0:
+                    db.execute(
+                        "UPDATE domains SET state = ?, worker = NULL WHERE id = ?",
+                        (DONE, domain_id))
+        return recorded
+
+    def counts(self, now: float = None) -> Dict[str, int]:
+        """How many domains are in each state."""
+        with self._transaction() as db:
+            self._expire(db, now or time.time())
+            rows = db.execute("SELECT state, COUNT(*) FROM domains GROUP BY state").fetchall()
+        counts = {QUEUED: 0, LEASED: 0, DONE: 0, FAILED: 0}
+        counts.update(dict(rows))
+        return counts
+
+    def finished(self) -> bool:
+        counts = self.counts()
+        return (counts[QUEUED] == 0) and (counts[LEASED] == 0)
+
+    def results(self) -> Iterator[Tuple[str, str, List[list]]]:
+        """
+        Every task's (scanner, domain, rows), in the order domains were
+        added. Rows are None for tasks that were given up on.
+        """
+        cursor = self._connection().execute(
+            "SELECT tasks.scanner, domains.domain, tasks.rows FROM tasks "
+            "JOIN domains ON domains.id = tasks.domain_id ORDER BY domains.id")
+        for name, domain, rows in cursor:
+            yield name, domain, (json.loads(rows) if rows is not None else None)
+
+
+class Transaction:
+    """``with`` block for one write transaction, taking the lock up front."""
+
+    def __init__(self, db: sqlite3.Connection) -> None:
+        self.db = db
+
+    def __enter__(self) -> sqlite3.Connection:
+        self.db.execute("BEGIN IMMEDIATE")
+        return self.db
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.db.execute("COMMIT")
+        else:
+            self.db.execute("ROLLBACK")
+
+
+def worker_id() -> str:
+    """A name for this worker that's unique across machines."""
+    return "%s-%i-%s" % (socket.gethostname(), os.getpid(), uuid.uuid4().hex[:8])
+
+
+class Heartbeat:
+    """Keep a worker's leases alive from a background thread."""
+
+    def __init__(self, work_queue: SQLiteQueue, worker: str, lease_time: float) -> None:
+        self.work_queue = work_queue
+        self.worker = worker
+        self.lease_time = lease_time
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self) -> None:
+        # Several heartbeats per lease, so one slow one doesn't lose it.
+        while not self.stopped.wait(self.lease_time / 3):
+            try:
+                self.work_queue.heartbeat(self.worker, self.lease_time)
+            except sqlite3.Error as error:
+                logging.warning("Heartbeat failed: %s" % error)
+        self.work_queue.close()
+
+    def stop(self) -> None:
+        self.stopped.set()
+        self.thread.join()
+
+
+class QueueResults:
+    """
+    Stands in for the ResultWriter in a worker: sends finished rows back
+    to the work queue from a background thread, a batch at a time.
+    """
+
+    batch_size = 100
+    flush_interval = 1.0
+
+    def __init__(self, work_queue: SQLiteQueue, worker: str) -> None:
+        self.work_queue = work_queue
+        self.worker = worker
+        self.queue = queue.Queue()  # type: queue.Queue
+        self.error = None  # type: Exception
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def put(self, name: str, domain: str, rows: List[list]) -> None:
+        self.queue.put((name, domain, rows))
+
+    def close(self) -> None:
+        self.queue.put(None)
+        self.thread.join()
+        if self.error is not None:
+            raise self.error
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _run(self) -> None:
+        batch = []
+        last_flush = time.monotonic()
+        while True:
+            timeout = max(0.0, self.flush_interval - (time.monotonic() - last_flush))
+            try:
+                item = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                item = ()
+
+            if item is None:
+                break
+            if item:
+                batch.append(item)
+
+            if batch and ((len(batch) >= self.batch_size) or
+                          (time.monotonic() - last_flush) >= self.flush_interval):
+                self._send(batch)
+                batch = []
+            if (time.monotonic() - last_flush) >= self.flush_interval:
+                last_flush = time.monotonic()
+
+        if batch:
+            self._send(batch)
+        self.work_queue.close()
+
+    def _send(self, batch: list) -> None:
+        try:
+            self.work_queue.complete(self.worker, batch)
+        except sqlite3.Error as error:
+            logging.error("Error sending results to the work queue: %s" % error)
+            self.error = self.error or error
@@ -0,0 +1,198 @@
+import logging
+import queue
+import threading
+import time
+from typing import Dict, List
+
+from utils.journal import Journal
+
+
+###
+# The one place results get written to during a scan.
+#
+# Workers (threads, coroutines, or the main process on behalf of worker
+# processes) only hand finished rows to a queue. A single writer thread
+# takes them off the queue, and writes them out to each scanner's sink in
+# batches, so rows from different workers can never interleave, and the
+# files see a few large writes instead of one per row.
+#
+# Every so often, the writer also syncs the sinks to disk and records a
+# checkpoint in the scan's journal, of which scans are now safely written.
+###
+
+
+class ResultWriter:
+    """
+    Write rows to each scanner's results from a single background thread.
+
+    ``handles[name]`` must have the scanner's ``sink`` (see utils/sinks.py)
+    to write to. Rows are written once ``batch_size`` of
+    them are waiting for a scanner, and everything waiting is written and
+    flushed to disk at least every ``flush_interval`` seconds.
+
+    If the writer falls behind, ``put`` blocks once ``queue_size`` scans'
+    worth of rows are waiting, rather than letting them pile up in memory.
+
+    With a ``journal``, the sinks are synced to disk and a checkpoint is
+    recorded every ``checkpoint_interval`` seconds, and when closing.
+    """
+
+    batch_size = 500
+    flush_interval = 1.0
+    checkpoint_interval = 10.0
+    queue_size = 10000
+
+    def __init__(self, handles: Dict[str, dict], batch_size: int = None,
+                 flush_interval: float = None, journal: Journal = None,
+                 checkpoint_interval: float = None) -> None:
+        self.handles = handles
+        self.journal = journal
+        if batch_size is not None:
+            self.batch_size = batch_size
+        if flush_interval is not None:
+            self.flush_interval = flush_interval
+        if checkpoint_interval is not None:
+            self.checkpoint_interval = checkpoint_interval
+
+        self.queue = queue.Queue(maxsize=self.queue_size)  # type: queue.Queue
+        self.batches = {name: [] for name in handles}  # type: Dict[str, List[list]]
+        # Scanners with rows written since the last flush.
+        self.dirty = set()  # type: set
+        # Scans whose rows have been queued since the last checkpoint.
+        self.done = []  # type: List[tuple]
+        self.error = None  # type: Exception
+
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def put(self, name: str, domain: str, rows: List[list]) -> None:
+        """
+        Queue up complete rows for a scanner's scan of a domain. Scans
+        with no rows at all (e.g. skipped domains) still count as done.
+        """
+        self.queue.put((name, domain, rows))
+
+    def close(self) -> None:
+        """Write out everything queued so far, and stop the writer thread."""
+        self.queue.put(None)
+        self.thread.join()
+        if self.error is not None:
+            raise self.error
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _run(self) -> None:
+        last_flush = last_checkpoint = time.monotonic()
+
+        while True:
+            timeout = max(0.0, self.flush_interval - (time.monotonic() - last_flush))
+            try:
+                item = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                item = ()
+
+            if item is None:
+                break
+
+            if item:
+                name, domain, rows = item
+                self.batches[name].extend(rows)
+                if self.journal is not None:
+                    self.done.append((name, domain))
+                if len(self.batches[name]) >= self.batch_size:
+                    self._write(name)
+
+            now = time.monotonic()
+            if (self.journal is not None) and \
+                    (now - last_checkpoint) >= self.checkpoint_interval:
+                self._checkpoint()
+                last_flush = last_checkpoint = time.monotonic()
+            elif (now - last_flush) >= self.flush_interval:
+                self._flush()
+                last_flush = time.monotonic()
+
+        if self.journal is not None:
+            self._checkpoint()
+        else:
+            self._flush()
+
+    def _write(self, name: str) -> None:
+        batch = self.batches[name]
+        if not batch:
+            return
+        self.batches[name] = []
+
+        # After an error, keep draining the queue so workers don't block,
+        # but don't write anything else. close() raises the error.
+        if self.error is not None:
+            return
+
+        try:
+            self.handles[name]['sink'].writerows(batch)
+            self.dirty.add(name)
+        except Exception as exception:
+            logging.error("[%s] Error writing results: %s" % (name, exception))
+            self.error = exception
+
+    def _flush(self) -> None:
+        for name in self.batches:
+            self._write(name)
+
+        for name in self.dirty:
+            try:
+                self.handles[name]['sink'].flush()
+            except Exception as exception:
+                logging.error("[%s] Error writing results: %s" % (name, exception))
+                self.error = self.error or exception
+        self.dirty = set()
+
+    # Sync everything written so far to disk, then journal it as done.
+    def _checkpoint(self) -> None:
+        self._flush()
+        if self.error is not None:
+            return
+
+        try:
+            offsets = {}
+            for name, handle in self.handles.items():
+                offsets[name] = handle['sink'].checkpoint()
+            self.journal.record(self.done, offsets)
+        except Exception as exception:
+            logging.error("Error checkpointing results: %s" % exception)
+            self.error = exception
+        self.done = []
+
+
+class ResultGate:
+    """
+    Pass each task's rows on to ``results`` (e.g. a ResultWriter) just
+    once, from whichever gets there first: the task itself, or the
+    scheduler giving up on it after a timeout. A scan that was given up on
+    can't be stopped if it's running in a thread, and its rows are dropped
+    if it ever finishes.
+
+    Each task has to be started with ``start`` before its rows are let
+    through.
+    """
+
+    def __init__(self, results) -> None:
+        self.results = results
+        self.lock = threading.Lock()
+        self.running = set()  # type: set
+
+    def start(self, name: str, domain: str) -> None:
+        with self.lock:
+            self.running.add((name, domain))
+
+    def put(self, name: str, domain: str, rows: List[list]) -> bool:
+        """Pass on the rows, unless some were already. Returns which."""
+        with self.lock:
+            if (name, domain) not in self.running:
+                return False
+            self.running.discard((name, domain))
+        self.results.put(name, domain, rows)
+        return True